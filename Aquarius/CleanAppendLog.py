@@ -18,20 +18,16 @@ import sys
 import pymssql
 import pymysql
 
+import aq_cleanup
+import aq_event_monitor
+import aq_event_archive
 from aq_dbinfo import aq_username, aqdb_host, aqdb_name, aqdb_user, aqdb_password, \
     dh_dbhost, dh_dbname, dh_dbuser, dh_dbpswd
 
 __author__ = 'Sara Geleskie Damiano'
 __contact__ = 'sdamiano@stroudcenter.org'
 
-# Find the date/time the script was started:
-start_datetime_utc = datetime.datetime.now(pytz.utc)
 eastern_local_time = pytz.timezone('US/Eastern')
-start_datetime_loc = start_datetime_utc.astimezone(eastern_local_time)
-usgs_older_than = start_datetime_loc - datetime.timedelta(days=14)
-notification1_older_than = start_datetime_loc - datetime.timedelta(hours=6)
-notification2_older_than = start_datetime_loc - datetime.timedelta(hours=72)
-processing_older_than = start_datetime_loc - datetime.timedelta(days=90)
 
 # Get the path and directory of this script:
 script_name_with_path = os.path.realpath(__file__)
@@ -43,303 +39,258 @@ parser.add_argument('--debug', action='store_true',
                     help='Turn debugging on')
 parser.add_argument('--nolog', action='store_false',
                     help='Turn logging off')
-# Read the command line options, if run from the command line
-if sys.stdin.isatty():
-    debug = parser.parse_args().debug
-    Log_to_file = parser.parse_args().nolog
-else:
-    debug = True
-    Log_to_file = True
-
-if debug:
-    print "Now running script: %s" % script_name_with_path
-    print "Script started at %s" % start_datetime_loc
-
-
-if Log_to_file:
-    # Open up a text file to log to
-    logfile = script_directory + "\AppendLogs\CleaningLog_" + start_datetime_loc.strftime("%Y%m%d") + ".txt"
-    if debug:
-        print "Log being written to: %s" % logfile
-    text_file = open(logfile, "a+")
-    text_file.write("***********************************************************************************************\n")
-    text_file.write("Script: %s \n" % script_name_with_path)
-    text_file.write("***********************************************************************************************\n")
-    text_file.write("\n")
-    text_file.write("Script started at %s \n \n" % start_datetime_loc)
-else:
-    text_file = ""
-
-
-def get_event_log_length():
+parser.add_argument('--batchsize', action='store', type=int, default=5000,
+                    help='Sets the maximum number of rows deleted in a single transaction')
+parser.add_argument('--pause', action='store', type=float, default=0.5,
+                    help='Sets the number of seconds to wait between batches of deletes')
+parser.add_argument('--timebudget', action='store', type=float, default=None,
+                    help='Sets the number of seconds the clean-up may run for, after which it stops')
+parser.add_argument('--whenneeded', action='store_true',
+                    help='Only clean up if the event log is bigger or growing faster than the limits')
+parser.add_argument('--maxrows', action='store', type=int, default=None,
+                    help='Sets the number of rows in the event log above which it is cleaned up')
+parser.add_argument('--maxgrowth', action='store', type=float, default=None,
+                    help='Sets the growth of the event log, in rows per hour, above which it is cleaned up')
+parser.add_argument('--countnew', action='store_true',
+                    help='Counts the new events by retention rule before cleaning; scans aq_event_log_ by eventTime_')
+parser.add_argument('--noarchive', action='store_false',
+                    help='Turn off archiving the deleted events to local files')
+batch_size = 5000  # Sets the maximum number of rows deleted in a single transaction
+pause_seconds = 0.5  # Sets the number of seconds to wait between batches of deletes
+time_budget = None  # Sets the number of seconds the clean-up may run for, use None for no limit
+only_when_needed = False  # Only cleans up when the event log is over the row or growth limits
+max_rows = None  # Sets the number of rows in the event log above which it is cleaned up, use None for no limit
+max_growth = None  # Sets the growth of the event log in rows per hour above which it is cleaned up, None for no limit
+count_new_events = False  # Counts the new events by retention rule before cleaning, which reads aq_event_log_ itself
+archive_events = True  # Writes every deleted event to gzipped daily files in the EventArchive directory
+
+
+def get_event_log_length(monitor, retention_rules, phase, count_new_events=False):
     """
-    :return: this returns the number of records in the aq_event_log_ table
+    :return: this returns the number of records in the aq_event_log_ table, and records it with the monitor
     when this table becomes too long, the whole system bogs down.
+    The count comes from the partition statistics, so it takes no longer however long the table gets.
     """
     conn_f = pymssql.connect(server=aqdb_host, user=aqdb_user, password=aqdb_password, database=aqdb_name)
-    cur_f = conn_f.cursor()
-
-    cur_f.execute("""
-        SELECT
-            COUNT(*)
-        FROM
-            aq_event_log_
-    """)
-
-    events = cur_f.fetchall()[0]
-
-    cur_f.close()     # close the database cursor
-    conn_f.close()    # close the database connection
-
-    return events
-
-
-# Check the length of the event log prior to cleaning
-pre_cleaning = get_event_log_length()
-if debug:
-    print "There were %s records in aq_event_log_ prior to cleaning" % pre_cleaning
-if Log_to_file:
-    text_file.write("There were %s records in aq_event_log_ prior to cleaning \n" % pre_cleaning)
-
-
-# Look for the aop id of dataseries that are being appended by the API from dreamhost
-conn = pymysql.connect(host=dh_dbhost, db=dh_dbname, user=dh_dbuser, passwd=dh_dbpswd)
-cur = conn.cursor()
-
-cur.execute("""
-    SELECT DISTINCT
-        AQTimeSeriesID
-    FROM
-        Series_for_midStream
-    WHERE
-        AQTimeSeriesID != 0
-    ;
-""")
-
-AqSeries = cur.fetchall()
-
-cur.close()     # close the database cursor
-conn.close()    # close the database connection
-
-
-# Now delete events from the SQL table
-conn = pymssql.connect(server=aqdb_host, user=aqdb_user, password=aqdb_password, database=aqdb_name)
-cur = conn.cursor()
-
-# Delete all events directly run by the API user
-cur.execute("""
-    DELETE
-    FROM
-        aq_event_log_
-    WHERE
-        userID_ = '%s'
-    ;
-""" % aq_username)
-
-if debug:
-    print "%s rows were deleted from aq_event_log_ that were added by the API user" % cur.rowcount
-if Log_to_file:
-    text_file.write("%s rows were deleted from aq_event_log_ that were added by the API user \n" % cur.rowcount)
-
-conn.commit()
-
-
-# Delete event run by the system on the time series designated to receive streaming data.
-for AQTimeSeriesID in AqSeries:
-    cur.execute("""
-        DELETE
-        FROM
-            aq_event_log_
-        WHERE
-            eventOrigin_ = '%s' AND eventType_ = 'Automated Processing' AND userID_ = 'SYSTEM@AQUARIUS'
-        ;
-    """ % AQTimeSeriesID)
-
-    if debug and cur.rowcount > 0:
-        print "%s row were deleted from aq_event_log_ that were automated processing on AOP %s" %\
-              (cur.rowcount, AQTimeSeriesID)
-    if Log_to_file and cur.rowcount > 0:
-        text_file.write("%s row were deleted from aq_event_log_ that were automated processing on AOP %s \n" %
-                        (cur.rowcount, AQTimeSeriesID))
-
-    conn.commit()
-
-
-# Delete all events that are old USGS sync notes
-cur.execute("""
-    DELETE
-    FROM
-        aq_event_log_
-    WHERE
-        taskName_ = 'Default.RESTFul_SyncJob' AND eventTime_ < '%s'
-    ;
-""" % usgs_older_than.strftime('%Y-%m-%dT%H:%M:%S'))
-if debug:
-    print "%s rows were deleted from aq_event_log_ that were older sync messages with USGS Rest Services" % cur.rowcount
-if Log_to_file:
-    text_file.write("%s rows were deleted from aq_event_log_ that were older sync messages with USGS Rest Services\n" 
-                    % cur.rowcount)
-conn.commit()
-cur.execute("""
-    DELETE
-    FROM
-        aq_event_log_
-    WHERE
-        taskName_ = 'Default.USGSOGC_SyncJob' AND eventTime_ < '%s'
-    ;
-""" % usgs_older_than.strftime('%Y-%m-%dT%H:%M:%S'))
-if debug:
-    print "%s rows were deleted from aq_event_log_ that were older sync messages with USGS OGC" % cur.rowcount
-if Log_to_file:
-    text_file.write("%s rows were deleted from aq_event_log_ that were older sync messages with USGS OGC\n"
-                    % cur.rowcount)
-conn.commit()
-cur.execute("""
-    DELETE
-    FROM
-        aq_event_log_
-    WHERE
-        taskName_ = 'Default.USGSWaterServices_SyncJob' AND eventTime_ < '%s'
-    ;
-""" % usgs_older_than.strftime('%Y-%m-%dT%H:%M:%S'))
-if debug:
-    print "%s rows were deleted from aq_event_log_ that were older sync messages with USGS Water Services"\
-          % cur.rowcount
-if Log_to_file:
-    text_file.write("%s rows were deleted from aq_event_log_ that were older sync messages with USGS Water Services\n"
-                    % cur.rowcount)
-conn.commit()
-cur.execute("""
-    DELETE
-    FROM
-        aq_event_log_
-    WHERE
-        taskName_ = 'Default.EventLogCleanup' AND eventTime_ < '%s'
-    ;
-""" % usgs_older_than.strftime('%Y-%m-%dT%H:%M:%S'))
-if debug:
-    print "%s rows were deleted from aq_event_log_ that were automatic event log clean-up notices"\
-          % cur.rowcount
-if Log_to_file:
-    text_file.write("%s rows were deleted from aq_event_log_ that were automatic event log clean-up notices\n"
-                    % cur.rowcount)
-conn.commit()
-cur.execute("""
-    DELETE
-    FROM
-        aq_event_log_
-    WHERE
-        taskName_ = 'Default.OutgoingNotificationCleanup' AND eventTime_ < '%s'
-    ;
-""" % usgs_older_than.strftime('%Y-%m-%dT%H:%M:%S'))
-if debug:
-    print "%s rows were deleted from aq_event_log_ that were automatic notification clean-up notices"\
-          % cur.rowcount
-if Log_to_file:
-    text_file.write("%s rows were deleted from aq_event_log_ that were automatic notification clean-up notices\n"
-                    % cur.rowcount)
-conn.commit()
-
-
-# Delete all events that are old notifications
-cur.execute("""
-    DELETE
-    FROM
-        aq_event_log_
-    WHERE
-        eventType_ = 'INFO' AND taskName_ LIKE 'Notification.%%.Ruleset.%%' AND eventTime_ < '%s'
-    ;
-""" % notification1_older_than.strftime('%Y-%m-%dT%H:%M:%S'))
-if debug:
-    print "%s rows were deleted from aq_event_log_ that were notifications jobs older than 6 hours" % cur.rowcount
-if Log_to_file:
-    text_file.write("%s rows were deleted from aq_event_log_ that were notifications older than 72 hours\n"
-                    % cur.rowcount)
-conn.commit()
-cur.execute("""
-    DELETE
-    FROM
-        aq_event_log_
-    WHERE
-        eventType_ = 'Notification Event' AND eventTime_ < '%s'
-    ;
-""" % notification2_older_than.strftime('%Y-%m-%dT%H:%M:%S'))
-if debug:
-    print "%s rows were deleted from aq_event_log_ that were notifications older than 72 hours" % cur.rowcount
-if Log_to_file:
-    text_file.write("%s rows were deleted from aq_event_log_ that were notifications older than 72 hours\n"
-                    % cur.rowcount)
-conn.commit()
-cur.execute("""
-    DELETE
-    FROM
-        aq_event_log_
-    WHERE
-        message_ = '0 data points were appended.' AND eventTime_ < '%s'
-    ;
-""" % notification2_older_than.strftime('%Y-%m-%dT%H:%M:%S'))
-if debug:
-    print "%s rows were deleted from aq_event_log_ that were empty appends" % cur.rowcount
-if Log_to_file:
-    text_file.write("%s rows were deleted from aq_event_log_ that were empty appends\n"
-                    % cur.rowcount)
-conn.commit()
-cur.execute("""
-    DELETE
-    FROM
-        aq_event_log_
-    WHERE
-        message_ = 'No data points have been appended.' AND eventTime_ < '%s'
-    ;
-""" % notification2_older_than.strftime('%Y-%m-%dT%H:%M:%S'))
-if debug:
-    print "%s more rows were deleted from aq_event_log_ that were empty appends" % cur.rowcount
-if Log_to_file:
-    text_file.write("%s more rows were deleted from aq_event_log_ that were empty appends\n"
-                    % cur.rowcount)
-conn.commit()
-
-
-# Delete older automated processing messages
-cur.execute("""
-    DELETE
-    FROM
-        aq_event_log_
-    WHERE
-        eventType_ = 'Automated Processing' AND userID_ = 'SYSTEM@AQUARIUS' AND eventTime_ < '%s'
-    ;
-""" % processing_older_than.strftime('%Y-%m-%dT%H:%M:%S'))
-if debug:
-    print "%s rows were deleted from aq_event_log_ that were old automated processing messages" % cur.rowcount
-if Log_to_file:
-    text_file.write("%s rows were deleted from aq_event_log_ that were old automated processing messages\n"
-                    % cur.rowcount)
-conn.commit()
-
-cur.close()     # close the database cursor
-conn.close()    # close the database connection
-
-
-# Check the length of the table again after cleaning.
-post_cleaning = get_event_log_length()
-if debug:
-    print "There are %s records in aq_event_log_ after cleaning" % post_cleaning
-if Log_to_file:
-    text_file.write("There are %s records in aq_event_log_ after cleaning \n" % post_cleaning)
-
-# Find the date/time the script finished:
-end_datetime_utc = datetime.datetime.now(pytz.utc)
-end_datetime_loc = end_datetime_utc.astimezone(eastern_local_time)
-runtime = end_datetime_utc - start_datetime_utc
-
-# Close out the text file
-if debug:
-    print "Script completed at %s" % end_datetime_loc
-    print "Total time for script: %s" % runtime
-if Log_to_file:
-    text_file.write("\n")
-    text_file.write("Script completed at %s \n" % end_datetime_loc)
-    text_file.write("Total time for script: %s \n" % runtime)
-    text_file.write("***********************************************************************************************\n")
-    text_file.write("\n \n")
-    text_file.close()
+    try:
+        cur_f = conn_f.cursor()
+
+        events = aq_event_monitor.get_event_log_row_count(cur_f)
+
+        new_events = None
+        previous = monitor.last_sample()
+        if count_new_events and previous is not None:
+            since = datetime.datetime.fromisoformat(previous['sampled_at']).astimezone(eastern_local_time)
+            new_events = aq_event_monitor.count_new_events_by_category(
+                cur_f, retention_rules, since.strftime(aq_cleanup.event_time_format))
+
+        cur_f.close()     # close the database cursor
+    finally:
+        conn_f.close()    # close the database connection
+
+    return monitor.record(events, datetime.datetime.now(pytz.utc), phase, new_events), previous
+
+
+def log_deletion(stats, description, text_file, debug=False, Log_to_file=True):
+    """
+    Writes the number of rows a delete removed, and how fast, to the screen and the log.
+    """
+    message = "%s rows were deleted from aq_event_log_ that were %s (%s batches, %.0f rows/sec)" % \
+              (stats['rows_deleted'], description, stats['batches'], stats['rows_per_sec'])
+    if stats['rows_archived'] > 0:
+        message += ", archived first"
+    if not stats['complete']:
+        message += " - stopped at the time budget, more remain"
+    if debug:
+        print(message)
+    if Log_to_file:
+        text_file.write(message + " \n")
+
+
+def clean_append_log(batch_size=5000, pause_seconds=0.5, time_budget=None, only_when_needed=False, max_rows=None,
+                     max_growth=None, count_new_events=False, archive_events=True, debug=False, Log_to_file=True):
+    """
+    Cleans the aq_event_log_ table once.
+    :param batch_size: The maximum number of rows deleted in a single transaction
+    :param pause_seconds: The number of seconds to wait between batches of deletes
+    :param time_budget: The number of seconds the clean-up may run for, None for no limit
+    :param only_when_needed: Only cleans up when the event log is over the row or growth limits
+    :param max_rows: The number of rows in the event log above which it is cleaned up, None for no limit
+    :param max_growth: The growth of the event log in rows per hour above which it is cleaned up, None for no limit
+    :param count_new_events: Counts the events logged since the last sample by retention rule.  Unlike the total,
+        which comes from the partition statistics, this reads aq_event_log_ itself, so it is off by default.
+    :param archive_events: Writes every deleted event to gzipped daily files in the EventArchive directory
+    :param debug: A boolean for whether extra print commands apply
+    :param Log_to_file: A boolean for whether a log is written
+    :return: Why the event log was cleaned, or None if it wasn't
+    """
+    # Find the date/time the script was started:
+    start_datetime_utc = datetime.datetime.now(pytz.utc)
+    start_datetime_loc = start_datetime_utc.astimezone(eastern_local_time)
+    # The events to clean out, and how old they have to be - see aq_cleanup.retention_rules
+    RetentionRules = aq_cleanup.retention_rules(aq_username)
+
+    if debug:
+        print("Now running script: %s" % script_name_with_path)
+        print("Script started at %s" % start_datetime_loc)
+
+    if Log_to_file:
+        # Open up a text file to log to
+        logfile = script_directory + "\\AppendLogs\\CleaningLog_" + start_datetime_loc.strftime("%Y%m%d") + ".txt"
+        if debug:
+            print("Log being written to: %s" % logfile)
+        text_file = open(logfile, "a+")
+        text_file.write("*******************************************************************************************\n")
+        text_file.write("Script: %s \n" % script_name_with_path)
+        text_file.write("*******************************************************************************************\n")
+        text_file.write("\n")
+        text_file.write("Script started at %s \n \n" % start_datetime_loc)
+    else:
+        text_file = ""
+
+    try:
+        # The size of the event log is sampled before and after every run, to follow how fast it grows
+        monitor = aq_event_monitor.EventLogMonitor(os.path.join(script_directory, 'EventLogGrowth.jsonl'),
+                                                   max_rows=max_rows, max_growth_per_hour=max_growth, debug=debug)
+
+        # Check the length of the event log prior to cleaning
+        pre_cleaning, previous_sample = get_event_log_length(monitor, RetentionRules, 'before cleaning',
+                                                             count_new_events=count_new_events)
+        if debug:
+            print("There were %s records in aq_event_log_ prior to cleaning" % pre_cleaning['total_rows'])
+        if Log_to_file:
+            text_file.write("There were %s records in aq_event_log_ prior to cleaning \n" % pre_cleaning['total_rows'])
+        for Category, NewEvents in sorted((pre_cleaning['new_events'] or {}).items()):
+            if debug:
+                print("%s new %s events since the last check" % (NewEvents, Category))
+            if Log_to_file:
+                text_file.write("%s new %s events since the last check \n" % (NewEvents, Category))
+
+        # Decide whether to clean up at all
+        if only_when_needed:
+            CleanupReason = monitor.cleanup_reason(pre_cleaning, previous_sample)
+        else:
+            CleanupReason = "run on schedule"
+        if debug:
+            print("Cleaning up: %s" % CleanupReason if CleanupReason
+                  else "The event log is within its limits, not cleaning")
+        if Log_to_file:
+            text_file.write(("Cleaning up: %s \n" % CleanupReason) if CleanupReason
+                            else "The event log is within its limits, not cleaning \n")
+
+        if CleanupReason is not None:
+            # Look for the aop id of dataseries that are being appended by the API from dreamhost
+            conn = pymysql.connect(host=dh_dbhost, db=dh_dbname, user=dh_dbuser, passwd=dh_dbpswd)
+            try:
+                cur = conn.cursor()
+
+                cur.execute("""
+                    SELECT DISTINCT
+                        AQTimeSeriesID
+                    FROM
+                        Series_for_midStream
+                    WHERE
+                        AQTimeSeriesID != 0
+                    ;
+                """)
+
+                AqSeries = cur.fetchall()
+
+                cur.close()     # close the database cursor
+            finally:
+                conn.close()    # close the database connection
+
+            # Now delete events from the SQL table
+            # Every delete is run in small batches, each committed on its own, so the clean-up doesn't lock out Aquarius
+            conn = pymssql.connect(server=aqdb_host, user=aqdb_user, password=aqdb_password, database=aqdb_name)
+            budget = aq_cleanup.TimeBudget(time_budget)
+            # Every row is written to the archive before the batch that deletes it is committed
+            if archive_events:
+                archive = aq_event_archive.EventArchive(os.path.join(script_directory, 'EventArchive'), debug=debug)
+            else:
+                archive = None
+
+            try:
+                # Delete event run by the system on the time series designated to receive streaming data.
+                # All of the series are deleted in one pass over aq_event_log_, rather than one pass per series.
+                AutomatedProcessingStats, AutomatedProcessingDeleted = aq_cleanup.delete_automated_processing(
+                    conn, [row[0] for row in AqSeries], batch_size=batch_size, pause_seconds=pause_seconds,
+                    budget=budget, archive=archive, debug=debug)
+                log_deletion(AutomatedProcessingStats, "automated processing on streaming series", text_file, debug,
+                             Log_to_file)
+
+                for AQTimeSeriesID, RowsDeleted in sorted(AutomatedProcessingDeleted.items()):
+                    if debug:
+                        print("%s row were deleted from aq_event_log_ that were automated processing on AOP %s" %
+                              (RowsDeleted, AQTimeSeriesID))
+                    if Log_to_file:
+                        text_file.write("%s row were deleted from aq_event_log_ that were automated processing on AOP "
+                                        "%s \n" % (RowsDeleted, AQTimeSeriesID))
+
+                # Delete everything else the retention rules match, in as few passes over aq_event_log_ as the rules
+                # allow
+                for RuleStats in aq_cleanup.run_retention_rules(conn, RetentionRules, start_datetime_loc,
+                                                                batch_size=batch_size, pause_seconds=pause_seconds,
+                                                                budget=budget, archive=archive, debug=debug):
+                    log_deletion(RuleStats, RuleStats['description'], text_file, debug, Log_to_file)
+            finally:
+                conn.close()    # close the database connection
+                # Close the archive even if a batch failed, so every file gets its gzip end-of-stream marker
+                if archive is not None:
+                    archive.close()
+
+            if archive is not None:
+                if debug:
+                    print("%s deleted rows were archived to %s at %.0f rows/sec" %
+                          (archive.rows_archived, archive.archive_directory, archive.rows_per_sec()))
+                if Log_to_file:
+                    text_file.write("%s deleted rows were archived to %s at %.0f rows/sec \n" %
+                                    (archive.rows_archived, archive.archive_directory, archive.rows_per_sec()))
+
+            if budget.expired():
+                if debug:
+                    print("The clean-up stopped after using its %s second time budget" % time_budget)
+                if Log_to_file:
+                    text_file.write("The clean-up stopped after using its %s second time budget \n" % time_budget)
+
+            # Check the length of the table again after cleaning.
+            post_cleaning, _ = get_event_log_length(monitor, RetentionRules, 'after cleaning')
+            if debug:
+                print("There are %s records in aq_event_log_ after cleaning" % post_cleaning['total_rows'])
+            if Log_to_file:
+                text_file.write("There are %s records in aq_event_log_ after cleaning \n" % post_cleaning['total_rows'])
+    finally:
+        # Find the date/time the script finished:
+        end_datetime_utc = datetime.datetime.now(pytz.utc)
+        end_datetime_loc = end_datetime_utc.astimezone(eastern_local_time)
+        runtime = end_datetime_utc - start_datetime_utc
+
+        # Close out the text file, even if the clean-up failed
+        if debug:
+            print("Script completed at %s" % end_datetime_loc)
+            print("Total time for script: %s" % runtime)
+        if Log_to_file:
+            text_file.write("\n")
+            text_file.write("Script completed at %s \n" % end_datetime_loc)
+            text_file.write("Total time for script: %s \n" % runtime)
+            text_file.write("*************************************************************************************"
+                            "******\n")
+            text_file.write("\n \n")
+            text_file.close()
+
+    return CleanupReason
+
+
+if __name__ == '__main__':
+    # Read the command line options, if run from the command line
+    if sys.stdin.isatty():
+        args = parser.parse_args()
+        clean_append_log(batch_size=args.batchsize, pause_seconds=args.pause, time_budget=args.timebudget,
+                         only_when_needed=args.whenneeded, max_rows=args.maxrows, max_growth=args.maxgrowth,
+                         count_new_events=args.countnew, archive_events=args.noarchive, debug=args.debug,
+                         Log_to_file=args.nolog)
+    else:
+        clean_append_log(batch_size=batch_size, pause_seconds=pause_seconds, time_budget=time_budget,
+                         only_when_needed=only_when_needed, max_rows=max_rows, max_growth=max_growth,
+                         count_new_events=count_new_events, archive_events=archive_events, debug=True,
+                         Log_to_file=True)
@@ -11,14 +11,13 @@ __contact__ = 'sdamiano@stroudcenter.org'
 
 import pymssql
 import pandas as pd
-import numpy as np
-import xml.etree.ElementTree as ET
 import os
 import datetime
 import pytz
 import argparse
 import sys
 
+import aq_metadata
 from aq_dbinfo import aqdb_host, aqdb_name, aqdb_user, aqdb_password
 
 __author__ = 'Sara Geleskie Damiano'
@@ -29,444 +28,152 @@ pd.set_option('max_colwidth', 500)
 pd.set_option('display.max_columns', 0)
 
 
-# Find the date/time the script was started:
-start_datetime_utc = datetime.datetime.now(pytz.utc)
-eastern_local_time = pytz.timezone('US/Eastern')
-start_datetime_loc = start_datetime_utc.astimezone(eastern_local_time)
-
-# Get the path and directory of this script:
-script_name_with_path = os.path.realpath(__file__)
-script_directory = os.path.dirname(os.path.realpath(__file__))
-
 # Set up a parser for command line options
 parser = argparse.ArgumentParser(description='This script cleans excess metadata from the Aquarius database.')
 parser.add_argument('--debug', action='store_true',
                     help='Turn debugging on')
 parser.add_argument('--nolog', action='store_false',
                     help='Turn logging off')
-
-# Read the command line options, if run from the command line
-if sys.stdin.isatty():
-    debug = parser.parse_args().debug
-    Log_to_file = parser.parse_args().nolog
-else:
-    debug = True
-    Log_to_file = True
-
-if debug:
-    print "Now running script: %s" % script_name_with_path
-    print "Script started at %s" % start_datetime_loc
-
-
-if Log_to_file:
-    # Open up a text file to log to
-    logfile = script_directory + "\AppendLogs\CleaningLog_" + start_datetime_loc.strftime("%Y%m%d") + ".txt"
-    if debug:
-        print "Log being written to: %s" % logfile
-    text_file = open(logfile, "a+")
-    text_file.write("***********************************************************************************************\n")
-    text_file.write("Script: %s \n" % script_name_with_path)
-    text_file.write("***********************************************************************************************\n")
-    text_file.write("\n")
-    text_file.write("Script started at %s \n \n" % start_datetime_loc)
-else:
-    text_file = ""
-
-# Set up the connection directly to the Aquarius SQL Database
-conn = pymssql.connect(server=aqdb_host, user=aqdb_user, password=aqdb_password, database=aqdb_name)
-cur = conn.cursor()
-
-if debug:
-    print "Connected to server."
-
-# Set a where clause for the SQL query
-
-# where_clause = """
-# WHERE
-# TimeSeriesID in (SELECT
-# AQDataID_
-# FROM AQAtom_TimeSeries_
-# WHERE AQParentID_ = (SELECT
-# LocationID
-# FROM Location
-# WHERE Identifier = 'Well042'))
-# """
-
-# where_clause = """
-# WHERE
-# TimeSeriesID = 24696758
-# """
-
-where_clause = ""
-
-# Read TimeSeries information into pandas
-ts_df_query = """
-SELECT ts.AQDataID_  as TimeSeriesID, 
-       ts.label_ as TS_label,
-       Location.Identifier as LocationCode,
-       ts.parameterType_ as TS_Parm_Code,
-       parameter.displayid as Parameter
-FROM AQAtom_TimeSeries_ as ts
-LEFT JOIN Location
-ON ts.AQParentID_ = Location.LocationID
-LEFT JOIN parameter 
-ON ts.parameterType_ = parameter.parameterid
-"""
-
-if debug:
-    print "Reading TimeSeries information into pandas"
-    print ts_df_query
-
-ts_df = pd.read_sql(ts_df_query, conn)
-ts_df['TS_Text_ID'] = ts_df['Parameter'] + '.' + ts_df['TS_label'] + '@' + ts_df['LocationCode']
-
-
-# Read the metadata table into pandas
-if debug:
-    print "Reading the metadata table into pandas using query:"
-    print "SELECT * FROM TimeSeriesMeta" + where_clause
-
-meta_df = pd.read_sql("SELECT * FROM TimeSeriesMeta" + where_clause, conn)
-
-# Expand the XML "Blob" of sub-meta-data into columns of its own.
-if debug:
-    print 'Expanding the XML "Blobs"'
-
-meta_df['blob_dict'] = meta_df['XmlBlob'].apply(lambda x: ET.fromstring(x).attrib)
-meta_expand = pd.concat([meta_df, pd.DataFrame((d for idx, d in meta_df['blob_dict'].iteritems()))], axis=1)
-full_df = meta_expand.merge(ts_df, on='TimeSeriesID')
-oneblob = ET.fromstring(meta_df.loc[1, 'XmlBlob'])
-
-# Clean up Data Types
-if debug:
-    print 'Cleaning up Data Types'
-
-if full_df['StartTime'].dtype == np.dtype('datetime64[ns]'):
-    full_df['startTime_dt'] = pd.to_datetime(full_df['startTime'], errors='ignore', format='%Y-%m-%d %H:%M:%S.%f')
-else:
-    full_df['startTime'] = full_df['startTime'].fillna(value='1899-12-30 00:00:00.000')
-    full_df['startTime_dt'] = full_df['startTime'].apply(lambda x: pd.datetime.strptime(str(x), '%Y-%m-%d %H:%M:%S.%f'))
-if full_df['EndTime'].dtype == np.dtype('datetime64[ns]'):
-    full_df['endTime_dt'] = pd.to_datetime(full_df['endTime'], errors='ignore', format='%Y-%m-%d %H:%M:%S.%f')
-else:
-    full_df['endTime'] = full_df['endTime'].fillna(value='4637-11-26 00:00:00.000')
-    full_df['endTime_dt'] = full_df['endTime'].apply(lambda x: pd.datetime.strptime(str(x), '%Y-%m-%d %H:%M:%S.%f'))
-full_df['dateApplied'] = pd.to_numeric(full_df['dateApplied'])
-full_df['dateAppliedTZBias'] = pd.to_numeric(full_df['dateAppliedTZBias'])
-if 'modifiedPoints' in full_df.columns:
-    full_df['modifiedPoints'] = pd.to_numeric(full_df['modifiedPoints'])
-
-# Sort the list
-if debug:
-    print 'Sorting'
-
-full_df.sort_values(by=['TimeSeriesID', 'StartTime', 'TypeName', 'DateApplied', 'DateModified'], inplace=True)
-full_df.fillna(value=-9999, inplace=True)
-
-if debug:
-    print "There are %s Total Metadata Records" % len(full_df)
-if Log_to_file:
-    text_file.write("There are %s Total Metadata Records\n" % len(full_df))
-
-# These are columns that are unique for every meta-data row
-unique_cols = ['MetaID', 'XmlBlob', 'blob_dict', 'AQMetadataID', 'StartTime', 'startTime', 'startTime_dt',
-               'EndTime', 'endTime', 'endTime_dt', 'LastModifiedTime', 'DateModified']
-non_unique_cols = full_df.columns.values.tolist()
-for item in unique_cols:
-    non_unique_cols.remove(item)
-
-
-# Update metadata for ranges that changed
-if debug:
-    print 'De-dupp-ing and aggregating'
-dedupped = full_df.drop_duplicates(subset=non_unique_cols, keep='last')
-
-full_df_grouped = full_df.groupby(non_unique_cols)
-
-aggregates = pd.DataFrame({'count': full_df_grouped.size(),
-                           'min_start': full_df_grouped['StartTime'].min(),
-                           'max_end': full_df_grouped['EndTime'].max()
-                           }).reset_index()
-
-dedupped_aggr = pd.merge(dedupped, aggregates, on=non_unique_cols)
-values_to_update = dedupped_aggr[(dedupped_aggr['StartTime'] != dedupped_aggr['min_start']) |
-                                 (dedupped_aggr['EndTime'] != dedupped_aggr['max_end'])].reset_index(drop=True)
-
-# Want to update the ranges of metadata because when data is appended and holes are filled in, it splits the metadata
-# into two separate records around the hole.  This reconnects those records, but it also deletes the information about
-# which files each point came from.
-if len(values_to_update) > 0:
-
-    # Set the minimum time for all the records to the minimum time for the group
-    if values_to_update['min_start'].dtype == np.dtype('datetime64[ns]'):
-        # values_to_update['min_start_str'] = values_to_update['min_start'].dt.strftime('%Y-%m-%d %H:%M:%S.%f').str[:-3]
-        values_to_update['min_start_str_long'] = values_to_update['min_start'].dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+parser.add_argument('--batchsize', action='store', type=int, default=200,
+                    help='Sets the number of time series cleaned in each batch, 0 to clean them all at once')
+parser.add_argument('--workers', action='store', type=int, default=4,
+                    help='Sets the number of processes cleaning batches at the same time')
+parser.add_argument('--incremental', action='store_true',
+                    help='Only clean the time series with metadata modified since the last run')
+parser.add_argument('--serverside', action='store_true',
+                    help='Find duplicate, junk and empty records inside the database and only delete them, without '
+                         'reading the metadata or reconnecting split ranges')
+parser.add_argument('--overlap', action='store', type=float, default=60,
+                    help='Sets the minutes before the last run an incremental run looks back to, to catch metadata '
+                         'committed late')
+
+
+# Everything below runs only when this is the script being run, not in the worker processes that clean the batches
+if __name__ == '__main__':
+    # Find the date/time the script was started:
+    start_datetime_utc = datetime.datetime.now(pytz.utc)
+    eastern_local_time = pytz.timezone('US/Eastern')
+    start_datetime_loc = start_datetime_utc.astimezone(eastern_local_time)
+
+    # Get the path and directory of this script:
+    script_name_with_path = os.path.realpath(__file__)
+    script_directory = os.path.dirname(os.path.realpath(__file__))
+
+    # Read the command line options, if run from the command line
+    batch_size = 200  # Sets the number of time series cleaned in each batch, use None to clean them all at once
+    workers = 4  # Sets the number of processes cleaning batches at the same time
+    incremental = False  # Only cleans the time series with metadata modified since the last run
+    overlap_minutes = 60  # Sets the minutes before the last run an incremental run looks back to
+    server_side = False  # Finds the records to delete inside the database, without reconnecting split ranges
+    if sys.stdin.isatty():
+        debug = parser.parse_args().debug
+        Log_to_file = parser.parse_args().nolog
+        batch_size = parser.parse_args().batchsize
+        workers = parser.parse_args().workers
+        incremental = parser.parse_args().incremental
+        overlap_minutes = parser.parse_args().overlap
+        server_side = parser.parse_args().serverside
     else:
-        values_to_update['min_start_str_long'] = values_to_update['min_start'].apply(
-            lambda x: "%02d-%02d-%02d %02d:%02d:%02d.%03d" %
-            (x.year, x.month, x.day, x.hour, x.minute, x.second, x.microsecond))
-    values_to_update['min_start_str'] = values_to_update['min_start_str_long'].str[0:23]
-    values_to_update['new_blob'] = values_to_update['XmlBlob'].replace(
-        to_replace='(startTime="[0-9-]{10}\s[0-:."]{13})',
-        value='startTime="'+values_to_update['min_start_str']+'"',
-        regex=True)
-
-    # Set the maximum time for all the records to the maximum time for the group
-    if values_to_update['max_end'].dtype == np.dtype('datetime64[ns]'):
-        # values_to_update['max_end_str'] = values_to_update['max_end'].dt.strftime('%Y-%m-%d %H:%M:%S.%f').str[:-3]
-        values_to_update['max_end_str_long'] = values_to_update['max_end'].dt.strftime('%Y-%m-%d %H:%M:%S.%f')
-    else:
-        values_to_update['max_end_str_long'] = values_to_update['max_end'].apply(
-            lambda x: "%02d-%02d-%02d %02d:%02d:%02d.%03d" %
-            (x.year, x.month, x.day, x.hour, x.minute, x.second, x.microsecond))
-    values_to_update['max_end_str'] = values_to_update['max_end_str_long'].str[0:23]
-    values_to_update['new_blob2'] = values_to_update['new_blob'].replace(
-        to_replace='(endTime="[0-9-]{10}\s[0-:."]{13})',
-        value='endTime="'+values_to_update['max_end_str']+'"',
-        regex=True)
-
-    # Escape any single quotes
-    values_to_update['new_blob3'] = values_to_update['new_blob2'].replace(
-        to_replace="'",
-        value="''",
-        regex=True)
+        debug = True
+        Log_to_file = True
 
     if debug:
-        print "Updating %s Records" % len(values_to_update)
-    if Log_to_file:
-        text_file.write("Updating %s Records\n" % len(values_to_update))
-    update_group = values_to_update.groupby(['TimeSeriesID'])
-    for name, group in update_group:
-        if len(group) > 0:
-            if debug:
-                print "    Updating %s Records From TimeSeries # %s (%s)"\
-                      % (len(group), name, group['TS_Text_ID'].iloc[0])
-            if Log_to_file:
-                text_file.write("    Updating %s Records From TimeSeries # %s (%s)\n"
-                                % (len(group), name, group['TS_Text_ID'].iloc[0]))
-            for index, row in group.iterrows():
-                sql_update = """UPDATE TimeSeriesMeta
-                                SET StartTime='%s',
-                                EndTime='%s',
-                                XmlBlob=CONVERT(VARBINARY(max), '%s')
-                                WHERE MetaID='%s';
-                                """ % \
-                      (row['min_start_str'], row['max_end_str'], row['new_blob3'], str(row['MetaID']))
-                if debug:
-                    print "        Using Query: %s" % sql_update
-                cur.execute(sql_update)
-            conn.commit()
-else:
-    if debug:
-        print "No Records to Update"
-    if Log_to_file:
-        text_file.write("No Records to Update\n")
-
-
-# Remove Duplicates from the SQL
-dups = full_df[full_df.duplicated(subset=non_unique_cols, keep='last')]
-if len(dups) > 0:
-    if debug:
-        print "Deleting %s Duplicated Records" % len(dups)
-    if Log_to_file:
-        text_file.write("Deleting %s Duplicated Records\n" % len(dups))
-    # Doing by Group to help avoid overly massive delete statements
-    dups_group = dups.groupby(['TimeSeriesID', 'TypeName'])
-    for name, group in dups_group:
-        if len(group) > 0:
-            try:
-                meta_to_delete_str = str(list(group['MetaID'].values)).replace('UUID(', '').replace(')', '').strip('[]')
-                sql_delete = 'DELETE FROM TimeSeriesMeta WHERE MetaID IN ({0})'.format(meta_to_delete_str)
-                if debug:
-                    print "    Deleting %s Duplicate Records From TimeSeries # %s (%s)"\
-                          % (len(group), name, group['TS_Text_ID'].iloc[0])
-                    print "        Using Query: %s" % sql_delete
-                if Log_to_file:
-                    text_file.write("    Deleting %s Duplicate Records From TimeSeries # %s (%s)\n"
-                                    % (len(group), name, group['TS_Text_ID'].iloc[0]))
-                cur.execute(sql_delete)
-                conn.commit()
-            except:
-                if debug:
-                    print "    Delete Failed For TimeSeries # %s (%s)" % (name, group['TS_Text_ID'].iloc[0])
-                if Log_to_file:
-                    text_file.write("    Delete Failed For TimeSeries # %s (%s)\n"
-                                    % (name, group['TS_Text_ID'].iloc[0]))
-else:
-    if debug:
-        print "No Duplicate Records to Delete"
-    if Log_to_file:
-        text_file.write("No Duplicate Records to Delete\n")
-
-
-# Remove junk notes
-junk_notes = ['Correction was edited', 'Correction was marked as undone', 'Correction was marked as done']
-junk_note_df = full_df[(full_df['TypeName'] == 'NOTE') & (full_df['comment'].isin(junk_notes))]
-if len(junk_note_df) > 0:
-    if debug:
-        print "Deleting %s Junk Notes" % len(junk_note_df)
-    if Log_to_file:
-        text_file.write("Deleting %s Junk Notes\n" % len(junk_note_df))
-    # Doing by Group to help avoid overly massive delete statements
-    junk_note_group = junk_note_df.groupby(['TimeSeriesID'])
-    for name, group in junk_note_group:
-        if len(group) > 0:
-            meta_to_delete_str = str(list(group['MetaID'].values)).replace('UUID(', '').replace(')', '').strip('[]')
-            sql_delete = 'DELETE FROM TimeSeriesMeta WHERE MetaID IN ({0})'.format(meta_to_delete_str)
-            if debug:
-                print "    Deleting %s Junk Notes From TimeSeries # %s (%s)"\
-                      % (len(group), name, group['TS_Text_ID'].iloc[0])
-                print "        Using Query: %s" % sql_delete
-
-            if Log_to_file:
-                text_file.write("    Deleting %s Junk Notes From TimeSeries # %s (%s)\n"
-                                % (len(group), name, group['TS_Text_ID'].iloc[0]))
-            cur.execute(sql_delete)
-            conn.commit()
-else:
-    if debug:
-        print "No Junk Notes to Delete"
-    if Log_to_file:
-        text_file.write("No Junk Notes to Delete\n")
-
-
-# Remove empty approval codes
-empty_apr_code_df = full_df[(full_df['TypeName'] == 'APPROVALCODE') & (full_df['code'] == '-1') & (full_df['comment'] == '')]
-if len(empty_apr_code_df) > 0:
-    if debug:
-        print "Deleting %s Empty Approval Code Lines" % len(empty_apr_code_df)
-    if Log_to_file:
-        text_file.write("Deleting %s Empty Approval Code Lines\n" % len(empty_apr_code_df))
-    # Doing by Group to help avoid overly massive delete statements
-    junk_note_group = empty_apr_code_df.groupby(['TimeSeriesID'])
-    for name, group in junk_note_group:
-        if len(group) > 0:
-            meta_to_delete_str = str(list(group['MetaID'].values)).replace('UUID(', '').replace(')', '').strip('[]')
-            sql_delete = 'DELETE FROM TimeSeriesMeta WHERE MetaID IN ({0})'.format(meta_to_delete_str)
-            if debug:
-                print "    Deleting %s Empty Approval Code Lines From TimeSeries # %s (%s)"\
-                      % (len(group), name, group['TS_Text_ID'].iloc[0])
-                print "        Using Query: %s" % sql_delete
+        print("Now running script: %s" % script_name_with_path)
+        print("Script started at %s" % start_datetime_loc)
 
-            if Log_to_file:
-                text_file.write("    Deleting %s Empty Approval Code Lines From TimeSeries # %s (%s)\n"
-                                % (len(group), name, group['TS_Text_ID'].iloc[0]))
-            cur.execute(sql_delete)
-            conn.commit()
-else:
-    if debug:
-        print "No Empty Approval Code Lines to Delete"
     if Log_to_file:
-        text_file.write("No Empty Approval Code Lines to Delete\n")
-
+        # Open up a text file to log to
+        logfile = script_directory + "\\AppendLogs\\CleaningLog_" + start_datetime_loc.strftime("%Y%m%d") + ".txt"
+        if debug:
+            print("Log being written to: %s" % logfile)
+        text_file = open(logfile, "a+")
+        text_file.write("***********************************************************************************************\n")
+        text_file.write("Script: %s \n" % script_name_with_path)
+        text_file.write("***********************************************************************************************\n")
+        text_file.write("\n")
+        text_file.write("Script started at %s \n \n" % start_datetime_loc)
+    else:
+        text_file = ""
 
-# Remove empty data grades
-empty_data_grade_df = full_df[(full_df['TypeName'] == 'DATAGRADE') & (full_df['value'] == '-1.000') & (full_df['comment'] == '')]
-if len(empty_data_grade_df) > 0:
-    if debug:
-        print "Deleting %s Empty Data Grades" % len(empty_data_grade_df)
-    if Log_to_file:
-        text_file.write("Deleting %s Empty Data Grades\n" % len(empty_data_grade_df))
-    # Doing by Group to help avoid overly massive delete statements
-    junk_note_group = empty_data_grade_df.groupby(['TimeSeriesID'])
-    for name, group in junk_note_group:
-        if len(group) > 0:
-            meta_to_delete_str = str(list(group['MetaID'].values)).replace('UUID(', '').replace(')', '').strip('[]')
-            sql_delete = 'DELETE FROM TimeSeriesMeta WHERE MetaID IN ({0})'.format(meta_to_delete_str)
-            if debug:
-                print "    Deleting %s Empty Data Grades From TimeSeries # %s (%s)"\
-                      % (len(group), name, group['TS_Text_ID'].iloc[0])
-                print "        Using Query: %s" % sql_delete
+    def log(message, debug_only=False):
+        if debug:
+            print(message)
+        if Log_to_file and not debug_only:
+            text_file.write(message + "\n")
 
-            if Log_to_file:
-                text_file.write("    Deleting %s Empty Data Grades From TimeSeries # %s (%s)\n"
-                                % (len(group), name, group['TS_Text_ID'].iloc[0]))
-            cur.execute(sql_delete)
-            conn.commit()
-else:
+    # Set up the connection directly to the Aquarius SQL Database
+    connection_info = {'server': aqdb_host, 'user': aqdb_user, 'password': aqdb_password, 'database': aqdb_name}
+    conn = pymssql.connect(**connection_info)
     if debug:
-        print "No Empty Data Grades to Delete"
-    if Log_to_file:
-        text_file.write("No Empty Data Grades to Delete\n")
-
+        print("Connected to server.")
 
-# Remove empty interpolation codes
-empty_interp_code_df = full_df[(full_df['TypeName'] == 'INTERPOLATIONCODE') & (full_df['comment'] == '') & (full_df['value'] == -9999)]
-if len(empty_interp_code_df) > 0:
+    # Read TimeSeries information into pandas, and find the time series which have any metadata to clean
     if debug:
-        print "Deleting %s Empty Interpolation Code Lines" % len(empty_interp_code_df)
-    if Log_to_file:
-        text_file.write("Deleting %s Empty Interpolation Code Lines\n" % len(empty_interp_code_df))
-    # Doing by Group to help avoid overly massive delete statements
-    junk_note_group = empty_interp_code_df.groupby(['TimeSeriesID'])
-    for name, group in junk_note_group:
-        if len(group) > 0:
-            meta_to_delete_str = str(list(group['MetaID'].values)).replace('UUID(', '').replace(')', '').strip('[]')
-            sql_delete = 'DELETE FROM TimeSeriesMeta WHERE MetaID IN ({0})'.format(meta_to_delete_str)
-            if debug:
-                print "    Deleting %s Empty Interpolation Code Lines From TimeSeries # %s (%s)"\
-                      % (len(group), name, group['TS_Text_ID'].iloc[0])
-                print "        Using Query: %s" % sql_delete
-
-            if Log_to_file:
-                text_file.write("    Deleting %s Empty Interpolation Code Lines From TimeSeries # %s (%s)\n"
-                                % (len(group), name, group['TS_Text_ID'].iloc[0]))
-            cur.execute(sql_delete)
-            conn.commit()
-else:
+        print("Reading TimeSeries information into pandas")
+        print(aq_metadata.ts_df_query)
+    ts_df = aq_metadata.read_timeseries_info(conn)
+    # Read the new watermark before the time series, so anything modified in between is picked up again next time
+    watermark = aq_metadata.MetadataWatermark(os.path.join(script_directory, 'MetadataWatermark.json'), debug=debug)
+    new_watermark = aq_metadata.read_last_modified_time(conn)
+    last_watermark = watermark.read() if incremental else None
+    if last_watermark is not None:
+        modified_since = last_watermark - datetime.timedelta(minutes=overlap_minutes)
+        log("Cleaning only the time series with metadata modified since %s" % modified_since)
+        ts_ids = aq_metadata.read_metadata_timeseries_ids(conn, modified_since)
+    else:
+        if incremental:
+            log("There is no watermark from an earlier run, so cleaning every time series")
+        ts_ids = aq_metadata.read_metadata_timeseries_ids(conn)
+    conn.close()  # close the database connection
+
+    # Clean the metadata a batch of time series at a time, so only one batch per worker is ever in memory
+    log("Cleaning the metadata of %s time series in batches of %s with %s workers" %
+        (len(ts_ids), batch_size, workers))
+    total_records = 0
+    by_ts_counts = []
+    for batch_records, batch_counts, batch_messages in aq_metadata.clean_metadata(
+            connection_info, ts_ids, ts_df, batch_size=batch_size, workers=workers, server_side=server_side):
+        for message, debug_only in batch_messages:
+            log(message, debug_only)
+        total_records += batch_records
+        if batch_counts is not None:
+            by_ts_counts.append(batch_counts)
+
+    log("There are %s Total Metadata Records" % total_records)
+    # Only move the watermark once every batch has been cleaned
+    if new_watermark is not None:
+        watermark.write(new_watermark, len(ts_ids))
+
+    # Print out what happened
+    for by_ts_count in by_ts_counts:
+        for index, row in by_ts_count.iterrows():
+            if Log_to_file and (row['deleted_dups'] + row['deleted_junk'] + row['updated_meta']
+                                + row['empty_apr_code'] + row['empty_data_grade'] + row['empty_interp_code'] > 1):
+                text_file.write("*********************\n")
+                text_file.write("     Data Summary    \n")
+                text_file.write("*********************\n")
+                text_file.write("NumericIdentifier, TextIdentifier, TotalMetadata, UniqueMetadata,"
+                                " DeletedDeplicates, DeletedJunk, UpdatedRecords  \n")
+                text_file.write("%s, %s, %s, %s, %s, %s, %s, %s, %s, %s  \n" %
+                                (row['TimeSeriesID'], row['TS_Text_ID'], row['total_meta'], row['unique_meta'],
+                                 row['deleted_dups'], row['deleted_junk'], row['empty_apr_code'],
+                                 row['empty_data_grade'], row['empty_interp_code'], row['updated_meta']))
+
+                text_file.write("*********************\n")
+
+    # Find the date/time the script finished:
+    end_datetime_utc = datetime.datetime.now(pytz.utc)
+    end_datetime_loc = end_datetime_utc.astimezone(eastern_local_time)
+    runtime = end_datetime_utc - start_datetime_utc
+
+    # Close out the text file
     if debug:
-        print "No Empty Interpolation Code Lines to Delete"
+        print("Script completed at %s" % end_datetime_loc)
+        print("Total time for script: %s" % runtime)
     if Log_to_file:
-        text_file.write("No Empty Interpolation Code Lines to Delete\n")
-
-
-# Close out the database connections
-cur.close()  # close the database cursor
-conn.close()  # close the database connection
-
-
-# Print out what happened
-by_ts_full = pd.DataFrame({'total_meta': full_df.groupby(['TimeSeriesID']).size()})
-by_ts_unique = pd.DataFrame({'unique_meta': dedupped_aggr.groupby(['TimeSeriesID']).size()})
-by_ts_dups = pd.DataFrame({'deleted_dups': dups.groupby(['TimeSeriesID']).size()})
-by_ts_junk = pd.DataFrame({'deleted_junk': junk_note_df.groupby(['TimeSeriesID']).size()})
-by_empty_apr_code = pd.DataFrame({'empty_apr_code': empty_apr_code_df.groupby(['TimeSeriesID']).size()})
-by_empty_data_grade = pd.DataFrame({'empty_data_grade': empty_data_grade_df.groupby(['TimeSeriesID']).size()})
-by_empty_interp_code = pd.DataFrame({'empty_interp_code': empty_interp_code_df.groupby(['TimeSeriesID']).size()})
-by_ts_updated = pd.DataFrame({'updated_meta': values_to_update.groupby(['TimeSeriesID']).size()})
-by_ts_counts = pd.concat([by_ts_full, by_ts_unique, by_ts_dups, by_ts_junk, by_empty_apr_code, by_empty_data_grade,
-                          by_empty_interp_code, by_ts_updated], axis=1).merge(
-    ts_df[['TimeSeriesID', 'TS_Text_ID']], left_index=True, right_on='TimeSeriesID').fillna(0)
-
-for index, row in by_ts_counts.iterrows():
-    if Log_to_file and (row['deleted_dups'] + row['deleted_junk'] + row['updated_meta']
-                            + row['empty_apr_code'] + row['empty_data_grade']  + row['empty_interp_code'] > 1):
-        text_file.write("*********************\n")
-        text_file.write("     Data Summary    \n")
-        text_file.write("*********************\n")
-        text_file.write("NumericIdentifier, TextIdentifier, TotalMetadata, UniqueMetadata,"
-                        " DeletedDeplicates, DeletedJunk, UpdatedRecords  \n")
-        text_file.write("%s, %s, %s, %s, %s, %s, %s, %s, %s, %s  \n" %
-                        (row['TimeSeriesID'], row['TS_Text_ID'], row['total_meta'], row['unique_meta'],
-                         row['deleted_dups'], row['deleted_junk'], row['empty_apr_code'], row['empty_data_grade'],
-                         row['empty_interp_code'], row['updated_meta']))
-
-        text_file.write("*********************\n")
-
-
-# Find the date/time the script finished:
-end_datetime_utc = datetime.datetime.now(pytz.utc)
-end_datetime_loc = end_datetime_utc.astimezone(eastern_local_time)
-runtime = end_datetime_utc - start_datetime_utc
-
-# Close out the text file
-if debug:
-    print "Script completed at %s" % end_datetime_loc
-    print "Total time for script: %s" % runtime
-if Log_to_file:
-    text_file.write("\n")
-    text_file.write("Script completed at %s \n" % end_datetime_loc)
-    text_file.write("Total time for script: %s \n" % runtime)
-    text_file.write("***********************************************************************************************\n")
-    text_file.write("\n \n")
-    text_file.close()
+        text_file.write("\n")
+        text_file.write("Script completed at %s \n" % end_datetime_loc)
+        text_file.write("Total time for script: %s \n" % runtime)
+        text_file.write("***********************************************************************************************\n")
+        text_file.write("\n \n")
+        text_file.close()
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+The append stage of moving data from DreamHost to Aquarius.
+
+This takes the series and data already pulled from DreamHost, localizes the data to the time zone of each Aquarius
+time series, encodes it and appends it chunk by chunk through the append journal.  It is kept separate from the
+Dreamhost_to_Aquarius script so it can be run (and benchmarked) against any Aquarius endpoint.
+"""
+
+import time
+import numpy as np
+import Aquarius.aq_utils as aq_utils
+
+__author__ = 'Sara Geleskie Damiano'
+__contact__ = 'sdamiano@stroudcenter.org'
+
+log_columns = "Series, Table, Column, NumericIdentifier, TextIdentifier, NumPointsAppended, AppendToken  \n"
+
+
+def append_journaled_chunk(journal, chunk, append_bytes, chunk_number, text_file=None, retry_seconds=30,
+                           debug=False, metrics=None):
+    """
+    Appends a single planned chunk to Aquarius, records the outcome in the journal and writes it to the log
+    :param journal: The AppendJournal the chunk was planned in
+    :param chunk: A planned chunk from the append journal
+    :param append_bytes: The csv bytes to append
+    :param chunk_number: The number of the chunk in this run, for the log
+    :param text_file: An open log file, or None to skip logging
+    :param retry_seconds: The number of seconds to wait before retrying a failed append
+    :param debug: A boolean for whether extra print commands apply
+    :param metrics: A dh_metrics.PipelineMetrics to record the append ("upload") and the journal write ("log") in,
+        or None
+    :return: The append result from the SOAP client
+    """
+    upload_start = time.perf_counter()
+    append_result = aq_utils.aq_timeseries_append(
+        chunk['ts_numeric_id'], append_bytes, debug=debug, retry_seconds=retry_seconds)
+    log_start = time.perf_counter()
+    journal.record_outcome(chunk, append_result)
+    if metrics is not None:
+        metrics.record('upload', log_start - upload_start, rows=append_result.NumPointsAppended or 0,
+                       bytes=len(append_bytes), errors=0 if append_result.AppendToken else 1,
+                       table=chunk['table_name'], series=chunk['ts_numeric_id'], destination='aquarius')
+        metrics.record('log', time.perf_counter() - log_start, table=chunk['table_name'], destination='journal')
+    # A failed chunk stays in the journal and the run goes on; errors no later request could get past, like failing to
+    # authenticate, are raised by aq_timeseries_append and stop the run instead
+    if text_file:
+        text_file.write("{}, {}, {}, {}, {}, {}, {} \n"
+                        .format(chunk_number, chunk['table_name'], chunk['column_name'],
+                                chunk['ts_numeric_id'], append_result.TsIdentifier,
+                                append_result.NumPointsAppended, append_result.AppendToken))
+    return append_result
+
+
+def _summarize(summary, append_result):
+    summary['chunks'] += 1
+    summary['points_appended'] += append_result.NumPointsAppended or 0
+    if not append_result.AppendToken:
+        summary['failed_chunks'] += 1
+
+
+def replay_unfinished_chunks(journal, text_file=None, pause_seconds=1, retry_seconds=30, debug=False, metrics=None):
+    """
+    Replays only the chunks which were planned in the journal but never finished.
+    :param journal: The AppendJournal to replay from
+    :param text_file: An open log file, or None to skip logging
+    :param pause_seconds: Seconds to wait between appends
+    :param retry_seconds: The number of seconds to wait before retrying a failed append
+    :param debug: A boolean for whether extra print commands apply
+    :param metrics: A dh_metrics.PipelineMetrics to record each stage in, or None
+    :return: A dictionary with the number of chunks, points appended and failed chunks
+    """
+    summary = {'chunks': 0, 'points_appended': 0, 'failed_chunks': 0}
+    unfinished_chunks = journal.unfinished_chunks()
+    if debug:
+        print("{} unfinished chunks found in the append journal".format(len(unfinished_chunks)))
+    if text_file:
+        text_file.write("{} unfinished chunks found in the append journal \n \n".format(
+            len(unfinished_chunks)))
+        if len(unfinished_chunks) > 0:
+            text_file.write(log_columns)
+
+    i = 1
+    for chunk in unfinished_chunks:
+        append_bytes = journal.load_payload(chunk)
+        if append_bytes is None:
+            summary['failed_chunks'] += 1
+            if text_file:
+                text_file.write("{}, {}, {}, {}, Payload missing or corrupt - chunk {} not replayed \n"
+                                .format(i, chunk['table_name'], chunk['column_name'],
+                                        chunk['ts_numeric_id'], chunk['chunk_id']))
+        else:
+            _summarize(summary, append_journaled_chunk(journal, chunk, append_bytes, i, text_file,
+                                                    retry_seconds, debug, metrics))
+            time.sleep(pause_seconds)
+        i += 1
+    return summary
+
+
+def append_dreamhost_data(aq_series, aq_data, journal, text_file=None, chunk_size=None, pause_seconds=1,
+                          retry_seconds=30, debug=False, metrics=None):
+    """
+    Appends data pulled from DreamHost to the matching Aquarius time series.
+    :param aq_series: The series table returned by dh_utils.get_dreamhost_data, with AQTimeSeriesID and AQLocationID
+    :param aq_data: The data table returned by dh_utils.get_dreamhost_data
+    :param journal: The AppendJournal to record every chunk in
+    :param text_file: An open log file, or None to skip logging
+    :param chunk_size: The maximum number of points in a single append, None for one append per series
+    :param pause_seconds: Seconds to wait between appends
+    :param retry_seconds: The number of seconds to wait before retrying a failed append
+    :param debug: A boolean for whether extra print commands apply
+    :param metrics: A dh_metrics.PipelineMetrics to record each stage in, or None
+    :return: A dictionary with the number of chunks, points appended and failed chunks
+    """
+    summary = {'chunks': 0, 'points_appended': 0, 'failed_chunks': 0}
+    if len(aq_data.index) == 0:
+        return summary
+
+    if text_file:
+        text_file.write(log_columns)
+
+    # Get the corresponding Aquarius series time zones for each time series
+    correct_start = time.perf_counter()
+    get_aq_timezone = np.vectorize(aq_utils.get_aquarius_timezone)
+    aq_series['AQTimeZone'] = get_aq_timezone(
+        aq_series['AQTimeSeriesID'], aq_series['AQLocationID'])
+    aq_series2 = aq_series.loc[:, ['SeriesID', 'AQTimeZone']]
+
+    # Merge the Aquarius timezone with the data
+    aq_data = aq_data.merge(aq_series2, how='left', on='SeriesID')
+    # Localize data to the Aquarius timezone, one timezone at a time
+    aq_data['AQLocalizedTimeStamp'] = aq_utils.localize_to_aquarius_timezones(aq_data)
+    if metrics is not None:
+        metrics.record('correct', time.perf_counter() - correct_start, rows=len(aq_data.index),
+                       destination='aquarius')
+
+    i = 1
+    for name, group in aq_data.groupby('AQTimeSeriesID'):
+        # Chunks of earlier runs which this run is about to append again don't need to be resumed
+        journal.supersede_chunks(name, group['AQLocalizedTimeStamp'].min(), group['AQLocalizedTimeStamp'].max())
+        # Break long series into chunks so a crash only costs the chunk that was in flight
+        if chunk_size is None or chunk_size <= 0:
+            chunk_starts = [0]
+            this_chunk_size = len(group.index)
+        else:
+            chunk_starts = range(0, len(group.index), chunk_size)
+            this_chunk_size = chunk_size
+        for chunk_start in chunk_starts:
+            chunk_data = group.iloc[chunk_start:chunk_start + this_chunk_size]
+            encode_start = time.perf_counter()
+            append_bytes = aq_utils.create_appendable_csv(chunk_data)
+            # Write the chunk to the journal *before* trying to append it
+            log_start = time.perf_counter()
+            chunk = journal.plan_chunk(name, append_bytes, len(chunk_data.index),
+                                       table_name=chunk_data['TableName'].iloc[0],
+                                       column_name=chunk_data['TableColumnName'].iloc[0],
+                                       first_timestamp=chunk_data['AQLocalizedTimeStamp'].iloc[0],
+                                       last_timestamp=chunk_data['AQLocalizedTimeStamp'].iloc[-1])
+            if metrics is not None:
+                metrics.record('encode', log_start - encode_start, rows=len(chunk_data.index),
+                               bytes=len(append_bytes), table=chunk['table_name'],
+                               series=chunk['ts_numeric_id'])
+                metrics.record('log', time.perf_counter() - log_start, bytes=len(append_bytes),
+                               table=chunk['table_name'], destination='journal')
+            _summarize(summary, append_journaled_chunk(journal, chunk, append_bytes, i, text_file,
+                                                    retry_seconds, debug, metrics))
+            time.sleep(pause_seconds)
+            i += 1
+    return summary
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+Set-based clean-up of the Aquarius aq_event_log_ table.
+
+The functions here take an open pymssql connection so they can be shared by the clean-up scripts.  Rather than running
+one DELETE per time series, which scans the huge aq_event_log_ table again for every series, the ids are loaded into a
+temp table and the matching events are deleted with a single join.  The ids of the deleted events are captured with
+an OUTPUT clause, so the per-series counts come out of the same pass.
+
+Everything else is described by a table of retention rules: which events a rule matches and how old they must be
+before they are deleted.  Rules which share a maximum age are compiled into a single DELETE, so adding a rule doesn't
+add another scan of the table.  The rule each deleted row matched is captured with an OUTPUT clause, so every rule
+still gets its own count.
+
+Every delete runs as a loop of DELETE TOP (N) statements, each committed on its own.  Small transactions keep SQL
+Server from escalating to a table lock and keep the transaction log from ballooning, so Aquarius can keep appending
+while the clean-up runs.  The loop can pause between batches and stops when an overall time budget runs out.
+
+If an archive is given, every batch also returns the rows it deleted (OUTPUT deleted.*).  They are streamed into the
+archive and synced to disk before the batch is committed, so no row leaves the table without being archived.  For the
+retention rules the same CASE that names the matching rule is returned with each row, so every archived row records
+the one rule that removed it.
+"""
+
+import time
+import datetime
+import collections
+
+__author__ = 'Sara Geleskie Damiano'
+__contact__ = 'sdamiano@stroudcenter.org'
+
+# SQL Server allows at most 1000 rows in a single VALUES list
+max_insert_rows = 1000
+
+# The format of the cutoff times compared to eventTime_
+event_time_format = '%Y-%m-%dT%H:%M:%S'
+
+
+class Like(object):
+    """
+    A pattern to match a column against with LIKE, rather than with =, in a retention rule.
+    """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+
+def retention_rules(api_username):
+    """
+    The events to clean out of aq_event_log_.  Each rule has a name, a description for the log, the column values
+    an event must have to match (all of them), and the age an event must reach before it is deleted, or None to delete
+    matching events of any age.
+    :param api_username: The user Aquarius appends are made by
+    """
+    return [
+        {'name': 'API user', 'description': "added by the API user",
+         'where': {'userID_': api_username}, 'max_age': None},
+        {'name': 'USGS Rest Services', 'description': "older sync messages with USGS Rest Services",
+         'where': {'taskName_': 'Default.RESTFul_SyncJob'}, 'max_age': datetime.timedelta(days=14)},
+        {'name': 'USGS OGC', 'description': "older sync messages with USGS OGC",
+         'where': {'taskName_': 'Default.USGSOGC_SyncJob'}, 'max_age': datetime.timedelta(days=14)},
+        {'name': 'USGS Water Services', 'description': "older sync messages with USGS Water Services",
+         'where': {'taskName_': 'Default.USGSWaterServices_SyncJob'}, 'max_age': datetime.timedelta(days=14)},
+        {'name': 'event log clean-up', 'description': "automatic event log clean-up notices",
+         'where': {'taskName_': 'Default.EventLogCleanup'}, 'max_age': datetime.timedelta(days=14)},
+        {'name': 'notification clean-up', 'description': "automatic notification clean-up notices",
+         'where': {'taskName_': 'Default.OutgoingNotificationCleanup'}, 'max_age': datetime.timedelta(days=14)},
+        {'name': 'notification jobs', 'description': "notifications jobs older than 6 hours",
+         'where': {'eventType_': 'INFO', 'taskName_': Like('Notification.%.Ruleset.%')},
+         'max_age': datetime.timedelta(hours=6)},
+        {'name': 'notification events', 'description': "notifications older than 72 hours",
+         'where': {'eventType_': 'Notification Event'}, 'max_age': datetime.timedelta(hours=72)},
+        {'name': 'empty appends', 'description': "empty appends",
+         'where': {'message_': '0 data points were appended.'}, 'max_age': datetime.timedelta(hours=72)},
+        {'name': 'no points appended', 'description': "more empty appends",
+         'where': {'message_': 'No data points have been appended.'}, 'max_age': datetime.timedelta(hours=72)},
+        {'name': 'old automated processing', 'description': "old automated processing messages",
+         'where': {'eventType_': 'Automated Processing', 'userID_': 'SYSTEM@AQUARIUS'},
+         'max_age': datetime.timedelta(days=90)},
+    ]
+
+
+def compile_rule_predicate(rule, prefix=''):
+    """
+    Turns the column values of a rule into a SQL condition and its parameters.
+    :param rule: A retention rule
+    :param prefix: A prefix for the column names, like "deleted."
+    :return: The condition and a list of its parameters
+    """
+    conditions = []
+    params = []
+    for column, value in sorted(rule['where'].items()):
+        if isinstance(value, Like):
+            conditions.append("{}{} LIKE %s".format(prefix, column))
+            params.append(value.pattern)
+        else:
+            conditions.append("{}{} = %s".format(prefix, column))
+            params.append(value)
+    return "(" + " AND ".join(conditions) + ")", params
+
+
+def compile_retention_rules(rules, now):
+    """
+    Compiles retention rules into the fewest DELETE statements: one for each distinct maximum age.  Each statement
+    deletes the rows matching any of its rules and records which rule each deleted row matched in #DeletedByRule.
+    :param rules: A list of retention rules
+    :param now: The time the ages are counted back from, in the same time zone as eventTime_
+    :return: A list of passes, each a dictionary of the cutoff, the names of its rules, the statement and its
+        parameters, and the OUTPUT clause returning the deleted rows with the rule each matched (as cleanup_rule)
+        and the statement's parameters when that clause is used
+    """
+    rules_by_age = collections.OrderedDict()
+    for rule in rules:
+        rules_by_age.setdefault(rule['max_age'], []).append(rule)
+
+    passes = []
+    for max_age, age_rules in rules_by_age.items():
+        output_params = []
+        output_cases = []
+        where_params = []
+        where_predicates = []
+        for rule in age_rules:
+            predicate, params = compile_rule_predicate(rule, prefix='deleted.')
+            output_cases.append("WHEN {} THEN %s".format(predicate))
+            output_params.extend(params + [rule['name']])
+            predicate, params = compile_rule_predicate(rule)
+            where_predicates.append(predicate)
+            where_params.extend(params)
+        where = "(" + " OR ".join(where_predicates) + ")"
+        if max_age is None:
+            cutoff = None
+        else:
+            cutoff = (now - max_age).strftime(event_time_format)
+            where = "eventTime_ < %s AND " + where
+            where_params.insert(0, cutoff)
+        rule_case = "CASE {} END".format(" ".join(output_cases))
+        statement = """
+            DELETE TOP ({{batch_size}})
+            FROM
+                aq_event_log_
+            OUTPUT
+                {} INTO #DeletedByRule (rule_name)
+            {{archive_output}}
+            WHERE
+                {}
+            ;
+        """.format(rule_case, where)
+        passes.append({'cutoff': cutoff, 'rules': [rule['name'] for rule in age_rules], 'statement': statement,
+                       'params': tuple(output_params + where_params),
+                       'archive_output': "OUTPUT deleted.*, {} AS cleanup_rule".format(rule_case),
+                       'archive_params': tuple(output_params + output_params + where_params)})
+    return passes
+
+
+def run_retention_rules(conn, rules, now, batch_size=5000, pause_seconds=0, budget=None, archive=None,
+                        debug=False):
+    """
+    Deletes the events matched by the retention rules, one chunked delete for each distinct maximum age.
+    :param conn: An open connection to the Aquarius database
+    :param rules: A list of retention rules
+    :param now: The time the ages are counted back from, in the same time zone as eventTime_
+    :param batch_size: The maximum number of rows deleted in one transaction
+    :param pause_seconds: Seconds to wait between batches
+    :param budget: A TimeBudget shared by the whole clean-up, or None for no limit
+    :param archive: An EventArchive to write the deleted rows to, or None to delete them without archiving
+    :param debug: A boolean for whether extra print commands apply
+    :return: A list with the stats and description of every rule.  The rows deleted are the rule's own, the
+        batches, seconds and rows/sec are those of the pass the rule was run in.
+    """
+    cursor = conn.cursor()
+    cursor.execute("IF OBJECT_ID('tempdb..#DeletedByRule') IS NOT NULL DROP TABLE #DeletedByRule;")
+    cursor.execute("CREATE TABLE #DeletedByRule (rule_name NVARCHAR(100) NULL);")
+    conn.commit()
+
+    descriptions = dict((rule['name'], rule['description']) for rule in rules)
+    rule_stats = []
+    for rule_pass in compile_retention_rules(rules, now):
+        pass_name = ", ".join(rule_pass['rules'])
+        stats = chunked_delete(conn, pass_name, rule_pass['statement'], rule_pass['params'], batch_size=batch_size,
+                               pause_seconds=pause_seconds, budget=budget, archive=archive,
+                               archive_output=rule_pass['archive_output'], archive_params=rule_pass['archive_params'],
+                               debug=debug)
+        cursor.execute("SELECT rule_name, COUNT(*) FROM #DeletedByRule GROUP BY rule_name;")
+        deleted_counts = dict(cursor.fetchall())
+        cursor.execute("TRUNCATE TABLE #DeletedByRule;")
+        conn.commit()
+        for rule_name in rule_pass['rules']:
+            this_rule_stats = dict(stats)
+            this_rule_stats['rule'] = rule_name
+            this_rule_stats['description'] = descriptions[rule_name]
+            this_rule_stats['rows_deleted'] = deleted_counts.get(rule_name, 0)
+            if archive is not None:
+                this_rule_stats['rows_archived'] = this_rule_stats['rows_deleted']
+            rule_stats.append(this_rule_stats)
+
+    cursor.execute("DROP TABLE #DeletedByRule;")
+    conn.commit()
+    cursor.close()
+    return rule_stats
+
+
+class TimeBudget(object):
+    """
+    The time allowed for a whole clean-up run, shared by every delete in it.
+    """
+
+    def __init__(self, seconds=None):
+        """
+        :param seconds: The number of seconds the clean-up may run for, None for no limit
+        """
+        self.seconds = seconds
+        self.started = time.monotonic()
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def expired(self):
+        return self.seconds is not None and self.elapsed() >= self.seconds
+
+
+def empty_stats(rule_name):
+    return {'rule': rule_name, 'rows_deleted': 0, 'batches': 0, 'seconds': 0.0, 'rows_per_sec': 0.0,
+            'complete': False, 'rows_archived': 0, 'archive_seconds': 0.0}
+
+
+def chunked_delete(conn, rule_name, delete_statement, params=(), batch_size=5000, pause_seconds=0, budget=None,
+                   archive=None, archive_output="OUTPUT deleted.*", archive_params=None, fetch_size=1000, debug=False):
+    """
+    Runs a DELETE TOP (N) statement over and over, committing after every batch, until there's nothing left to delete
+    or the time budget runs out.
+    :param conn: An open connection to the Aquarius database
+    :param rule_name: A name for the delete, for progress messages
+    :param delete_statement: The DELETE statement, with "TOP ({batch_size})" where the batch size goes and
+        "{archive_output}" where the OUTPUT clause returning the deleted rows goes
+    :param params: The parameters for the DELETE statement
+    :param batch_size: The maximum number of rows deleted in one transaction
+    :param pause_seconds: Seconds to wait between batches, to give other work on the server a turn
+    :param budget: A TimeBudget shared by the whole clean-up, or None for no limit
+    :param archive: An EventArchive to write the deleted rows to before each batch is committed, or None
+    :param archive_output: The OUTPUT clause returning the deleted rows when archiving.  If it returns a cleanup_rule
+        column, that is the rule archived with each row; otherwise every row is archived with rule_name.
+    :param archive_params: The parameters for the DELETE statement when archiving, if archive_output has any of its
+        own; by default params
+    :param fetch_size: The number of deleted rows to fetch from the server at a time when archiving
+    :param debug: A boolean for whether extra print commands apply
+    :return: A dictionary with the rule, rows deleted, batches, seconds, rows per second, whether it completed and
+        the rows archived and seconds spent archiving
+    """
+    statement = delete_statement.format(batch_size=int(batch_size),
+                                        archive_output=archive_output if archive is not None else "")
+    if archive is not None and archive_params is not None:
+        params = archive_params
+    stats = empty_stats(rule_name)
+    cursor = conn.cursor()
+    started = time.monotonic()
+    while budget is None or not budget.expired():
+        cursor.execute(statement, params)
+        if archive is None:
+            rows_deleted = cursor.rowcount
+        else:
+            # Stream the deleted rows into the archive, and make sure they're on disk before the delete is committed
+            archive_started = time.monotonic()
+            columns = [column[0] for column in cursor.description]
+            rows_deleted = 0
+            rows = cursor.fetchmany(fetch_size)
+            while rows:
+                rows_deleted += archive.write_rows(columns, rows, rule_name)
+                rows = cursor.fetchmany(fetch_size)
+            archive.flush()
+            stats['rows_archived'] += rows_deleted
+            stats['archive_seconds'] += time.monotonic() - archive_started
+        conn.commit()
+        stats['batches'] += 1
+        stats['rows_deleted'] += max(rows_deleted, 0)
+        if debug:
+            print("{}: batch {} deleted {} rows, {} so far".format(
+                rule_name, stats['batches'], rows_deleted, stats['rows_deleted']))
+        if rows_deleted < batch_size:
+            stats['complete'] = True
+            break
+        if pause_seconds > 0:
+            time.sleep(pause_seconds)
+    cursor.close()
+    stats['seconds'] = time.monotonic() - started
+    if stats['seconds'] > 0:
+        stats['rows_per_sec'] = stats['rows_deleted'] / stats['seconds']
+    return stats
+
+
+def load_event_origins(cursor, table_name, event_origins):
+    """
+    Creates a temp table of event origins, with the same column type as aq_event_log_.eventOrigin_ so the join
+    doesn't have to convert every row of the event log.
+    :param cursor: An open cursor on the Aquarius database
+    :param table_name: The name of the temp table, starting with #
+    :param event_origins: The event origins (generally numeric time series ids) to load
+    :return: The number of distinct event origins loaded
+    """
+    event_origins = sorted(set(str(event_origin) for event_origin in event_origins))
+    cursor.execute("IF OBJECT_ID('tempdb..{0}') IS NOT NULL DROP TABLE {0};".format(table_name))
+    cursor.execute("SELECT TOP 0 eventOrigin_ INTO {} FROM aq_event_log_;".format(table_name))
+    for batch_start in range(0, len(event_origins), max_insert_rows):
+        batch = event_origins[batch_start:batch_start + max_insert_rows]
+        cursor.execute("INSERT INTO {} (eventOrigin_) VALUES {};".format(
+            table_name, ", ".join(["(%s)"] * len(batch))), tuple(batch))
+    cursor.execute("CREATE CLUSTERED INDEX IX_eventOrigin ON {} (eventOrigin_);".format(table_name))
+    return len(event_origins)
+
+
+def delete_automated_processing(conn, ts_numeric_ids, user_id='SYSTEM@AQUARIUS', batch_size=5000,
+                                pause_seconds=0, budget=None, archive=None, debug=False):
+    """
+    Deletes the automated processing events for all of the given time series in batches, each of which is a single
+    pass over aq_event_log_ for every series at once.
+    :param conn: An open connection to the Aquarius database
+    :param ts_numeric_ids: The numeric ids of the time series whose automated processing events should be deleted
+    :param user_id: The user that runs automated processing
+    :param batch_size: The maximum number of rows deleted in one transaction
+    :param pause_seconds: Seconds to wait between batches
+    :param budget: A TimeBudget shared by the whole clean-up, or None for no limit
+    :param archive: An EventArchive to write the deleted rows to, or None to delete them without archiving
+    :param debug: A boolean for whether extra print commands apply
+    :return: The stats from chunked_delete, and a dictionary of the number of rows deleted for each time series id
+        which had any rows deleted
+    """
+    cursor = conn.cursor()
+    if load_event_origins(cursor, '#StreamingSeries', ts_numeric_ids) == 0:
+        cursor.close()
+        stats = empty_stats('automated processing on streaming series')
+        stats['complete'] = True
+        return stats, {}
+    cursor.execute("IF OBJECT_ID('tempdb..#DeletedOrigins') IS NOT NULL DROP TABLE #DeletedOrigins;")
+    cursor.execute("SELECT TOP 0 eventOrigin_ INTO #DeletedOrigins FROM aq_event_log_;")
+    conn.commit()
+
+    stats = chunked_delete(conn, 'automated processing on streaming series', """
+        DELETE TOP ({batch_size})
+            events
+        OUTPUT
+            deleted.eventOrigin_ INTO #DeletedOrigins
+        {archive_output}
+        FROM
+            aq_event_log_ AS events
+            INNER JOIN #StreamingSeries AS streaming ON events.eventOrigin_ = streaming.eventOrigin_
+        WHERE
+            events.eventType_ = 'Automated Processing' AND events.userID_ = %s
+        ;
+    """, (user_id,), batch_size=batch_size, pause_seconds=pause_seconds, budget=budget, archive=archive,
+        debug=debug)
+
+    cursor.execute("""
+        SELECT
+            eventOrigin_, COUNT(*)
+        FROM
+            #DeletedOrigins
+        GROUP BY
+            eventOrigin_
+        ;
+    """)
+    deleted_counts = dict((event_origin, count) for event_origin, count in cursor.fetchall())
+    cursor.execute("DROP TABLE #DeletedOrigins;")
+    cursor.execute("DROP TABLE #StreamingSeries;")
+    conn.commit()
+    cursor.close()
+    return stats, deleted_counts
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+A local archive of the aq_event_log_ rows removed by the clean-up, so they are still there for digging into failed
+appends after they are gone from the live table.
+
+Rows are written as gzipped JSON lines, in one file per day of eventTime_ for each run of the clean-up
+(archive/YYYY/MM/aq_event_log_YYYY-MM-DD_RUNID.jsonl.gz, where the run id is when the run started and its process id).
+Rows are written as they are streamed from the server, a batch at a time, so memory use doesn't grow with the number of
+rows archived.
+
+A file only gets its gzip end-of-stream marker when the archive is closed.  If the process is killed outright (kill -9,
+a power cut, or the daemon giving up on a clean-up when it stops), the files it had open are cut short: gzip and zcat
+read every row up to the cut and then stop with an error.  Because every run writes files of its own, a later run never
+appends after a cut and the rows it archives stay readable.  The rows of a cut file can be recovered with
+"zcat file.jsonl.gz 2>/dev/null > rows.jsonl", dropping any partial last line.
+"""
+
+import os
+import json
+import gzip
+import time
+import datetime
+import collections
+
+__author__ = 'Sara Geleskie Damiano'
+__contact__ = 'sdamiano@stroudcenter.org'
+
+
+class EventArchive(object):
+    """
+    Writes aq_event_log_ rows to gzipped, date-partitioned JSON-lines files.
+    """
+
+    def __init__(self, archive_directory, time_column='eventTime_', max_open_files=16, compress_level=6,
+                 run_id=None, debug=False):
+        """
+        :param archive_directory: The directory the archive files are written under
+        :param time_column: The column whose date decides which file a row goes in
+        :param max_open_files: The most archive files to keep open at once
+        :param compress_level: The gzip compression level, 1 (fastest) to 9 (smallest)
+        :param run_id: Added to the name of every file this archive writes, so no two runs write to the same file; by
+            default when the archive was created and the process id
+        :param debug: A boolean for whether extra print commands apply
+        """
+        self.archive_directory = archive_directory
+        self.time_column = time_column
+        self.max_open_files = max_open_files
+        self.compress_level = compress_level
+        if run_id is None:
+            run_id = "{}-{}".format(datetime.datetime.now().strftime('%Y%m%dT%H%M%S'), os.getpid())
+        self.run_id = run_id
+        self.debug = debug
+        self._open_files = collections.OrderedDict()
+        self.rows_archived = 0
+        self.seconds = 0.0
+
+    def file_for_date(self, date_string):
+        return os.path.join(self.archive_directory, date_string[:4], date_string[5:7],
+                            'aq_event_log_{}_{}.jsonl.gz'.format(date_string, self.run_id))
+
+    def _open_file(self, date_string):
+        open_file = self._open_files.pop(date_string, None)
+        if open_file is None:
+            if len(self._open_files) >= self.max_open_files:
+                _, oldest = self._open_files.popitem(last=False)
+                oldest.close()
+            file_name = self.file_for_date(date_string)
+            if not os.path.isdir(os.path.dirname(file_name)):
+                os.makedirs(os.path.dirname(file_name))
+            # A file closed to make room for another is opened again for appending; it was closed cleanly by this run
+            open_file = gzip.open(file_name, 'at', encoding='utf-8', compresslevel=self.compress_level)
+        # Keep the most recently used file at the end, so the least recently used is closed first
+        self._open_files[date_string] = open_file
+        return open_file
+
+    def write_rows(self, columns, rows, rule_name=None):
+        """
+        Writes rows fetched from the database to the archive.
+        :param columns: The column names, in the same order as the values in each row
+        :param rows: An iterable of row tuples
+        :param rule_name: The clean-up rule the rows were removed by, recorded with each row that doesn't already have
+            a cleanup_rule column of its own
+        :return: The number of rows written
+        """
+        started = time.monotonic()
+        time_index = columns.index(self.time_column)
+        num_rows = 0
+        for row in rows:
+            record = dict(zip(columns, row))
+            if rule_name is not None and record.get('cleanup_rule') is None:
+                record['cleanup_rule'] = rule_name
+            event_time = row[time_index]
+            # Rows without a time go in a file of their own
+            date_string = event_time.strftime('%Y-%m-%d') if event_time is not None else '0000-00-00'
+            self._open_file(date_string).write(json.dumps(record, default=str) + '\n')
+            num_rows += 1
+        self.rows_archived += num_rows
+        self.seconds += time.monotonic() - started
+        return num_rows
+
+    def flush(self):
+        """
+        Makes sure everything written so far is on disk.  Call this before committing the delete of the rows.
+        """
+        for open_file in self._open_files.values():
+            open_file.flush()
+            os.fsync(open_file.fileno())
+
+    def close(self):
+        for open_file in self._open_files.values():
+            open_file.close()
+        self._open_files.clear()
+
+    def rows_per_sec(self):
+        return self.rows_archived / self.seconds if self.seconds > 0 else 0.0
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+Size monitoring for the Aquarius aq_event_log_ table, and deciding when it needs to be cleaned.
+
+The total number of rows is read from SQL Server's partition statistics, which takes the same time however big the
+table is, rather than from a COUNT(*) scan of the table we are trying to keep small.  Every sample is kept in a local
+JSON-lines file, so the growth of the table can be followed over time, and the clean-up only needs to run when the
+table is too big or growing too fast.  The new events since the last sample can also be counted by category (the
+retention rule they match, or "other"), but that reads the table itself, so it is only done when asked for.
+"""
+
+import os
+import json
+import datetime
+import pytz
+import aq_cleanup
+
+__author__ = 'Sara Geleskie Damiano'
+__contact__ = 'sdamiano@stroudcenter.org'
+
+
+def get_event_log_row_count(cursor):
+    """
+    Reads the number of rows in aq_event_log_ from the partition statistics, without touching the table itself.
+    The login needs the VIEW DATABASE STATE permission.
+    :param cursor: An open cursor on the Aquarius database
+    :return: The number of rows in aq_event_log_
+    """
+    cursor.execute("""
+        SELECT
+            SUM(row_count)
+        FROM
+            sys.dm_db_partition_stats
+        WHERE
+            object_id = OBJECT_ID('aq_event_log_') AND index_id IN (0, 1)
+        ;
+    """)
+    row_count = cursor.fetchone()[0]
+    return int(row_count or 0)
+
+
+def count_new_events_by_category(cursor, rules, since):
+    """
+    Counts the events logged since the given time, by the first retention rule each one matches.  Only the new
+    events are read, but finding them is a scan of aq_event_log_ unless eventTime_ is indexed, so this is opt-in.
+    :param cursor: An open cursor on the Aquarius database
+    :param rules: A list of retention rules from aq_cleanup
+    :param since: The eventTime_ to count from, as a string in aq_cleanup.event_time_format
+    :return: A dictionary of the number of new events for each rule name, and "other" for events no rule matches
+    """
+    cases = []
+    params = []
+    for rule in rules:
+        predicate, rule_params = aq_cleanup.compile_rule_predicate(rule)
+        cases.append("WHEN {} THEN %s".format(predicate))
+        params.extend(rule_params + [rule['name']])
+    category = "CASE {} ELSE 'other' END".format(" ".join(cases)) if cases else "'other'"
+    cursor.execute("""
+        SELECT
+            category, COUNT(*)
+        FROM
+            (SELECT {} AS category FROM aq_event_log_ WHERE eventTime_ >= %s) AS new_events
+        GROUP BY
+            category
+        ;
+    """.format(category), tuple(params + [since]))
+    return dict((category, count) for category, count in cursor.fetchall())
+
+
+class EventLogMonitor(object):
+    """
+    A JSON-lines store of samples of the size of aq_event_log_, and the rules for when the clean-up should run.
+    """
+
+    def __init__(self, store_file, max_rows=None, max_growth_per_hour=None, debug=False):
+        """
+        :param store_file: The JSON-lines file the samples are kept in
+        :param max_rows: Clean up whenever the table has more rows than this, None for no limit
+        :param max_growth_per_hour: Clean up whenever the table grew faster than this many rows an hour since the
+            last sample, None for no limit
+        :param debug: A boolean for whether extra print commands apply
+        """
+        self.store_file = store_file
+        self.max_rows = max_rows
+        self.max_growth_per_hour = max_growth_per_hour
+        self.debug = debug
+
+        store_directory = os.path.dirname(store_file)
+        if store_directory and not os.path.isdir(store_directory):
+            os.makedirs(store_directory)
+
+    def read(self):
+        samples = []
+        if os.path.isfile(self.store_file):
+            with open(self.store_file, 'r') as open_store:
+                for line in open_store:
+                    if line.strip():
+                        samples.append(json.loads(line))
+        return samples
+
+    def last_sample(self):
+        samples = self.read()
+        return samples[-1] if len(samples) > 0 else None
+
+    def record(self, total_rows, sampled_at, phase, new_events=None):
+        """
+        Adds a sample to the store.
+        :param total_rows: The number of rows in aq_event_log_
+        :param sampled_at: The time of the sample, timezone aware
+        :param phase: When the sample was taken, generally "before cleaning" or "after cleaning"
+        :param new_events: A dictionary of the number of new events by category since the last sample, if counted
+        :return: The sample
+        """
+        sample = {'sampled_at': sampled_at.astimezone(pytz.utc).isoformat(),
+                  'phase': phase,
+                  'total_rows': int(total_rows),
+                  'new_events': new_events}
+        with open(self.store_file, 'a') as open_store:
+            open_store.write(json.dumps(sample) + '\n')
+        if self.debug:
+            print("Recorded {} rows in aq_event_log_ {}".format(total_rows, phase))
+        return sample
+
+    @staticmethod
+    def growth_per_hour(previous_sample, sample):
+        """
+        The number of rows the table grew by per hour between two samples.
+        """
+        previous_time = datetime.datetime.fromisoformat(previous_sample['sampled_at'])
+        sample_time = datetime.datetime.fromisoformat(sample['sampled_at'])
+        hours = (sample_time - previous_time).total_seconds() / 3600.0
+        if hours <= 0:
+            return None
+        return (sample['total_rows'] - previous_sample['total_rows']) / hours
+
+    def cleanup_reason(self, sample, previous_sample):
+        """
+        Decides whether the clean-up should run.
+        :param sample: The latest sample
+        :param previous_sample: The sample before it, or None
+        :return: The reason the clean-up should run, or None if it doesn't need to
+        """
+        if self.max_rows is None and self.max_growth_per_hour is None:
+            return "no size or growth limits are set"
+        if self.max_rows is not None and sample['total_rows'] > self.max_rows:
+            return "{} rows is more than the limit of {}".format(sample['total_rows'], self.max_rows)
+        if self.max_growth_per_hour is not None and previous_sample is not None:
+            growth = self.growth_per_hour(previous_sample, sample)
+            if growth is not None and growth > self.max_growth_per_hour:
+                return "growth of {:.0f} rows an hour is more than the limit of {}".format(
+                    growth, self.max_growth_per_hour)
+        return None
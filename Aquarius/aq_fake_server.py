@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+A local stand-in for the Aquarius acquisition SOAP service, for profiling and regression testing appends without
+touching the real Aquarius server.
+
+The server runs in a background thread and serves both its own WSDL and the SOAP operations that aq_utils uses:
+GetAuthToken, IsConnectionValid, KeepConnectionAlive, GetLocation, GetAllLocations, GetTimeSeriesListForLocation and
+AppendTimeSeriesFromBytes2.  Responses can be slowed down, failed with SOAP faults, and tokens can be made to expire
+so re-authentication is exercised.  Like IIS, it can gzip its responses and accept gzipped requests.  Every call,
+every appended point and every byte on the wire is counted.
+"""
+
+import time
+import gzip
+import base64
+import random
+import threading
+import collections
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+__author__ = 'Sara Geleskie Damiano'
+__contact__ = 'sdamiano@stroudcenter.org'
+
+soap_namespace = 'http://schemas.xmlsoap.org/soap/envelope/'
+service_namespace = 'http://tempuri.org/'
+dto_namespace = 'http://schemas.datacontract.org/2004/07/AQAcquisitionService.Dto'
+
+# The operations the fake serves: the request parameters, the type of the result, and whether the operation needs
+# the AQAuthToken header
+operations = collections.OrderedDict([
+    ('GetAuthToken', ([('user', 'xs:string'), ('encodedPassword', 'xs:string')], 'xs:string', False)),
+    ('IsConnectionValid', ([], 'xs:boolean', True)),
+    ('KeepConnectionAlive', ([], None, True)),
+    ('GetLocation', ([('locationId', 'xs:long')], 'dto:LocationDTO', True)),
+    ('GetAllLocations', ([], 'dto:ArrayOfLocationDTO', True)),
+    ('GetTimeSeriesListForLocation', ([('locationId', 'xs:long')], 'dto:ArrayOfTimeSeriesDescription', True)),
+    ('AppendTimeSeriesFromBytes2', ([('id', 'xs:long'), ('csvbytes', 'xs:base64Binary'), ('userName', 'xs:string')],
+                                    'dto:AppendResult', True)),
+])
+
+dto_types = collections.OrderedDict([
+    ('LocationDTO', [('Identifier', 'xs:string'), ('LocationId', 'xs:long'), ('LocationName', 'xs:string'),
+                     ('UtcOffset', 'xs:double')]),
+    ('TimeSeriesDescription', [('AqDataID', 'xs:long'), ('Identifier', 'xs:string'), ('Label', 'xs:string')]),
+    ('AppendResult', [('AppendToken', 'xs:long'), ('NumPointsAppended', 'xs:int'), ('TsIdentifier', 'xs:string')]),
+])
+
+
+def build_wsdl(service_url):
+    """
+    Builds a document/literal WSDL for the fake service.
+    :param service_url: The url the SOAP requests should be posted to
+    :return: The WSDL, as a string
+    """
+    dto_schema = []
+    for type_name, fields in dto_types.items():
+        dto_schema.append('<xs:complexType name="{}"><xs:sequence>{}</xs:sequence></xs:complexType>'.format(
+            type_name, ''.join('<xs:element minOccurs="0" name="{}" nillable="true" type="{}"/>'.format(*field)
+                               for field in fields)))
+        dto_schema.append('<xs:element name="{0}" nillable="true" type="dto:{0}"/>'.format(type_name))
+    # The (optional, never sent) attribute on the array types stops zeep from unwrapping them into bare lists, so
+    # the results have .LocationDTO and .TimeSeriesDescription just like the real service's do in aq_utils
+    for type_name in ['LocationDTO', 'TimeSeriesDescription']:
+        dto_schema.append('<xs:complexType name="ArrayOf{0}"><xs:sequence>'
+                          '<xs:element minOccurs="0" maxOccurs="unbounded" name="{0}" nillable="true" type="dto:{0}"/>'
+                          '</xs:sequence><xs:attribute name="Count" type="xs:int" use="optional"/>'
+                          '</xs:complexType>'.format(type_name))
+
+    service_schema = ['<xs:element name="AQAuthToken" nillable="true" type="xs:string"/>']
+    messages = ['<wsdl:message name="AQAuthTokenHeader"><wsdl:part name="AQAuthToken" element="tns:AQAuthToken"/>'
+                '</wsdl:message>']
+    port_type = []
+    binding = []
+    for operation, (parameters, result_type, needs_token) in operations.items():
+        service_schema.append('<xs:element name="{}"><xs:complexType><xs:sequence>{}</xs:sequence></xs:complexType>'
+                              '</xs:element>'.format(
+                                  operation,
+                                  ''.join('<xs:element minOccurs="0" name="{}" type="{}"/>'.format(*parameter)
+                                          for parameter in parameters)))
+        result = '' if result_type is None else \
+            '<xs:element minOccurs="0" name="{}Result" nillable="true" type="{}"/>'.format(operation, result_type)
+        service_schema.append('<xs:element name="{}Response"><xs:complexType><xs:sequence>{}</xs:sequence>'
+                              '</xs:complexType></xs:element>'.format(operation, result))
+        messages.append('<wsdl:message name="{0}Input"><wsdl:part name="parameters" element="tns:{0}"/>'
+                        '</wsdl:message>'.format(operation))
+        messages.append('<wsdl:message name="{0}Output"><wsdl:part name="parameters" element="tns:{0}Response"/>'
+                        '</wsdl:message>'.format(operation))
+        port_type.append('<wsdl:operation name="{0}"><wsdl:input message="tns:{0}Input"/>'
+                         '<wsdl:output message="tns:{0}Output"/></wsdl:operation>'.format(operation))
+        header = '<soap:header message="tns:AQAuthTokenHeader" part="AQAuthToken" use="literal"/>' \
+            if needs_token else ''
+        binding.append('<wsdl:operation name="{0}"><soap:operation soapAction="{1}IAQAcquisitionService/{0}" '
+                       'style="document"/><wsdl:input>{2}<soap:body use="literal"/></wsdl:input>'
+                       '<wsdl:output><soap:body use="literal"/></wsdl:output></wsdl:operation>'.format(
+                           operation, service_namespace, header))
+
+    return ('<?xml version="1.0" encoding="utf-8"?>'
+            '<wsdl:definitions name="AQAcquisitionService" targetNamespace="{tns}" '
+            'xmlns:wsdl="http://schemas.xmlsoap.org/wsdl/" xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/" '
+            'xmlns:xs="http://www.w3.org/2001/XMLSchema" xmlns:tns="{tns}" xmlns:dto="{dto}">'
+            '<wsdl:types>'
+            '<xs:schema elementFormDefault="qualified" targetNamespace="{dto}">{dto_schema}</xs:schema>'
+            '<xs:schema elementFormDefault="qualified" targetNamespace="{tns}">'
+            '<xs:import namespace="{dto}"/>{service_schema}</xs:schema>'
+            '</wsdl:types>'
+            '{messages}'
+            '<wsdl:portType name="IAQAcquisitionService">{port_type}</wsdl:portType>'
+            '<wsdl:binding name="BasicHttpBinding_IAQAcquisitionService" type="tns:IAQAcquisitionService">'
+            '<soap:binding transport="http://schemas.xmlsoap.org/soap/http"/>{binding}</wsdl:binding>'
+            '<wsdl:service name="AQAcquisitionService">'
+            '<wsdl:port name="BasicHttpBinding_IAQAcquisitionService" '
+            'binding="tns:BasicHttpBinding_IAQAcquisitionService"><soap:address location="{url}"/></wsdl:port>'
+            '</wsdl:service>'
+            '</wsdl:definitions>').format(tns=service_namespace, dto=dto_namespace, url=escape(service_url),
+                                          dto_schema=''.join(dto_schema), service_schema=''.join(service_schema),
+                                          messages=''.join(messages), port_type=''.join(port_type),
+                                          binding=''.join(binding))
+
+
+def _dto_xml(type_name, values):
+    return ''.join('<a:{0}>{1}</a:{0}>'.format(field, escape(str(values[field])))
+                   for field, field_type in dto_types[type_name] if values.get(field) is not None)
+
+
+class SoapFault(Exception):
+    pass
+
+
+class _AcquisitionHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so that clients can keep their connections alive between calls
+    protocol_version = 'HTTP/1.1'
+
+    def _respond(self, status_code, body, content_type='text/xml; charset=utf-8'):
+        body = bytes(body, 'utf-8')
+        compress = self.server.fake.compress_responses and 'gzip' in self.headers.get('Accept-Encoding', '')
+        if compress:
+            body = gzip.compress(body)
+        self.send_response(status_code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if compress:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        self.wfile.write(body)
+        return len(body)
+
+    def do_GET(self):
+        self._respond(200, build_wsdl(self.server.fake.url))
+
+    def do_POST(self):
+        fake = self.server.fake
+        request_body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        wire_bytes = len(request_body)
+        if self.headers.get('Content-Encoding', '').lower() == 'gzip':
+            if not fake.accept_compressed_requests:
+                response_bytes = self._respond(415, 'Unsupported Media Type', 'text/plain')
+                fake.count_bytes(wire_bytes, response_bytes)
+                return
+            request_body = gzip.decompress(request_body)
+        try:
+            result = fake.handle(request_body)
+        except SoapFault as e:
+            response = ('<s:Envelope xmlns:s="{}"><s:Body><s:Fault><faultcode>s:Server</faultcode>'
+                        '<faultstring>{}</faultstring></s:Fault></s:Body></s:Envelope>').format(
+                soap_namespace, escape(str(e)))
+            response_bytes = self._respond(500, response)
+        else:
+            response = '<s:Envelope xmlns:s="{}"><s:Body>{}</s:Body></s:Envelope>'.format(soap_namespace, result)
+            response_bytes = self._respond(200, response)
+        fake.count_bytes(wire_bytes, response_bytes)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeAcquisitionServer(object):
+    """
+    A fake Aquarius acquisition service.  Use as a context manager, or call start() and stop().
+    """
+
+    def __init__(self, locations=None, latency=0.0, append_latency_per_point=0.0, fault_rate=0.0,
+                 fault_operations=('AppendTimeSeriesFromBytes2',), token_lifetime=None, compress_responses=True,
+                 accept_compressed_requests=True, seed=None):
+        """
+        :param locations: A dictionary of location id to a dictionary with the location's "Identifier", "UtcOffset"
+            and a list of the numeric ids of its time series under "series"
+        :param latency: Seconds to wait before answering every call
+        :param append_latency_per_point: Extra seconds to wait for each point appended
+        :param fault_rate: The fraction of calls to the fault_operations which should fail with a SOAP fault
+        :param fault_operations: The operations that faults are injected into
+        :param token_lifetime: Seconds before an authentication token stops being valid, None for never
+        :param compress_responses: Whether to gzip responses for clients that accept it
+        :param accept_compressed_requests: Whether gzipped requests are accepted, rather than answered with a 415
+        :param seed: A seed for the random faults, so runs can be repeated
+        """
+        self.locations = locations if locations is not None else {}
+        self.latency = latency
+        self.append_latency_per_point = append_latency_per_point
+        self.fault_rate = fault_rate
+        self.fault_operations = set(fault_operations)
+        self.token_lifetime = token_lifetime
+        self.compress_responses = compress_responses
+        self.accept_compressed_requests = accept_compressed_requests
+        self._random = random.Random(seed)
+
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self._next_append_token = 1
+        self.series_by_id = {}
+        for location_id, location in self.locations.items():
+            for ts_numeric_id in location.get('series', []):
+                self.series_by_id[ts_numeric_id] = location_id
+        self.reset()
+
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/AQAcquisitionService.svc'.format(self._server.server_port)
+
+    @property
+    def wsdl_url(self):
+        return self.url + '?wsdl'
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _AcquisitionHandler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.wsdl_url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def reset(self):
+        """
+        Clears all of the call, byte and point counters.
+        """
+        with self._lock:
+            self.call_counts = collections.Counter()
+            self.fault_counts = collections.Counter()
+            self.points_appended = collections.Counter()
+            self.request_bytes = 0
+            self.response_bytes = 0
+
+    def count_bytes(self, request_bytes, response_bytes):
+        with self._lock:
+            self.request_bytes += request_bytes
+            self.response_bytes += response_bytes
+
+    def _token_is_valid(self, token):
+        issued = self._tokens.get(token)
+        if issued is None:
+            return False
+        return self.token_lifetime is None or time.monotonic() - issued < self.token_lifetime
+
+    def handle(self, request_body):
+        """
+        Answers a single SOAP request.
+        :param request_body: The SOAP envelope that was posted
+        :return: The XML for the response element, to be put in the body of the response envelope
+        """
+        envelope = ET.fromstring(request_body)
+        body = envelope.find('{{{}}}Body'.format(soap_namespace))
+        request = body[0]
+        operation = request.tag.split('}')[-1]
+        parameters = dict((child.tag.split('}')[-1], child.text) for child in request)
+        token = None
+        header = envelope.find('{{{}}}Header'.format(soap_namespace))
+        if header is not None:
+            for child in header:
+                if child.tag.split('}')[-1] == 'AQAuthToken':
+                    token = child.text
+
+        with self._lock:
+            self.call_counts[operation] += 1
+            inject_fault = operation in self.fault_operations and self._random.random() < self.fault_rate
+
+        if operation not in operations:
+            raise SoapFault('Unknown operation {}'.format(operation))
+        wait = self.latency
+        num_points = 0
+        if operation == 'AppendTimeSeriesFromBytes2' and parameters.get('csvbytes'):
+            csv_bytes = base64.b64decode(parameters['csvbytes'])
+            num_points = len([line for line in csv_bytes.splitlines() if line.strip()])
+            wait += self.append_latency_per_point * num_points
+        if wait > 0:
+            time.sleep(wait)
+        if inject_fault:
+            with self._lock:
+                self.fault_counts[operation] += 1
+            raise SoapFault('Injected fault in {}'.format(operation))
+
+        with self._lock:
+            if operation == 'GetAuthToken':
+                token = '{:032x}'.format(self._random.getrandbits(128))
+                self._tokens[token] = time.monotonic()
+                return self._result(operation, escape(token))
+            if operation == 'IsConnectionValid':
+                return self._result(operation, 'true' if self._token_is_valid(token) else 'false')
+            if not self._token_is_valid(token):
+                raise SoapFault('The authentication token is not valid')
+            if operation == 'KeepConnectionAlive':
+                self._tokens[token] = time.monotonic()
+                return '<{0}Response xmlns="{1}"/>'.format(operation, service_namespace)
+            if operation == 'GetLocation':
+                return self._result(operation, self._location_xml(int(parameters['locationId'])))
+            if operation == 'GetAllLocations':
+                return self._result(operation, ''.join(
+                    '<a:LocationDTO>{}</a:LocationDTO>'.format(self._location_xml(location_id))
+                    for location_id in self.locations))
+            if operation == 'GetTimeSeriesListForLocation':
+                location_id = int(parameters['locationId'])
+                return self._result(operation, ''.join(
+                    '<a:TimeSeriesDescription>{}</a:TimeSeriesDescription>'.format(
+                        _dto_xml('TimeSeriesDescription', {'AqDataID': ts_numeric_id,
+                                                           'Identifier': self._ts_identifier(ts_numeric_id),
+                                                           'Label': 'Series{}'.format(ts_numeric_id)}))
+                    for ts_numeric_id in self.locations.get(location_id, {}).get('series', [])))
+            if operation == 'AppendTimeSeriesFromBytes2':
+                ts_numeric_id = int(parameters['id'])
+                if ts_numeric_id not in self.series_by_id:
+                    raise SoapFault('Time series {} does not exist'.format(ts_numeric_id))
+                self.points_appended[ts_numeric_id] += num_points
+                append_token = self._next_append_token
+                self._next_append_token += 1
+                return self._result(operation, _dto_xml('AppendResult', {
+                    'AppendToken': append_token, 'NumPointsAppended': num_points,
+                    'TsIdentifier': self._ts_identifier(ts_numeric_id)}))
+
+    def _ts_identifier(self, ts_numeric_id):
+        location = self.locations[self.series_by_id[ts_numeric_id]]
+        return 'Series{}@{}'.format(ts_numeric_id, location['Identifier'])
+
+    def _location_xml(self, location_id):
+        if location_id not in self.locations:
+            raise SoapFault('Location {} does not exist'.format(location_id))
+        location = self.locations[location_id]
+        return _dto_xml('LocationDTO', {'Identifier': location['Identifier'], 'LocationId': location_id,
+                                        'LocationName': location.get('LocationName', location['Identifier']),
+                                        'UtcOffset': location.get('UtcOffset', -5.0)})
+
+    def _result(self, operation, result_xml):
+        return '<{0}Response xmlns="{1}"><{0}Result xmlns:a="{2}">{3}</{0}Result></{0}Response>'.format(
+            operation, service_namespace, dto_namespace, result_xml)
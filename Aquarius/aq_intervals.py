@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+Coalescing of time ranges, for reconnecting metadata records that were split apart.
+
+Within each group (for metadata, one time series, type and payload) the ranges are sorted once by their start and swept
+in order, keeping the running latest end.  A range that starts after the running end begins a new run; a range that
+starts at or before it (touching or overlapping) joins the current one.  Every step is a whole-array numpy operation,
+so the cost is that of the sort, O(n log n), however many groups there are.
+"""
+
+import numpy as np
+
+__author__ = 'Sara Geleskie Damiano'
+__contact__ = 'sdamiano@stroudcenter.org'
+
+
+def coalesce_intervals(group_codes, starts, ends):
+    """
+    Finds the runs of touching or overlapping ranges within each group.
+    :param group_codes: An integer array of the group of each range
+    :param starts: An integer array of the start of each range (datetimes can be viewed as int64)
+    :param ends: An integer array of the end of each range
+    :return: A dictionary of arrays: "run", the run number of each range; "keep", True for the one range kept for each
+        run (the last to start, or of those starting together the last given); and "run_start", "run_end" and
+        "run_size", the merged range and number of ranges of each run, indexed by run number
+    """
+    group_codes = np.asarray(group_codes, dtype=np.int64)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    num_ranges = len(starts)
+    if num_ranges == 0:
+        empty = np.array([], dtype=np.int64)
+        return {'run': empty, 'keep': np.array([], dtype=bool),
+                'run_start': empty, 'run_end': empty, 'run_size': empty}
+
+    # Sort by group, then start, then position; lexsort is stable and sorts on the last key first
+    order = np.lexsort((np.arange(num_ranges), starts, group_codes))
+    sorted_groups = group_codes[order]
+    sorted_starts = starts[order]
+    sorted_ends = ends[order]
+
+    # The running latest end within each group.  Replacing each end by its rank and offsetting the ranks by the group
+    # number (groups are in increasing order) lets a single maximum.accumulate run over all of the groups at once.
+    end_order = np.argsort(sorted_ends, kind='stable')
+    end_rank = np.empty(num_ranges, dtype=np.int64)
+    end_rank[end_order] = np.arange(num_ranges)
+    group_number = np.concatenate(([0], np.cumsum(sorted_groups[1:] != sorted_groups[:-1])))
+    running_rank = np.maximum.accumulate(group_number * num_ranges + end_rank) - group_number * num_ranges
+    running_end = sorted_ends[end_order[running_rank]]
+
+    # A run begins at the first range of each group, and wherever a range starts after everything before it has ended
+    new_run = np.ones(num_ranges, dtype=bool)
+    new_run[1:] = (group_number[1:] != group_number[:-1]) | (sorted_starts[1:] > running_end[:-1])
+    run_first = np.flatnonzero(new_run)
+    run_last = np.append(run_first[1:] - 1, num_ranges - 1)
+    sorted_run = np.cumsum(new_run) - 1
+
+    run = np.empty(num_ranges, dtype=np.int64)
+    run[order] = sorted_run
+    keep = np.zeros(num_ranges, dtype=bool)
+    keep[order[run_last]] = True
+    return {'run': run,
+            'keep': keep,
+            'run_start': sorted_starts[run_first],
+            'run_end': running_end[run_last],
+            'run_size': run_last - run_first + 1}
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+A local write-ahead journal for appends to Aquarius.
+
+Every chunk of data is written to the journal (with a copy of its payload) *before* it is sent to Aquarius, and the
+outcome of the append is written after.  If a run dies part of the way through, the chunks that were planned but
+never finished can be found in the journal and replayed without re-querying DreamHost or repeating the chunks that
+did make it into Aquarius.  When a later run plans the same points again, the unfinished chunks it covers are marked
+as superseded, so a resume after it doesn't append them a second time.
+"""
+
+import os
+import json
+import uuid
+import hashlib
+import datetime
+import pytz
+
+__author__ = 'Sara Geleskie Damiano'
+__contact__ = 'sdamiano@stroudcenter.org'
+
+
+def hash_payload(payload):
+    """
+    Creates the hash used to verify that a spooled payload is the same one that was planned.
+    :param payload: The bytes (or string) that will be sent to Aquarius
+    :return: A hex sha1 digest of the payload
+    """
+    if isinstance(payload, str):
+        payload = bytes(payload, 'ascii')
+    return hashlib.sha1(payload).hexdigest()
+
+
+def _parse_timestamp(timestamp):
+    if timestamp is None:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(str(timestamp))
+    except ValueError:
+        return None
+
+
+class AppendJournal(object):
+    """
+    A JSON-lines journal of planned chunks and their append outcomes.
+
+    Each line of the journal file is one event; either "planned" (written before the append is attempted),
+    "appended"/"failed" (written after) or "superseded" (written when a later run plans the same points again).
+    Every line is flushed and synced to disk as soon as it is written, so the journal is always at least as up-to-date
+    as Aquarius is.  Payloads are spooled to their own files next to the journal and are removed once they have been
+    appended or superseded.
+    """
+
+    def __init__(self, journal_directory, run_id=None, debug=False):
+        self.journal_directory = journal_directory
+        self.payload_directory = os.path.join(journal_directory, 'payloads')
+        self.journal_file = os.path.join(journal_directory, 'AppendJournal.jsonl')
+        self.run_id = run_id if run_id is not None else uuid.uuid4().hex
+        self.debug = debug
+        self._chunk_number = 0
+
+        if not os.path.isdir(self.payload_directory):
+            os.makedirs(self.payload_directory)
+
+    def _write_event(self, event):
+        event['run_id'] = event.get('run_id', self.run_id)
+        event['recorded'] = datetime.datetime.now(pytz.utc).isoformat()
+        with open(self.journal_file, 'a') as open_journal:
+            open_journal.write(json.dumps(event) + '\n')
+            open_journal.flush()
+            os.fsync(open_journal.fileno())
+
+    def _payload_path(self, chunk_id):
+        return os.path.join(self.payload_directory, '{}.csv'.format(chunk_id))
+
+    def read_events(self):
+        """
+        Reads all of the events in the journal.  A partially written final line (from a crash in the middle of a
+        write) is skipped.
+        :return: A list of event dictionaries, in the order they were written
+        """
+        events = []
+        if not os.path.isfile(self.journal_file):
+            return events
+        with open(self.journal_file, 'r') as open_journal:
+            for line in open_journal:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    if self.debug:
+                        print("Skipping unreadable journal line: {}".format(line.strip()))
+        return events
+
+    def plan_chunk(self, ts_numeric_id, payload, num_points, table_name=None, column_name=None,
+                   first_timestamp=None, last_timestamp=None):
+        """
+        Records that a chunk is about to be appended and spools the payload to disk.
+        :param ts_numeric_id: The integer primary key of the Aquarius time series
+        :param payload: The csv bytes that will be appended
+        :param num_points: The number of points in the chunk
+        :param table_name: The DreamHost table the data came from
+        :param column_name: The DreamHost column the data came from
+        :param first_timestamp: The first timestamp in the chunk
+        :param last_timestamp: The last timestamp in the chunk
+        :return: The planned chunk, as a dictionary
+        """
+        self._chunk_number += 1
+        chunk_id = '{}-{:06d}'.format(self.run_id, self._chunk_number)
+
+        payload_path = self._payload_path(chunk_id)
+        with open(payload_path, 'wb') as open_payload:
+            open_payload.write(payload if isinstance(payload, bytes) else bytes(payload, 'ascii'))
+            open_payload.flush()
+            os.fsync(open_payload.fileno())
+
+        chunk = {'event': 'planned',
+                 'chunk_id': chunk_id,
+                 'ts_numeric_id': int(ts_numeric_id),
+                 'table_name': table_name,
+                 'column_name': column_name,
+                 'num_points': int(num_points),
+                 'first_timestamp': None if first_timestamp is None else str(first_timestamp),
+                 'last_timestamp': None if last_timestamp is None else str(last_timestamp),
+                 'payload_hash': hash_payload(payload)}
+        self._write_event(chunk)
+        if self.debug:
+            print("Planned chunk {} ({} points to time series {})".format(chunk_id, num_points, ts_numeric_id))
+        return chunk
+
+    def record_outcome(self, chunk, append_result):
+        """
+        Records the result of an append.  Chunks which received an append token are finished and their spooled
+        payload is removed; anything else is recorded as failed and will be picked up by a resume.
+        :param chunk: The planned chunk dictionary
+        :param append_result: The append result from the SOAP client
+        :return: True if the append was successful
+        """
+        append_token = getattr(append_result, 'AppendToken', None)
+        succeeded = append_token is not None and append_token != 0
+        self._write_event({'event': 'appended' if succeeded else 'failed',
+                           'run_id': chunk['run_id'],
+                           'chunk_id': chunk['chunk_id'],
+                           'append_token': None if append_token is None else str(append_token),
+                           'num_points_appended': getattr(append_result, 'NumPointsAppended', None),
+                           'ts_identifier': str(getattr(append_result, 'TsIdentifier', ''))})
+        if succeeded:
+            payload_path = self._payload_path(chunk['chunk_id'])
+            if os.path.isfile(payload_path):
+                os.remove(payload_path)
+        return succeeded
+
+    def supersede_chunks(self, ts_numeric_id, first_timestamp, last_timestamp):
+        """
+        Marks the unfinished chunks of earlier runs for a time series as superseded if all of their points fall within
+        a range this run is about to plan again, and removes their spooled payloads.
+        :param ts_numeric_id: The integer primary key of the Aquarius time series
+        :param first_timestamp: The first timestamp this run will append to the series
+        :param last_timestamp: The last timestamp this run will append to the series
+        :return: The number of chunks superseded
+        """
+        range_start = _parse_timestamp(first_timestamp)
+        range_end = _parse_timestamp(last_timestamp)
+        if range_start is None or range_end is None:
+            return 0
+        num_superseded = 0
+        for chunk in self.unfinished_chunks():
+            if chunk['run_id'] == self.run_id or chunk['ts_numeric_id'] != int(ts_numeric_id):
+                continue
+            chunk_start = _parse_timestamp(chunk['first_timestamp'])
+            chunk_end = _parse_timestamp(chunk['last_timestamp'])
+            if chunk_start is None or chunk_end is None or chunk_start < range_start or chunk_end > range_end:
+                continue
+            self._write_event({'event': 'superseded',
+                               'run_id': chunk['run_id'],
+                               'chunk_id': chunk['chunk_id'],
+                               'superseded_by': self.run_id})
+            payload_path = self._payload_path(chunk['chunk_id'])
+            if os.path.isfile(payload_path):
+                os.remove(payload_path)
+            num_superseded += 1
+        if self.debug and num_superseded > 0:
+            print("{} unfinished chunks to time series {} superseded".format(num_superseded, ts_numeric_id))
+        return num_superseded
+
+    def unfinished_chunks(self):
+        """
+        Finds all of the chunks that were planned but never successfully appended or superseded.
+        :return: A list of planned chunk dictionaries, in the order they were planned
+        """
+        planned = {}
+        for event in self.read_events():
+            if event.get('event') == 'planned':
+                planned[event['chunk_id']] = event
+            elif event.get('event') in ('appended', 'superseded'):
+                planned.pop(event['chunk_id'], None)
+        return list(planned.values())
+
+    def load_payload(self, chunk):
+        """
+        Reads the spooled payload for a chunk and verifies it against the hash recorded when it was planned.
+        :param chunk: The planned chunk dictionary
+        :return: The payload bytes, or None if the payload is missing or does not match its hash
+        """
+        payload_path = self._payload_path(chunk['chunk_id'])
+        if not os.path.isfile(payload_path):
+            if self.debug:
+                print("Payload for chunk {} is missing".format(chunk['chunk_id']))
+            return None
+        with open(payload_path, 'rb') as open_payload:
+            payload = open_payload.read()
+        if hash_payload(payload) != chunk['payload_hash']:
+            if self.debug:
+                print("Payload for chunk {} does not match its hash".format(chunk['chunk_id']))
+            return None
+        return payload
+
+    def compact(self):
+        """
+        Rewrites the journal keeping only the chunks which are still unfinished, so the journal does not grow
+        without bound.  The new journal is written to a temporary file and then swapped in.
+        :return: The number of unfinished chunks kept in the journal
+        """
+        unfinished = self.unfinished_chunks()
+        temp_file = self.journal_file + '.tmp'
+        with open(temp_file, 'w') as open_journal:
+            for chunk in unfinished:
+                open_journal.write(json.dumps(chunk) + '\n')
+            open_journal.flush()
+            os.fsync(open_journal.fileno())
+        os.replace(temp_file, self.journal_file)
+        return len(unfinished)
@@ -0,0 +1,543 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+Cleaning of the Aquarius TimeSeriesMeta table, a batch of time series at a time.
+
+Metadata is only ever compared within a single time series, so the table can be cleaned in batches of TimeSeriesIDs
+with exactly the same result as cleaning it all at once.  Each batch is read from the database on its own, expanded,
+checked for split ranges, duplicates and empty records, and written back, so memory use depends on the batch size
+rather than on the size of the table.  Batches can be spread over a pool of processes, each with its own connection to
+the database.  Nothing is written to the log from a worker; the messages are handed back to be logged by the caller.
+"""
+
+import os
+import json
+import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pytz
+import pymssql
+import pandas as pd
+import numpy as np
+import aq_xmlblob
+import aq_intervals
+import aq_cleanup
+
+__author__ = 'Sara Geleskie Damiano'
+__contact__ = 'sdamiano@stroudcenter.org'
+
+# Read TimeSeries information into pandas
+ts_df_query = """
+SELECT ts.AQDataID_  as TimeSeriesID,
+       ts.label_ as TS_label,
+       Location.Identifier as LocationCode,
+       ts.parameterType_ as TS_Parm_Code,
+       parameter.displayid as Parameter
+FROM AQAtom_TimeSeries_ as ts
+LEFT JOIN Location
+ON ts.AQParentID_ = Location.LocationID
+LEFT JOIN parameter
+ON ts.parameterType_ = parameter.parameterid
+"""
+
+# These are columns that are unique for every meta-data row
+unique_cols = ['MetaID', 'XmlBlob', 'AQMetadataID', 'StartTime', 'startTime', 'startTime_dt',
+               'EndTime', 'endTime', 'endTime_dt', 'LastModifiedTime', 'DateModified']
+
+# The blob attributes the clean-up rules look at, which not every batch of metadata will have
+rule_cols = ['comment', 'code', 'value', 'startTime', 'endTime', 'dateApplied', 'dateAppliedTZBias']
+
+# The blob attributes which are numbers
+numeric_cols = ['dateApplied', 'dateAppliedTZBias', 'modifiedPoints']
+
+junk_notes = ['Correction was edited', 'Correction was marked as undone', 'Correction was marked as done']
+
+# The kinds of records deleted, with the columns they are counted in groups of and their descriptions in the log
+delete_kinds = [('dups', ['TimeSeriesID', 'TypeName'], 'Duplicate Records', 'Duplicated Records'),
+                ('junk_notes', ['TimeSeriesID'], 'Junk Notes', 'Junk Notes'),
+                ('empty_apr_code', ['TimeSeriesID'], 'Empty Approval Code Lines', 'Empty Approval Code Lines'),
+                ('empty_data_grade', ['TimeSeriesID'], 'Empty Data Grades', 'Empty Data Grades'),
+                ('empty_interp_code', ['TimeSeriesID'], 'Empty Interpolation Code Lines',
+                 'Empty Interpolation Code Lines')]
+
+
+class MessageList(object):
+    """
+    Collects log messages in a worker process so they can be written to the log by the main process.
+    """
+
+    def __init__(self):
+        self.messages = []
+
+    def __call__(self, message, debug_only=False):
+        self.messages.append((message, debug_only))
+
+
+def read_timeseries_info(conn):
+    """
+    Reads the identifiers of every time series, for the log.
+    """
+    ts_df = pd.read_sql(ts_df_query, conn)
+    ts_df['TS_Text_ID'] = ts_df['Parameter'] + '.' + ts_df['TS_label'] + '@' + ts_df['LocationCode']
+    return ts_df
+
+
+def read_metadata_timeseries_ids(conn, modified_since=None):
+    """
+    :param modified_since: Only find the time series with metadata modified after this time, None for all of them
+    :return: A sorted list of the TimeSeriesIDs which have any metadata
+    """
+    cur = conn.cursor()
+    if modified_since is None:
+        cur.execute("SELECT DISTINCT TimeSeriesID FROM TimeSeriesMeta ORDER BY TimeSeriesID;")
+    else:
+        cur.execute("SELECT DISTINCT TimeSeriesID FROM TimeSeriesMeta WHERE LastModifiedTime > %s "
+                    "ORDER BY TimeSeriesID;", (modified_since,))
+    ts_ids = [row[0] for row in cur.fetchall()]
+    cur.close()
+    return ts_ids
+
+
+def read_last_modified_time(conn):
+    """
+    :return: The latest LastModifiedTime in TimeSeriesMeta, or None if the table is empty
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT MAX(LastModifiedTime) FROM TimeSeriesMeta;")
+    last_modified = cur.fetchone()[0]
+    cur.close()
+    return last_modified
+
+
+class MetadataWatermark(object):
+    """
+    A small JSON file holding the latest LastModifiedTime of the metadata that has been cleaned, so the next run only
+    has to clean the time series with metadata modified since.
+    """
+
+    def __init__(self, store_file, debug=False):
+        """
+        :param store_file: The JSON file the watermark is kept in
+        :param debug: A boolean for whether extra print commands apply
+        """
+        self.store_file = store_file
+        self.debug = debug
+
+    def read(self):
+        """
+        :return: The stored watermark, or None if there isn't one
+        """
+        if not os.path.isfile(self.store_file):
+            return None
+        with open(self.store_file, 'r') as open_store:
+            stored = json.load(open_store)
+        return datetime.datetime.fromisoformat(stored['last_modified_time'])
+
+    def write(self, last_modified_time, num_series):
+        """
+        Stores a new watermark.  The file is written to a temporary file and then swapped in, so a run that dies
+        part way through can't leave it half written.
+        :param last_modified_time: The latest LastModifiedTime of the metadata cleaned
+        :param num_series: The number of time series cleaned, for the record
+        """
+        temp_file = self.store_file + '.tmp'
+        with open(temp_file, 'w') as open_store:
+            json.dump({'last_modified_time': last_modified_time.isoformat(),
+                       'series_cleaned': num_series,
+                       'recorded': datetime.datetime.now(pytz.utc).isoformat()}, open_store)
+            open_store.flush()
+            os.fsync(open_store.fileno())
+        os.replace(temp_file, self.store_file)
+        if self.debug:
+            print("Metadata watermark moved to {}".format(last_modified_time))
+
+
+def _timeseries_where(ts_ids):
+    if ts_ids is None:
+        return "", ()
+    return "WHERE TimeSeriesID IN ({})".format(", ".join(["%s"] * len(ts_ids))), tuple(ts_ids)
+
+
+def read_metadata(conn, ts_ids=None):
+    """
+    Reads the metadata for the given time series, or for all of them if ts_ids is None.
+    """
+    where, params = _timeseries_where(ts_ids)
+    return pd.read_sql("SELECT * FROM TimeSeriesMeta {}".format(where), conn, params=params or None)
+
+
+def _parse_times(times):
+    return times.apply(lambda x: datetime.datetime.strptime(str(x), '%Y-%m-%d %H:%M:%S.%f'))
+
+
+def expand_metadata(meta_df, ts_df):
+    """
+    Expands the XML "Blob" of sub-meta-data into columns of its own, joins on the time series identifiers and cleans
+    up the data types.
+    :return: The expanded metadata, sorted by time series, start time, type and application
+    """
+    meta_df['XmlBlob'] = [aq_xmlblob.blob_text(x) for x in meta_df['XmlBlob']]
+    blob_df, _ = aq_xmlblob.decode_blobs(meta_df['XmlBlob'], numeric_columns=numeric_cols)
+    meta_expand = pd.concat([meta_df, blob_df], axis=1)
+    for column in rule_cols:
+        if column not in meta_expand.columns:
+            meta_expand[column] = np.nan
+    full_df = meta_expand.merge(ts_df, on='TimeSeriesID')
+
+    # Clean up Data Types
+    if full_df['StartTime'].dtype == np.dtype('datetime64[ns]'):
+        full_df['startTime_dt'] = pd.to_datetime(full_df['startTime'], errors='coerce', format='%Y-%m-%d %H:%M:%S.%f')
+    else:
+        full_df['startTime'] = full_df['startTime'].fillna(value='1899-12-30 00:00:00.000')
+        full_df['startTime_dt'] = _parse_times(full_df['startTime'])
+    if full_df['EndTime'].dtype == np.dtype('datetime64[ns]'):
+        full_df['endTime_dt'] = pd.to_datetime(full_df['endTime'], errors='coerce', format='%Y-%m-%d %H:%M:%S.%f')
+    else:
+        full_df['endTime'] = full_df['endTime'].fillna(value='4637-11-26 00:00:00.000')
+        full_df['endTime_dt'] = _parse_times(full_df['endTime'])
+    # Rule columns added above as blanks still need to be numbers
+    full_df['dateApplied'] = pd.to_numeric(full_df['dateApplied'])
+    full_df['dateAppliedTZBias'] = pd.to_numeric(full_df['dateAppliedTZBias'])
+
+    # Sort the list
+    full_df.sort_values(by=['TimeSeriesID', 'StartTime', 'TypeName', 'DateApplied', 'DateModified'], inplace=True)
+    # Fill the blanks so they still group together; the columns with blanks become mixed type
+    null_cols = full_df.columns[full_df.isnull().any()]
+    full_df[null_cols] = full_df[null_cols].astype(object).fillna(value=-9999)
+    return full_df
+
+
+def _time_values(times):
+    # Microseconds since the epoch, which covers the far off dates Aquarius uses for open ended ranges
+    return np.asarray(times.values, dtype='datetime64[us]').astype(np.int64)
+
+
+def _time_strings(times):
+    if times.dtype.kind == 'M':
+        long_strings = times.dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+    else:
+        long_strings = times.apply(
+            lambda x: "%02d-%02d-%02d %02d:%02d:%02d.%03d" %
+            (x.year, x.month, x.day, x.hour, x.minute, x.second, x.microsecond))
+    return long_strings.str[0:23]
+
+
+def find_metadata_changes(full_df):
+    """
+    Finds the metadata ranges to reconnect and the records to delete.
+    :param full_df: Expanded metadata from expand_metadata
+    :return: A dictionary of data frames: the de-duplicated metadata ("dedupped_aggr"), the ranges to update
+        ("values_to_update") and the records to delete for each of the delete_kinds
+    """
+    non_unique_cols = [column for column in full_df.columns.values.tolist() if column not in unique_cols]
+    payload_cols = [column for column in non_unique_cols if column not in ['TimeSeriesID', 'TypeName']]
+
+    # Records of the same time series and type with exactly the same payload are coalesced, but only where their ranges
+    # touch or overlap; the same payload on ranges far apart is left as it is
+    payload_hash = pd.util.hash_pandas_object(full_df[payload_cols], index=False).values
+    group_codes = pd.MultiIndex.from_arrays([full_df['TimeSeriesID'].values, full_df['TypeName'].values,
+                                             payload_hash]).factorize()[0]
+    starts = _time_values(full_df['StartTime'])
+    ends = _time_values(full_df['EndTime'])
+    runs = aq_intervals.coalesce_intervals(group_codes, starts, ends)
+
+    # The record kept for each run takes the whole range of the run; the others are deleted
+    dedupped_aggr = full_df[runs['keep']].copy()
+    kept_runs = runs['run'][runs['keep']]
+    dedupped_aggr['count'] = runs['run_size'][kept_runs]
+    min_start = runs['run_start'][kept_runs]
+    max_end = runs['run_end'][kept_runs]
+    dedupped_aggr['min_start'] = min_start.astype('datetime64[us]')
+    dedupped_aggr['max_end'] = max_end.astype('datetime64[us]')
+    values_to_update = dedupped_aggr[(starts[runs['keep']] != min_start) |
+                                     (ends[runs['keep']] != max_end)].reset_index(drop=True)
+    dedupped_aggr = dedupped_aggr.reset_index(drop=True)
+
+    # Want to update the ranges of metadata because when data is appended and holes are filled in, it splits the
+    # metadata into two separate records around the hole.  This reconnects those records, but it also deletes the
+    # information about which files each point came from.
+    if len(values_to_update) > 0:
+        values_to_update['min_start_str'] = _time_strings(pd.to_datetime(values_to_update['min_start']))
+        values_to_update['max_end_str'] = _time_strings(pd.to_datetime(values_to_update['max_end']))
+        values_to_update['new_blob'] = aq_xmlblob.rewrite_times(
+            values_to_update['XmlBlob'], values_to_update['min_start_str'], values_to_update['max_end_str'])
+
+    return {'dedupped_aggr': dedupped_aggr,
+            'values_to_update': values_to_update,
+            'dups': full_df[~runs['keep']],
+            'junk_notes': full_df[(full_df['TypeName'] == 'NOTE') & (full_df['comment'].isin(junk_notes))],
+            'empty_apr_code': full_df[(full_df['TypeName'] == 'APPROVALCODE') & (full_df['code'] == '-1') &
+                                      (full_df['comment'] == '')],
+            'empty_data_grade': full_df[(full_df['TypeName'] == 'DATAGRADE') & (full_df['value'] == '-1.000') &
+                                        (full_df['comment'] == '')],
+            'empty_interp_code': full_df[(full_df['TypeName'] == 'INTERPOLATIONCODE') & (full_df['comment'] == '') &
+                                         (full_df['value'] == -9999)]}
+
+
+# Finds the records to delete inside the database; only the ids of those records come back.  Exact duplicates are
+# records of the same time series and type with the same range, application time and blob.  The blob hash needs SQL
+# Server 2016 or later for blobs over 8000 bytes.
+server_changes_query = """
+    WITH meta AS (
+        SELECT
+            MetaID, TimeSeriesID, TypeName, StartTime, EndTime, DateApplied, DateModified,
+            HASHBYTES('SHA2_256', XmlBlob) AS BlobHash,
+            CAST(CAST(XmlBlob AS VARCHAR(MAX)) AS XML) AS Blob
+        FROM
+            TimeSeriesMeta
+        {where}
+    ), attributes AS (
+        SELECT
+            MetaID, TimeSeriesID, TypeName,
+            ROW_NUMBER() OVER (PARTITION BY TimeSeriesID, TypeName, StartTime, EndTime, DateApplied, BlobHash
+                               ORDER BY DateModified DESC, MetaID DESC) AS Copy,
+            Blob.value('(/*/@comment)[1]', 'NVARCHAR(MAX)') AS comment,
+            Blob.value('(/*/@code)[1]', 'NVARCHAR(100)') AS code,
+            Blob.value('(/*/@value)[1]', 'NVARCHAR(100)') AS value
+        FROM
+            meta
+    )
+    SELECT
+        MetaID, TimeSeriesID, TypeName, Kind
+    FROM
+        (SELECT
+            MetaID, TimeSeriesID, TypeName,
+            CASE
+                WHEN Copy > 1 THEN 'dups'
+                WHEN TypeName = 'NOTE' AND comment IN ({junk_notes}) THEN 'junk_notes'
+                WHEN TypeName = 'APPROVALCODE' AND code = '-1' AND comment = '' THEN 'empty_apr_code'
+                WHEN TypeName = 'DATAGRADE' AND value = '-1.000' AND comment = '' THEN 'empty_data_grade'
+                WHEN TypeName = 'INTERPOLATIONCODE' AND comment = '' AND value IS NULL THEN 'empty_interp_code'
+            END AS Kind
+        FROM
+            attributes) AS flagged
+    WHERE
+        Kind IS NOT NULL
+    ;
+"""
+
+
+def find_metadata_changes_on_server(conn, ts_ids, ts_df):
+    """
+    Finds the duplicate, junk and empty records to delete inside the database, without reading any blobs.  Ranges
+    aren't reconnected; that needs the blobs, so it is only done by find_metadata_changes.
+    :param ts_ids: The TimeSeriesIDs to look at, or None for every time series
+    :param ts_df: The time series identifiers from read_timeseries_info
+    :return: The number of metadata records of each time series, as a series, and a dictionary of data frames of the
+        records to delete for each of the delete_kinds, as from find_metadata_changes
+    """
+    where, params = _timeseries_where(ts_ids)
+    cur = conn.cursor()
+    cur.execute("SELECT TimeSeriesID, COUNT(*) FROM TimeSeriesMeta {} GROUP BY TimeSeriesID;".format(where), params)
+    total_meta = pd.Series(dict(cur.fetchall()), dtype=np.int64)
+    cur.execute(server_changes_query.format(where=where, junk_notes=", ".join(["%s"] * len(junk_notes))),
+                params + tuple(junk_notes))
+    flagged = pd.DataFrame(cur.fetchall(), columns=['MetaID', 'TimeSeriesID', 'TypeName', 'Kind'])
+    cur.close()
+
+    flagged = flagged.merge(ts_df[['TimeSeriesID', 'TS_Text_ID']], on='TimeSeriesID', how='left')
+    changes = {'dedupped_aggr': None, 'values_to_update': flagged.iloc[0:0]}
+    for kind, group_cols, description, total_description in delete_kinds:
+        changes[kind] = flagged[flagged['Kind'] == kind]
+    return total_meta, changes
+
+
+def _insert_rows(cursor, table_name, columns, rows):
+    # The values are passed as parameters, a VALUES list of rows at a time; blobs go as bytes
+    for batch_start in range(0, len(rows), aq_cleanup.max_insert_rows):
+        batch = rows[batch_start:batch_start + aq_cleanup.max_insert_rows]
+        row_marker = "(" + ", ".join(["%s"] * len(columns)) + ")"
+        cursor.execute("INSERT INTO {} ({}) VALUES {};".format(
+            table_name, ", ".join(columns), ", ".join([row_marker] * len(batch))),
+            tuple(value for row in batch for value in row))
+
+
+def _create_staging_table(cursor, table_name, columns):
+    # Copying the columns from TimeSeriesMeta gives them exactly the same types, so the joins don't convert anything
+    cursor.execute("IF OBJECT_ID('tempdb..{0}') IS NOT NULL DROP TABLE {0};".format(table_name))
+    cursor.execute("SELECT TOP 0 {} INTO {} FROM TimeSeriesMeta;".format(", ".join(columns), table_name))
+
+
+def write_range_updates(conn, values_to_update, log):
+    """
+    Writes the reconnected ranges back to TimeSeriesMeta.  The new ranges are staged in a temp table and applied with
+    a single UPDATE, in one transaction.
+    :return: The number of rows updated
+    """
+    if len(values_to_update) == 0:
+        log("No Records to Update")
+        return 0
+    log("Updating %s Records" % len(values_to_update))
+    for name, group in values_to_update.groupby(['TimeSeriesID']):
+        log("    Updating %s Records From TimeSeries # %s (%s)" %
+            (len(group), name[0], group['TS_Text_ID'].iloc[0]))
+
+    cur = conn.cursor()
+    _create_staging_table(cur, '#MetaUpdates', ['MetaID', 'StartTime', 'EndTime', 'XmlBlob'])
+    _insert_rows(cur, '#MetaUpdates', ['MetaID', 'StartTime', 'EndTime', 'XmlBlob'],
+                 [(str(meta_id), min_start, max_end, new_blob.encode('latin-1'))
+                  for meta_id, min_start, max_end, new_blob in zip(
+                      values_to_update['MetaID'], values_to_update['min_start_str'],
+                      values_to_update['max_end_str'], values_to_update['new_blob'])])
+    # Committing the staged rows means a failed update only rolls back the update itself
+    conn.commit()
+    sql_update = """
+        UPDATE
+            meta
+        SET
+            StartTime = updates.StartTime,
+            EndTime = updates.EndTime,
+            XmlBlob = updates.XmlBlob
+        FROM
+            TimeSeriesMeta AS meta
+            INNER JOIN #MetaUpdates AS updates ON meta.MetaID = updates.MetaID
+        ;
+    """
+    log("    Using Query: %s" % sql_update, debug_only=True)
+    try:
+        cur.execute(sql_update)
+        num_updated = cur.rowcount
+        conn.commit()
+    except pymssql.Error:
+        conn.rollback()
+        log("    Update Failed")
+        num_updated = 0
+    cur.execute("DROP TABLE #MetaUpdates;")
+    conn.commit()
+    cur.close()
+    return num_updated
+
+
+def write_deletes(conn, changes, log):
+    """
+    Deletes the records found for every one of the delete_kinds.  The MetaIDs are staged in a temp table and deleted
+    with a single DELETE, in one transaction.
+    :param changes: The changes from find_metadata_changes
+    :return: The number of rows deleted
+    """
+    meta_ids = set()
+    for kind, group_cols, description, total_description in delete_kinds:
+        to_delete = changes[kind]
+        if len(to_delete) == 0:
+            log("No %s to Delete" % description)
+            continue
+        log("Deleting %s %s" % (len(to_delete), total_description))
+        for name, group in to_delete.groupby(group_cols):
+            log("    Deleting %s %s From TimeSeries # %s (%s)" %
+                (len(group), description, name[0], group['TS_Text_ID'].iloc[0]))
+        meta_ids.update(str(meta_id) for meta_id in to_delete['MetaID'])
+    if len(meta_ids) == 0:
+        return 0
+
+    cur = conn.cursor()
+    _create_staging_table(cur, '#MetaDeletes', ['MetaID'])
+    _insert_rows(cur, '#MetaDeletes', ['MetaID'], [(meta_id,) for meta_id in sorted(meta_ids)])
+    conn.commit()
+    sql_delete = """
+        DELETE
+            meta
+        FROM
+            TimeSeriesMeta AS meta
+            INNER JOIN #MetaDeletes AS deletes ON meta.MetaID = deletes.MetaID
+        ;
+    """
+    log("    Using Query: %s" % sql_delete, debug_only=True)
+    try:
+        cur.execute(sql_delete)
+        num_deleted = cur.rowcount
+        conn.commit()
+    except pymssql.Error:
+        conn.rollback()
+        log("    Delete Failed")
+        num_deleted = 0
+    cur.execute("DROP TABLE #MetaDeletes;")
+    conn.commit()
+    cur.close()
+    return num_deleted
+
+
+def summarize_changes(total_meta, changes, ts_df):
+    """
+    Counts the metadata records and changes for each time series.
+    :param total_meta: The number of metadata records of each time series, as a series indexed by TimeSeriesID
+    """
+    if changes['dedupped_aggr'] is not None:
+        unique_meta = changes['dedupped_aggr'].groupby(['TimeSeriesID']).size()
+    else:
+        unique_meta = total_meta.sub(changes['dups'].groupby(['TimeSeriesID']).size(), fill_value=0)
+    counts = [pd.DataFrame({'total_meta': total_meta}),
+              pd.DataFrame({'unique_meta': unique_meta}),
+              pd.DataFrame({'deleted_dups': changes['dups'].groupby(['TimeSeriesID']).size()}),
+              pd.DataFrame({'deleted_junk': changes['junk_notes'].groupby(['TimeSeriesID']).size()}),
+              pd.DataFrame({'empty_apr_code': changes['empty_apr_code'].groupby(['TimeSeriesID']).size()}),
+              pd.DataFrame({'empty_data_grade': changes['empty_data_grade'].groupby(['TimeSeriesID']).size()}),
+              pd.DataFrame({'empty_interp_code': changes['empty_interp_code'].groupby(['TimeSeriesID']).size()}),
+              pd.DataFrame({'updated_meta': changes['values_to_update'].groupby(['TimeSeriesID']).size()})]
+    return pd.concat(counts, axis=1).merge(
+        ts_df[['TimeSeriesID', 'TS_Text_ID']], left_index=True, right_on='TimeSeriesID').fillna(0)
+
+
+def clean_metadata_batch(connection_info, ts_ids, ts_df, log=None, server_side=False):
+    """
+    Cleans the metadata of one batch of time series.  This is run in a worker process, so it opens its own
+    connection.
+    :param connection_info: A dictionary of the arguments to pymssql.connect
+    :param ts_ids: The TimeSeriesIDs in the batch, or None for every time series
+    :param ts_df: The time series identifiers from read_timeseries_info
+    :param log: A function to write log messages to, or None to collect them and hand them back
+    :param server_side: Find only the records to delete, inside the database, with find_metadata_changes_on_server
+    :return: The number of metadata records looked at, the per time series counts from summarize_changes, and the
+        collected log messages (if log was None)
+    """
+    messages = MessageList() if log is None else None
+    log = messages if log is None else log
+
+    conn = pymssql.connect(**connection_info)
+    if server_side:
+        total_meta, changes = find_metadata_changes_on_server(conn, ts_ids, ts_df)
+    else:
+        meta_df = read_metadata(conn, ts_ids)
+        if len(meta_df.index) == 0:
+            conn.close()
+            return 0, None, messages.messages if messages else []
+        full_df = expand_metadata(meta_df, ts_df)
+        del meta_df
+        changes = find_metadata_changes(full_df)
+        total_meta = full_df.groupby(['TimeSeriesID']).size()
+        del full_df
+    if total_meta.sum() == 0:
+        conn.close()
+        return 0, None, messages.messages if messages else []
+
+    write_range_updates(conn, changes['values_to_update'], log)
+    write_deletes(conn, changes, log)
+    conn.close()
+
+    return int(total_meta.sum()), summarize_changes(total_meta, changes, ts_df), messages.messages if messages else []
+
+
+def clean_metadata(connection_info, ts_ids, ts_df, batch_size=None, workers=1, server_side=False):
+    """
+    Cleans the metadata of the given time series in batches, spread over a pool of worker processes.
+    :param connection_info: A dictionary of the arguments to pymssql.connect
+    :param ts_ids: The TimeSeriesIDs to clean
+    :param ts_df: The time series identifiers from read_timeseries_info
+    :param batch_size: The number of time series in each batch, None to do them all in one batch
+    :param workers: The number of worker processes; with 1 the batches are cleaned in this process
+    :param server_side: Find only the records to delete, inside the database
+    :return: Yields the result of clean_metadata_batch for each batch, as they finish
+    """
+    if batch_size is None or batch_size <= 0:
+        batch_size = max(len(ts_ids), 1)
+    batches = [ts_ids[start:start + batch_size] for start in range(0, len(ts_ids), batch_size)]
+    if workers <= 1:
+        for batch in batches:
+            yield clean_metadata_batch(connection_info, batch, ts_df[ts_df['TimeSeriesID'].isin(batch)],
+                                       server_side=server_side)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(clean_metadata_batch, connection_info, batch,
+                                   ts_df[ts_df['TimeSeriesID'].isin(batch)], server_side=server_side)
+                       for batch in batches]
+            for future in as_completed(futures):
+                yield future.result()
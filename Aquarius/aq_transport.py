@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+The HTTP transport used by the Aquarius acquisition SOAP client.
+
+Every call goes over one pooled keep-alive requests session, so the TCP (and TLS) connection set up for one call is
+reused by the next, and enough connections are kept open for appends to run concurrently.  Connecting and reading
+have separate timeouts, so a dead server is noticed in seconds while a big append still has minutes to finish.
+
+Responses are always requested gzipped; requests decompresses them when the server obliges.  Appends are large
+base64-encoded CSV bodies, so the request bodies can be gzipped too.  Not every server accepts compressed requests,
+so that is off by default.  If the server rejects a compressed request because of its encoding, the request is sent
+again uncompressed and compression is paused for a while before it is tried again.
+"""
+
+import gzip
+import time
+import threading
+from zeep.transports import Transport
+from requests.adapters import HTTPAdapter
+
+__author__ = 'Sara Geleskie Damiano'
+__contact__ = 'sdamiano@stroudcenter.org'
+
+# The status code a server answers with when it can't read a compressed body
+compression_rejected_status_code = 415
+# Some servers answer a 400 instead; only those whose response mentions the encoding are taken as a rejection
+compression_rejected_bad_request_words = ('gzip', 'encoding', 'compress')
+
+
+def compression_rejected(response):
+    """
+    :return: True if the response says the server couldn't read a compressed request body
+    """
+    if response.status_code == compression_rejected_status_code:
+        return True
+    if response.status_code == 400:
+        response_text = response.text.lower()
+        return any(word in response_text for word in compression_rejected_bad_request_words)
+    return False
+
+
+class AcquisitionTransport(Transport):
+    """
+    A zeep transport over a pooled keep-alive session, with optional gzip compression of request bodies.
+    """
+
+    def __init__(self, pool_size=4, connect_timeout=10, read_timeout=600, wsdl_timeout=60,
+                 compress_requests=False, compress_min_bytes=1024, compress_level=6, compress_retry_seconds=3600,
+                 cache=None):
+        """
+        :param pool_size: The number of connections to keep open to the server, which should be at least the number
+            of appends run at once
+        :param connect_timeout: Seconds to wait for a connection to the server
+        :param read_timeout: Seconds to wait for the server to answer a call
+        :param wsdl_timeout: Seconds to wait when loading the WSDL and its schemas
+        :param compress_requests: Whether to gzip request bodies
+        :param compress_min_bytes: Request bodies smaller than this are never compressed
+        :param compress_level: The gzip compression level, 1 (fastest) to 9 (smallest)
+        :param compress_retry_seconds: Seconds to send uncompressed after the server rejects a compressed request,
+            before compressing again
+        :param cache: A zeep cache for the WSDL, or None
+        """
+        super(AcquisitionTransport, self).__init__(cache=cache, timeout=wsdl_timeout,
+                                                   operation_timeout=(connect_timeout, read_timeout))
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+        self.session.headers['Connection'] = 'keep-alive'
+        self.compress_requests = compress_requests
+        self.compress_min_bytes = compress_min_bytes
+        self.compress_level = compress_level
+        self.compress_retry_seconds = compress_retry_seconds
+        self._compress_paused_until = None
+        self._lock = threading.Lock()
+        self.resize_pool(pool_size)
+        self.reset_counters()
+
+    def resize_pool(self, pool_size):
+        """
+        Replaces the http and https connection pools with ones holding pool_size connections.
+        """
+        self.pool_size = pool_size
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def set_timeouts(self, connect_timeout=None, read_timeout=None):
+        old_connect_timeout, old_read_timeout = self.operation_timeout
+        self.operation_timeout = (old_connect_timeout if connect_timeout is None else connect_timeout,
+                                  old_read_timeout if read_timeout is None else read_timeout)
+
+    def reset_counters(self):
+        """
+        Clears the counts of the bytes sent before and after compression.
+        """
+        with self._lock:
+            self.calls = 0
+            self.body_bytes = 0
+            self.sent_bytes = 0
+
+    def _count(self, body_bytes, sent_bytes):
+        with self._lock:
+            self.calls += 1
+            self.body_bytes += body_bytes
+            self.sent_bytes += sent_bytes
+
+    def compression_paused(self):
+        """
+        :return: True if compression is paused because the server rejected a compressed request not long ago
+        """
+        with self._lock:
+            if self._compress_paused_until is not None and time.monotonic() >= self._compress_paused_until:
+                self._compress_paused_until = None
+            return self._compress_paused_until is not None
+
+    def post(self, address, message, headers):
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        if not self.compress_requests or len(message) < self.compress_min_bytes or self.compression_paused():
+            self._count(len(message), len(message))
+            return super(AcquisitionTransport, self).post(address, message, headers)
+
+        compressed = gzip.compress(message, compresslevel=self.compress_level)
+        compressed_headers = dict(headers)
+        compressed_headers['Content-Encoding'] = 'gzip'
+        self._count(len(message), len(compressed))
+        response = super(AcquisitionTransport, self).post(address, compressed, compressed_headers)
+        if compression_rejected(response):
+            # The server can't read gzipped requests; send this one again as is and don't compress for a while
+            with self._lock:
+                self._compress_paused_until = time.monotonic() + self.compress_retry_seconds
+            self._count(len(message), len(message))
+            response = super(AcquisitionTransport, self).post(address, message, headers)
+        return response
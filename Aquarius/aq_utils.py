@@ -13,17 +13,27 @@ import pytz
 import base64
 import sys
 import socket
-from zeep.transports import Transport
 from zeep import Client
+from zeep.exceptions import Fault
 import pandas as pd
+import numpy as np
 
 # Bring in all of the database connection information.
 from Aquarius.aq_dbinfo import aq_acq_1page_url, aq_username, aq_password
+from Aquarius.aq_transport import AcquisitionTransport
 
 __author__ = 'Sara Geleskie Damiano'
 __contact__ = 'sdamiano@stroudcenter.org'
 
 
+class AquariusConnectionError(Exception):
+    """
+    Raised when the acquisition client can't be created or can't authenticate.  This is raised rather than exiting,
+    so a long running process can count the failed run and try again later.
+    """
+    pass
+
+
 # Get an authentication token to open the path into the API
 def get_aq_auth_token(username=aq_username, password=aq_password, debug=False):
     """
@@ -32,25 +42,23 @@ def get_aq_auth_token(username=aq_username, password=aq_password, debug=False):
     # Call up the Aquarius Acquisition SOAP API
 
     try:
-        token_transport = Transport(timeout=30)
+        token_transport = AcquisitionTransport(pool_size=1, read_timeout=30, wsdl_timeout=30)
         aq_token_client = Client(aq_acq_1page_url, transport=token_transport)
     except Exception as e:
         print("Error Creating Client: {}".format(sys.exc_info()[0]))
         print('{}'.format(e))
-        print("Stopping all program execution")
-        sys.exit("Unable to connect to server")
+        raise AquariusConnectionError("Unable to connect to server") from e
     else:
         try:
             auth_token = aq_token_client.service.GetAuthToken(
                 username, password)
             # cookie = aq_token_client.options.transport.cookiejar
-        except suds.WebFault as e:
+        except Fault as e:
             if debug:
                 print("Error Getting Acquisition Token: {}".format(
                     sys.exc_info()[0]))
                 print('{}'.format(e))
-                print("Stopping all program execution")
-            sys.exit("No Acquisition Authentication Token")
+            raise AquariusConnectionError("No Acquisition Authentication Token") from e
         else:
             if debug:
                 print("Acquisition Authentication Token: {}".format(auth_token))
@@ -58,17 +66,64 @@ def get_aq_auth_token(username=aq_username, password=aq_password, debug=False):
             return auth_token
 
 
-# The client, with a transport to increase the timeout
-transport = Transport(timeout=600)
-aq_client = Client(aq_acq_1page_url, transport=transport)
-# Run the get-authentication function to get a default cookie
-module_token = get_aq_auth_token(aq_username, aq_password)
+# The pooled keep-alive transport, with a long read timeout for big appends.  Nothing is sent until it's used.
+transport = AcquisitionTransport(pool_size=4, connect_timeout=10, read_timeout=600)
+# The client and the default authentication token are only set up the first time they are needed, so importing this
+# module doesn't touch the server.  In a long running process they are then kept for every later call.
+aq_client = None
+module_token = None
+# The timezone of each time series, so they aren't looked up on the server every run of a long running process
+timezone_cache = {}
+timezone_cache_seconds = 6 * 3600
+
+
+def get_client():
+    """
+    :return: The SOAP client for the acquisition service, parsing the WSDL the first time it is needed
+    """
+    global aq_client
+    if aq_client is None:
+        aq_client = Client(aq_acq_1page_url, transport=transport)
+    return aq_client
 
 
-def check_aq_connection(token=module_token, debug=False):
+def get_module_token(debug=False):
+    """
+    :return: The default authentication token, authenticating the first time it is needed
+    """
+    global module_token
+    if module_token is None:
+        module_token = get_aq_auth_token(aq_username, aq_password, debug)
+    return module_token
+
+
+def clear_caches():
+    """
+    Forgets the cached time series timezones, so they are looked up again.
+    """
+    timezone_cache.clear()
+
+
+def configure_transport(pool_size=None, connect_timeout=None, read_timeout=None, compress_requests=None):
+    """
+    Changes the settings of the transport shared by every call to Aquarius.  Settings left as None are not changed.
+    :param pool_size: The number of connections to keep open, at least the number of appends run at once
+    :param connect_timeout: Seconds to wait for a connection to the server
+    :param read_timeout: Seconds to wait for the server to answer a call
+    :param compress_requests: Whether to gzip request bodies; only turn this on if the server accepts it
+    """
+    if pool_size is not None:
+        transport.resize_pool(pool_size)
+    transport.set_timeouts(connect_timeout, read_timeout)
+    if compress_requests is not None:
+        transport.compress_requests = compress_requests
+
+
+def check_aq_connection(token=None, debug=False):
     start_check = datetime.datetime.now()
+    token = token if token is not None else get_module_token(debug)
     try:
-        is_valid = aq_client.service.IsConnectionValid(
+        is_valid = get_client().service.IsConnectionValid(
             _soapheaders={"AQAuthToken": token})
     except Exception as e:
         is_valid = False
@@ -84,15 +139,16 @@ def check_aq_connection(token=module_token, debug=False):
         try:
             if debug:
                 print("Requesting that token {} be kept alive".format(token))
-            aq_client.service.KeepConnectionAlive(
+            get_client().service.KeepConnectionAlive(
                 _soapheaders={"AQAuthToken": token})
         except Exception as e:
             print("Unable to request keep-alive: {}".format(e))
     return is_valid
 
 
-def check_and_revalidate_connection(token=module_token, debug=False):
+def check_and_revalidate_connection(token=None, debug=False):
     global module_token
+    token = token if token is not None else get_module_token(debug)
     if debug:
         print("Checking for valid connection to the Aquarius acquisition endpoint; token: {}.".format(
             module_token))
@@ -105,11 +161,11 @@ def check_and_revalidate_connection(token=module_token, debug=False):
     return token
 
 
-def get_aquarius_location_timezone(loc_numeric_id, debug=False, token=module_token):
+def get_aquarius_location_timezone(loc_numeric_id, debug=False, token=None):
     # Verify the connection is still valid
     token_to_use = check_and_revalidate_connection(token, debug)
 
-    location_dto = aq_client.service.GetLocation(
+    location_dto = get_client().service.GetLocation(
         loc_numeric_id, _soapheaders={"AQAuthToken": token_to_use})
     utc_offset_float = location_dto.UtcOffset
     utc_offset_string = '{:+3.0f}'.format(
@@ -121,9 +177,20 @@ def get_aquarius_location_timezone(loc_numeric_id, debug=False, token=module_tok
     return timezone
 
 
-def get_aquarius_timezone(ts_numeric_id, loc_numeric_id=None, debug=False, token=module_token):
+def get_aquarius_timezone(ts_numeric_id, loc_numeric_id=None, debug=False, token=None):
+    cached = timezone_cache.get((ts_numeric_id, loc_numeric_id))
+    if cached is not None and time.monotonic() - cached[1] < timezone_cache_seconds:
+        return cached[0]
+    timezone = _find_aquarius_timezone(ts_numeric_id, loc_numeric_id, debug, token)
+    if timezone is not None:
+        timezone_cache[(ts_numeric_id, loc_numeric_id)] = (timezone, time.monotonic())
+    return timezone
+
+
+def _find_aquarius_timezone(ts_numeric_id, loc_numeric_id=None, debug=False, token=None):
     # Verify the connection is still valid
     token_to_use = check_and_revalidate_connection(token, debug)
+    aq_client = get_client()
 
     if loc_numeric_id is None:
         all_locations = aq_client.service.GetAllLocations(
@@ -151,6 +218,25 @@ def get_aquarius_timezone(ts_numeric_id, loc_numeric_id=None, debug=False, token
                     return timezone
 
 
+def localize_to_aquarius_timezones(data_table, timestamp_column='timestamp', timezone_column='AQTimeZone'):
+    """
+    Converts the timestamps in a data frame into the local (wall clock) time of each row's Aquarius time series.
+    There are only ever a handful of fixed 'Etc/GMT+N' zones in use, so this converts each zone's rows as a whole
+    column instead of calling astimezone on every single data point.
+    :param data_table: A pandas data frame with timezone aware timestamps and a column of pytz timezones
+    :param timestamp_column: The name of the column of timezone aware timestamps
+    :param timezone_column: The name of the column with the pytz timezone of the Aquarius series
+    :return: A pandas series of timezone naive datetime64 values in the Aquarius local time, aligned to the data
+        frame's index.  Rows without an Aquarius timezone are NaT.
+    """
+    utc_timestamps = pd.to_datetime(data_table[timestamp_column], utc=True)
+    localized = np.full(len(data_table.index), np.datetime64('NaT'), dtype='datetime64[ns]')
+    for timezone, positions in data_table.groupby(timezone_column, sort=False).indices.items():
+        localized[positions] = utc_timestamps.iloc[positions].dt.tz_convert(
+            timezone).dt.tz_localize(None).values
+    return pd.Series(localized, index=data_table.index)
+
+
 def create_appendable_csv(data_table):
     """
     This takes a pandas data frame and converts it to a base64 string ready to read into the
@@ -192,20 +278,21 @@ def create_appendable_csv(data_table):
     return byte_string
 
 
-def aq_timeseries_append(ts_numeric_id, appendbytes, debug=False, token=module_token):
+def aq_timeseries_append(ts_numeric_id, appendbytes, debug=False, token=None, retry_seconds=30):
     """
     Appends data to an aquarius time series given a base64 encoded csv string with the following values:
         datetime(isoformat), value, flag, grade, interpolation, approval, note
     :param ts_numeric_id: The integer primary key of an aquarius time series
     :param appendbytes: Base64 csv string with ISO-datetime, value, flag, grade, interpolation, approval, note
     :param debug: Says whether or not to issue print(statements.)
-    :param token: A cookie jar with the current authentication cookie to the API client
+    :param token: The authentication token to use, None for the default token
+    :param retry_seconds: The number of seconds to wait before retrying a failed append
     :return: The append result from the SOAP client
     """
 
     # Create an empty resute
     # empty_result = aq_client.factory.create('ns0:AppendResult')
-    empty_result = aq_client.get_type(
+    empty_result = get_client().get_type(
         '{http://schemas.datacontract.org/2004/07/AQAcquisitionService.Dto}AppendResult')
 
     # Actually append to the Aquarius dataset
@@ -215,18 +302,18 @@ def aq_timeseries_append(ts_numeric_id, appendbytes, debug=False, token=module_t
             try:
                 # Verify the connection is still valid
                 token_to_use = check_and_revalidate_connection(token, debug)
-                append_result = aq_client.service.AppendTimeSeriesFromBytes2(
+                append_result = get_client().service.AppendTimeSeriesFromBytes2(
                     ts_numeric_id, appendbytes, aq_username, _soapheaders={"AQAuthToken": token_to_use})
                 if debug:
                     print("Append result: {}".format(append_result))
                 if pd.notna(append_result.AppendToken):
                     break
-            except suds.WebFault as e:
+            except Fault as e:
                 if debug:
                     print("      Error: {}".format(sys.exc_info()[0]))
                     print('      {}'.format(e))
-                    print('      Retrying in 30 seconds')
-                time.sleep(30)
+                    print('      Retrying in {} seconds'.format(retry_seconds))
+                time.sleep(retry_seconds)
                 #     t4 = datetime.datetime.now()
                 #     print("      API execution took {}".format(t4 - t3))
                 # empty_result.NumPointsAppended = 0
@@ -239,14 +326,17 @@ def aq_timeseries_append(ts_numeric_id, appendbytes, debug=False, token=module_t
                 if debug:
                     print("      Socket timeout: {}".format(sys.exc_info()[0]))
                     print('      {}'.format(e))
-                    print('      Retrying in 30 seconds')
-                time.sleep(30)
+                    print('      Retrying in {} seconds'.format(retry_seconds))
+                time.sleep(retry_seconds)
+            except AquariusConnectionError:
+                # Can't authenticate at all; give up the run rather than retrying every chunk, the journal keeps it
+                raise
             except Exception as e:
                 if debug:
                     print("      Error: {}".format(sys.exc_info()[0]))
                     print('      {}'.format(e))
-                    print('      Retrying in 30 seconds')
-                time.sleep(30)
+                    print('      Retrying in {} seconds'.format(retry_seconds))
+                time.sleep(retry_seconds)
         else:  # if we never got to the "break" for a successful result
             if debug:
                 print("      Error: {}".format(sys.exc_info()[0]))
@@ -269,7 +359,7 @@ def aq_timeseries_append(ts_numeric_id, appendbytes, debug=False, token=module_t
     return append_result
 
 
-def export_data_by_month(chunk_of_data, data_column, timeseries_id_numeric, debug=False, token=module_token):
+def export_data_by_month(chunk_of_data, data_column, timeseries_id_numeric, debug=False, token=None):
     # Output a CSV
     csv_data = chunk_of_data.rename(
         columns={data_column: 'data_value'}).dropna(
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+Fast reading and rewriting of the XmlBlob column of the Aquarius TimeSeriesMeta table.
+
+Every blob is a single empty XML element whose attributes hold the metadata, like
+<ApprovalCode startTime="2016-01-01 00:00:00.000" endTime="2016-02-01 00:00:00.000" code="900" comment=""/>.
+Rather than building an element tree for each one, the attributes are pulled out with a pair of compiled regular
+expressions and gathered straight into columns.  Any blob the expressions can't be sure of (character or entity
+references, whitespace the XML parser would normalize, single quotes, child elements, namespaces) falls back to the
+XML parser, so the result is always the same as ElementTree's.  The start and end times are rewritten in place in the
+text, again without parsing the blob.
+"""
+
+import xml.etree.ElementTree as ET
+import re
+import gc
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+__author__ = 'Sara Geleskie Damiano'
+__contact__ = 'sdamiano@stroudcenter.org'
+
+# A whole blob that is a single empty element with only plain, double quoted attributes
+element_pattern = re.compile(
+    r'[ \t\r\n]*<[A-Za-z_][\w.-]*((?:[ \t\r\n]+[A-Za-z_][\w.-]*[ \t\r\n]*=[ \t\r\n]*"[^"<&\t\n\r]*")*)[ \t\r\n]*/>'
+    r'[ \t\r\n]*\Z')
+# One attribute of such an element
+attribute_pattern = re.compile(r'([A-Za-z_][\w.-]*)[ \t\r\n]*=[ \t\r\n]*"([^"]*)"')
+# The start and end time attributes, split around their value
+time_attribute_pattern = re.compile(r'([ \t\r\n](startTime|endTime)[ \t\r\n]*=[ \t\r\n]*")[^"]*(")')
+
+
+def blob_text(blob):
+    """
+    The blobs are stored as VARBINARY; latin-1 turns them into text and back without changing a single byte.
+    """
+    return blob.decode('latin-1') if isinstance(blob, bytes) else blob
+
+
+def _element_names(shape):
+    """
+    Checks the text around the values of a blob, split on its double quotes, and finds its attribute names.
+    :return: A tuple of the attribute names, or None if the blob has to be read by the XML parser
+    """
+    match = element_pattern.match('""'.join(shape))
+    if match is None:
+        return None
+    names = tuple(name for name, value in attribute_pattern.findall(match.group(1)))
+    if len(names) != len(shape) - 1 or len(set(names)) != len(names):
+        return None
+    return names
+
+
+def _decode_chunk(blobs):
+    # Split on the double quotes, a blob's values are every other piece.  The pieces in between (the tag, the attribute
+    # names and the punctuation) are its "shape", and blobs of the same type almost always have the same shape, so each
+    # shape is checked only once and the values of all the blobs of a shape are put into columns together.
+    groups = {}
+    fallback_rows = []
+    fallback_attributes = []
+    # None of the lists made here can be in a reference cycle, so there is no point in the garbage collector going
+    # through them again and again as they pile up
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        blobs = [blob.decode('latin-1') if isinstance(blob, bytes) else blob for blob in blobs]
+        # References have to be resolved, and tabs and new lines in values turned into spaces, by the parser
+        split_blobs = [blob.split('"') if blob.count('<') == 1 and '&' not in blob and '\t' not in blob and
+                       '\n' not in blob and '\r' not in blob else None for blob in blobs]
+        for row, parts in enumerate(split_blobs):
+            if parts is not None:
+                shape = tuple(parts[0::2])
+                group = groups.get(shape)
+                if group is None:
+                    group = groups[shape] = (_element_names(shape), [], [])
+                if group[0] is not None:
+                    group[1].append(row)
+                    group[2].append(parts)
+                    continue
+            fallback_rows.append(row)
+            fallback_attributes.append(ET.fromstring(blobs[row]).attrib)
+        del split_blobs
+
+        named_groups = [(names, rows, list(zip(*parts))[1::2])
+                        for names, rows, parts in groups.values() if names is not None]
+        named_groups.extend((tuple(attributes.keys()), [row], [(value,) for value in attributes.values()])
+                            for row, attributes in zip(fallback_rows, fallback_attributes))
+        # Columns are in the order they are first seen, as they would be from a list of dictionaries
+        named_groups.sort(key=lambda group: group[1][0])
+        columns = {}
+        for names, rows, values in named_groups:
+            rows = np.array(rows, dtype=np.int64)
+            for name, column_values in zip(names, values):
+                column = columns.get(name)
+                if column is None:
+                    column = columns[name] = np.full(len(blobs), np.nan, dtype=object)
+                column[rows] = column_values
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return pd.DataFrame(columns, index=range(len(blobs))), len(fallback_rows)
+
+
+def decode_blobs(blobs, numeric_columns=(), workers=1, chunk_size=100000, index=None):
+    """
+    Pulls the attributes of every blob into columns of a data frame.
+    :param blobs: A list or series of blobs, as bytes or text
+    :param numeric_columns: Attributes to convert to numbers, if they are there
+    :param workers: The number of processes to decode with; with 1 the blobs are decoded in this process
+    :param chunk_size: The number of blobs each process decodes at a time
+    :param index: The index for the data frame, by default the index of the blobs if they are a series
+    :return: A data frame with a column for every attribute in any blob, blank where a blob doesn't have it, and the
+        number of blobs which had to be read by the XML parser
+    """
+    if index is None and isinstance(blobs, pd.Series):
+        index = blobs.index
+    blobs = list(blobs)
+    if workers <= 1 or len(blobs) <= chunk_size:
+        attributes, fallbacks = _decode_chunk(blobs)
+    else:
+        chunks = [blobs[start:start + chunk_size] for start in range(0, len(blobs), chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_decode_chunk, chunks))
+        attributes = pd.concat([result[0] for result in results], ignore_index=True, sort=False)
+        fallbacks = sum(result[1] for result in results)
+    if index is not None:
+        attributes.index = index
+    for column in numeric_columns:
+        if column in attributes.columns:
+            attributes[column] = pd.to_numeric(attributes[column])
+    return attributes, fallbacks
+
+
+def _replace_attribute(blob, marker, value):
+    # Finds ' name="' outside of any value (after an even number of quotes) and swaps out the value after it
+    start = blob.find(marker)
+    while start >= 0 and blob.count('"', 0, start) % 2 == 1:
+        start = blob.find(marker, start + 1)
+    if start < 0:
+        return None
+    start += len(marker)
+    return blob[:start] + value + blob[blob.index('"', start):]
+
+
+def rewrite_times(blobs, start_times, end_times):
+    """
+    Replaces the startTime and endTime attributes of each blob, without parsing it.  Blobs without one of the
+    attributes are left without it.
+    :param blobs: The blobs, as text
+    :param start_times: The new start time of each blob, as text
+    :param end_times: The new end time of each blob, as text
+    :return: A list of the rewritten blobs
+    """
+    rewritten = []
+    for blob, start_time, end_time in zip(blobs, start_times, end_times):
+        new_blob = _replace_attribute(blob, ' startTime="', start_time)
+        if new_blob is not None:
+            new_blob = _replace_attribute(new_blob, ' endTime="', end_time)
+        if new_blob is None:
+            # Missing times, or other spacing around the attributes
+            times = {'startTime': start_time, 'endTime': end_time}
+            new_blob = time_attribute_pattern.sub(
+                lambda match: match.group(1) + times[match.group(2)] + match.group(3), blob)
+        rewritten.append(new_blob)
+    return rewritten
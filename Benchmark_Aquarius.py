@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""
+@author: Sara Geleskie Damiano
+
+This script benchmarks the append stage of Dreamhost_to_Aquarius against a local stand-in for the Aquarius
+acquisition service, so append throughput can be profiled without touching the real Aquarius server.
+For each combination of series count, points per series, chunk size, injected fault rate and compression it reports
+the points/sec appended, the number of SOAP calls made per series (by operation) and the number of bytes on the wire
+each way.
+"""
+
+import sys
+import types
+import shutil
+import datetime
+import tempfile
+import itertools
+import argparse
+import numpy as np
+import pandas as pd
+import pytz
+import Aquarius.aq_fake_server as aq_fake_server
+import Aquarius.aq_journal as aq_journal
+
+__author__ = 'Sara Geleskie Damiano'
+__contact__ = 'sdamiano@stroudcenter.org'
+
+
+# Set up a parser for command line options
+parser = argparse.ArgumentParser(
+    description='This script benchmarks appending data to a local stand-in for Aquarius.')
+parser.add_argument('--series', action='store', type=int, nargs='+', default=[6, 30],
+                    help='Sets the numbers of time series to benchmark')
+parser.add_argument('--seriesperlocation', action='store', type=int, default=6,
+                    help='Sets the number of time series at each Aquarius location')
+parser.add_argument('--points', action='store', type=int, nargs='+', default=[288, 2880],
+                    help='Sets the numbers of 5-minute points of data for each series')
+parser.add_argument('--chunksize', action='store', type=int, nargs='+', default=[0],
+                    help='Sets the maximum numbers of points in a single append, 0 for one append per series')
+parser.add_argument('--faultrate', action='store', type=float, nargs='+', default=[0.0],
+                    help='Sets the fractions of appends the stand-in server should fail')
+parser.add_argument('--compression', action='store', nargs='+', default=['none', 'responses', 'both'],
+                    choices=['none', 'responses', 'both'],
+                    help='Sets which messages are gzipped: none, only responses, or both requests and responses')
+parser.add_argument('--latency', action='store', type=float, default=0.01,
+                    help='Sets the stand-in server latency for every call in seconds')
+parser.add_argument('--pointlatency', action='store', type=float, default=0.0,
+                    help='Sets the extra stand-in server latency for each point appended in seconds')
+parser.add_argument('--tokenlifetime', action='store', type=float, default=None,
+                    help='Sets the number of seconds before a stand-in authentication token expires')
+
+
+def make_synthetic_locations(num_series, series_per_location):
+    """
+    Creates the locations dictionary for the fake acquisition server, with numeric time series ids starting at 1000.
+    """
+    locations = {}
+    for series_number in range(num_series):
+        location_id = 100 + series_number // series_per_location
+        location = locations.setdefault(
+            location_id, {'Identifier': 'SL{:03d}'.format(location_id - 100), 'UtcOffset': -5, 'series': []})
+        location['series'].append(1000 + series_number)
+    return locations
+
+
+def make_synthetic_data(locations, num_points):
+    """
+    Creates the series and data frames returned by dh_utils.get_dreamhost_data for the given fake locations.
+    """
+    eastern_standard_time = pytz.timezone('Etc/GMT+5')
+    first_timestamp = eastern_standard_time.localize(datetime.datetime(2020, 1, 1))
+    timestamps = pd.date_range(first_timestamp, periods=num_points, freq='5min')
+
+    series_rows = []
+    for location_id, location in sorted(locations.items()):
+        for column_number, ts_numeric_id in enumerate(location['series']):
+            series_rows.append({'SeriesID': ts_numeric_id - 999,
+                                'AQTimeSeriesID': ts_numeric_id,
+                                'AQLocationID': location_id,
+                                'TableName': location['Identifier'],
+                                'TableColumnName': 'Column{}'.format(column_number),
+                                'DateTimeSeriesStart': first_timestamp})
+    aq_series = pd.DataFrame(series_rows)
+
+    aq_data = aq_series.loc[aq_series.index.repeat(num_points),
+                            ['SeriesID', 'AQTimeSeriesID', 'TableName', 'TableColumnName']].reset_index(drop=True)
+    aq_data['timestamp'] = np.tile(timestamps, len(aq_series.index))
+    aq_data['data_value'] = np.random.default_rng(len(aq_series.index)).normal(10, 2, len(aq_data.index)).round(3)
+    return aq_series, aq_data
+
+
+def connect_to_server(server):
+    """
+    Points aq_utils at the fake server and imports the append stage.  aq_utils reads its connection details from
+    aq_dbinfo when it is imported, so the fake connection details must be in place first.
+    """
+    aq_dbinfo = types.ModuleType('Aquarius.aq_dbinfo')
+    aq_dbinfo.aq_acq_1page_url = server.wsdl_url
+    aq_dbinfo.aq_username = 'benchmark'
+    aq_dbinfo.aq_password = 'benchmark'
+    sys.modules['Aquarius.aq_dbinfo'] = aq_dbinfo
+    import Aquarius.aq_append as aq_append
+    return aq_append
+
+
+def run_benchmark(aq_append, server, locations, num_points, chunk_size, fault_rate, compression):
+    aq_series, aq_data = make_synthetic_data(locations, num_points)
+    journal_directory = tempfile.mkdtemp(prefix='AppendJournal')
+    server.fault_rate = fault_rate
+    server.compress_responses = compression != 'none'
+    aq_append.aq_utils.configure_transport(compress_requests=compression == 'both')
+    server.reset()
+    # Every configuration starts cold, looking up the time zones again, so their calls and speeds compare
+    aq_append.aq_utils.clear_caches()
+    try:
+        journal = aq_journal.AppendJournal(journal_directory)
+        append_start = datetime.datetime.now()
+        summary = aq_append.append_dreamhost_data(aq_series, aq_data, journal, chunk_size=chunk_size,
+                                                  pause_seconds=0, retry_seconds=0)
+        append_seconds = (datetime.datetime.now() - append_start).total_seconds()
+        unfinished = len(journal.unfinished_chunks())
+    finally:
+        shutil.rmtree(journal_directory, ignore_errors=True)
+
+    num_series = len(aq_series.index)
+    result = {'series': num_series,
+              'points': num_points,
+              'chunk_size': chunk_size,
+              'fault_rate': fault_rate,
+              'compression': compression,
+              'chunks': summary['chunks'],
+              'failed_chunks': summary['failed_chunks'],
+              'unfinished_chunks': unfinished,
+              'points_per_sec': summary['points_appended'] / append_seconds if append_seconds > 0 else float('inf'),
+              'calls_per_series': sum(server.call_counts.values()) / float(num_series),
+              'faults': sum(server.fault_counts.values()),
+              'request_kb': server.request_bytes / 1024.0,
+              'response_kb': server.response_bytes / 1024.0}
+    for operation, count in sorted(server.call_counts.items()):
+        result[operation] = count / float(num_series)
+    return result
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    # Every location the benchmark could use has to exist before aq_utils connects
+    all_locations = make_synthetic_locations(max(args.series), args.seriesperlocation)
+    with aq_fake_server.FakeAcquisitionServer(locations=all_locations, latency=args.latency,
+                                              append_latency_per_point=args.pointlatency,
+                                              token_lifetime=args.tokenlifetime, seed=0) as server:
+        aq_append = connect_to_server(server)
+        results = []
+        for num_series, num_points, chunk_size, fault_rate, compression in itertools.product(
+                args.series, args.points, args.chunksize, args.faultrate, args.compression):
+            locations = make_synthetic_locations(num_series, args.seriesperlocation)
+            result = run_benchmark(aq_append, server, locations, num_points, chunk_size, fault_rate, compression)
+            print("{series:>5} series, {points:>6} points, chunks of {chunk_size}, {fault_rate:.0%} faults, "
+                  "{compression} gzipped: "
+                  "{points_per_sec:,.0f} points/sec, {calls_per_series:.1f} SOAP calls per series, "
+                  "{chunks} chunks ({failed_chunks} failed), {request_kb:,.1f} kB sent, "
+                  "{response_kb:,.1f} kB received".format(**result))
+            results.append(result)
+
+    print("")
+    print(pd.DataFrame(results).fillna(0).to_string(index=False, float_format='{:,.1f}'.format))
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+"""
+@author: Sara Geleskie Damiano
+
+This script benchmarks building and posting EnviroDIY data-stream payloads against a local stand-in for the
+EnviroDIY endpoint, so the uploader can be load tested without sending anything to data.envirodiy.org.
+For each combination of series count, concurrency and injected error rate it reports the payloads/sec for building
+and for posting, the p50/p99 time to post each payload and what happened to the failures.  The time of a payload
+runs from its first attempt to its last, so it includes any retries and the backoff between them; it is only the time
+of a single request for payloads accepted on their first attempt.
+"""
+
+import datetime
+import itertools
+import argparse
+import numpy as np
+import pandas as pd
+import pytz
+import EnviroDIY.diy_utils as diy_utils
+import EnviroDIY.diy_uploader as diy_uploader
+import EnviroDIY.diy_fake_server as diy_fake_server
+
+__author__ = 'Sara Geleskie Damiano'
+__contact__ = 'sdamiano@stroudcenter.org'
+
+
+# Set up a parser for command line options
+parser = argparse.ArgumentParser(
+    description='This script benchmarks posting data to a local stand-in for EnviroDIY.')
+parser.add_argument('--series', action='store', type=int, nargs='+', default=[12, 60, 300],
+                    help='Sets the numbers of time series to benchmark')
+parser.add_argument('--seriespersite', action='store', type=int, default=6,
+                    help='Sets the number of time series at each site (sampling feature)')
+parser.add_argument('--sitespertoken', action='store', type=int, default=1,
+                    help='Sets the number of sites sharing each EnviroDIY token')
+parser.add_argument('--timestamps', action='store', type=int, default=48,
+                    help='Sets the number of 5-minute timestamps of data for each series')
+parser.add_argument('--workers', action='store', type=int, nargs='+', default=[1, 4, 16],
+                    help='Sets the numbers of uploader workers to benchmark')
+parser.add_argument('--tokenworkers', action='store', type=int, default=2,
+                    help='Sets the number of posts that may be in flight at once for a single token')
+parser.add_argument('--errorrate', action='store', type=float, nargs='+', default=[0.0, 0.05],
+                    help='Sets the fractions of posts the stand-in server should fail')
+parser.add_argument('--latency', action='store', type=float, default=0.02,
+                    help='Sets the stand-in server latency in seconds')
+parser.add_argument('--jitter', action='store', type=float, default=0.01,
+                    help='Sets the maximum random extra stand-in server latency in seconds')
+parser.add_argument('--ratelimit', action='store', type=int, default=None,
+                    help='Sets the number of requests per second per token the stand-in server allows')
+parser.add_argument('--attempts', action='store', type=int, default=3,
+                    help='Sets the number of times to try each post')
+
+
+def make_synthetic_data(num_series, series_per_site, sites_per_token, num_timestamps):
+    """
+    Creates a data frame shaped like the EnviroDIY data returned by dh_utils.get_dreamhost_data.
+    """
+    eastern_standard_time = pytz.timezone('Etc/GMT+5')
+    num_sites = max(1, int(np.ceil(num_series / float(series_per_site))))
+    first_timestamp = eastern_standard_time.localize(datetime.datetime(2020, 1, 1))
+    timestamps = pd.date_range(first_timestamp, periods=num_timestamps, freq='5min')
+
+    series = pd.DataFrame({'series_number': np.arange(num_series)})
+    series['site_number'] = series['series_number'] // series_per_site
+    series['EnviroDIYToken'] = 'token-' + (series['site_number'] // sites_per_token).astype(str)
+    series['SamplingFeatureGUID'] = 'site-' + series['site_number'].astype(str)
+    series['SiteCode'] = 'SL' + series['site_number'].astype(str).str.zfill(3)
+    series['TableName'] = series['SiteCode']
+    series['TimeSeriesGUID'] = 'series-' + series['series_number'].astype(str)
+
+    data = series.loc[series.index.repeat(num_timestamps)].reset_index(drop=True)
+    data['timestamp'] = np.tile(timestamps, num_sites * series_per_site)[:len(data.index)]
+    data['data_value'] = np.random.default_rng(num_series).normal(10, 2, len(data.index)).round(3)
+    data['server_offset'] = pd.Timedelta(seconds=30)
+    data['time_correction'] = pd.Timedelta(seconds=0)
+    return data
+
+
+def run_benchmark(num_series, workers, error_rate, args):
+    data = make_synthetic_data(num_series, args.seriespersite, args.sitespertoken, args.timestamps)
+
+    build_start = datetime.datetime.now()
+    payloads, row_payload = diy_utils.build_data_stream_payloads(data)
+    build_seconds = (datetime.datetime.now() - build_start).total_seconds()
+
+    with diy_fake_server.FakeDataStreamServer(latency=args.latency, latency_jitter=args.jitter,
+                                              error_rate=error_rate, token_rate_limit=args.ratelimit,
+                                              seed=num_series) as server:
+        uploader = diy_uploader.DataStreamUploader(url=server.url, max_workers=workers,
+                                                   per_token_concurrency=args.tokenworkers,
+                                                   max_attempts=args.attempts, backoff_base=0.05,
+                                                   backoff_max=1.0)
+        post_start = datetime.datetime.now()
+        responses = uploader.upload(payloads)
+        post_seconds = (datetime.datetime.now() - post_start).total_seconds()
+        uploader.close()
+        num_received = len(server.received)
+
+    accepted = (responses['status_code'] > 0) & (responses['status_code'] <= 205)
+    return {'series': num_series,
+            'workers': workers,
+            'error_rate': error_rate,
+            'payloads': len(payloads.index),
+            'build_per_sec': len(payloads.index) / build_seconds if build_seconds > 0 else float('inf'),
+            'post_per_sec': len(payloads.index) / post_seconds if post_seconds > 0 else float('inf'),
+            # Per payload, including retries and their backoff, not per request
+            'payload_p50_ms': responses['seconds'].quantile(0.50) * 1000,
+            'payload_p99_ms': responses['seconds'].quantile(0.99) * 1000,
+            'retries': int((responses['attempts'] - 1).sum()),
+            'accepted': int(accepted.sum()),
+            'dead_letters': int((~accepted).sum()),
+            'received': num_received}
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    results = []
+    for num_series, workers, error_rate in itertools.product(args.series, args.workers, args.errorrate):
+        result = run_benchmark(num_series, workers, error_rate, args)
+        print("{series:>6} series, {workers:>3} workers, {error_rate:.0%} errors: "
+              "{payloads} payloads, built {build_per_sec:,.0f}/sec, posted {post_per_sec:,.1f}/sec, "
+              "per payload with retries p50 {payload_p50_ms:.1f} ms, p99 {payload_p99_ms:.1f} ms, {retries} retries, "
+              "{accepted} accepted, {dead_letters} dead letters".format(**result))
+        results.append(result)
+
+    print("")
+    print(pd.DataFrame(results).to_string(index=False, float_format='{:,.1f}'.format))
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+"""
+@author: Sara Geleskie Damiano
+
+This script benchmarks reading and rewriting the XmlBlob column of the Aquarius TimeSeriesMeta table, as done by
+CleanMetadata, on synthetic blobs, so no connection to the Aquarius database is needed.
+It compares parsing every blob with ElementTree and building a data frame from the attribute dictionaries against
+the aq_xmlblob codec, in one process and spread over several, and compares rewriting the start and end times with the
+two regular expression replacements CleanMetadata used to use against the single pass of the codec.  The results of
+each method are checked against each other.
+"""
+
+import re
+import time
+import random
+import datetime
+import argparse
+import xml.etree.ElementTree as ET
+import pandas as pd
+import Aquarius.aq_xmlblob as aq_xmlblob
+
+__author__ = 'Sara Geleskie Damiano'
+__contact__ = 'sdamiano@stroudcenter.org'
+
+
+# Set up a parser for command line options
+parser = argparse.ArgumentParser(
+    description='This script benchmarks reading and rewriting Aquarius metadata blobs.')
+parser.add_argument('--blobs', action='store', type=int, default=1000000,
+                    help='Sets the number of synthetic blobs')
+parser.add_argument('--workers', action='store', type=int, nargs='+', default=[1, 4],
+                    help='Sets the numbers of processes to decode the blobs with')
+parser.add_argument('--chunksize', action='store', type=int, default=100000,
+                    help='Sets the number of blobs each process decodes at a time')
+parser.add_argument('--escaped', action='store', type=float, default=0.01,
+                    help='Sets the fraction of blobs with comments the codec has to hand to the XML parser')
+
+# The regular expressions CleanMetadata rewrote the times with before the codec
+old_start_time_pattern = re.compile(r'(startTime="[0-9-]{10}\s[0-:."]{13})')
+old_end_time_pattern = re.compile(r'(endTime="[0-9-]{10}\s[0-:."]{13})')
+
+
+def make_synthetic_blobs(num_blobs, escaped_fraction, seed=0):
+    """
+    Creates blobs like those in TimeSeriesMeta, as the bytes read from the database.
+    """
+    random_state = random.Random(seed)
+    first_time = datetime.datetime(2014, 1, 1)
+    blobs = []
+    for blob_number in range(num_blobs):
+        start_time = first_time + datetime.timedelta(minutes=5 * random_state.randrange(1000000))
+        end_time = start_time + datetime.timedelta(minutes=5 * random_state.randrange(1, 10000))
+        times = 'startTime="{}" endTime="{}" dateApplied="{}" dateAppliedTZBias="-300"'.format(
+            start_time.strftime('%Y-%m-%d %H:%M:%S.000'), end_time.strftime('%Y-%m-%d %H:%M:%S.000'),
+            random_state.randrange(40000, 45000))
+        if random_state.random() < escaped_fraction:
+            comment = 'Sensor &amp; logger swapped &quot;{}&quot;'.format(blob_number)
+        else:
+            comment = random_state.choice(['', 'Correction was edited', 'Field visit {}'.format(blob_number)])
+        blob_type = blob_number % 4
+        if blob_type == 0:
+            blob = '<ApprovalCode {} code="{}" comment="{}"/>'.format(times, random_state.choice([-1, 900, 1200]),
+                                                                    comment)
+        elif blob_type == 1:
+            blob = '<DataGrade {} value="{}" comment="{}"/>'.format(times, random_state.choice(['-1.000', '4.000']),
+                                                                  comment)
+        elif blob_type == 2:
+            blob = '<Note {} comment="{}"/>'.format(times, comment)
+        else:
+            blob = '<Correction {} modifiedPoints="{}" comment="{}" type="Offset"/>'.format(
+                times, random_state.randrange(1000), comment)
+        blobs.append(blob.encode('latin-1'))
+    return blobs
+
+
+def decode_with_elementtree(blobs):
+    blob_text = [blob.decode('latin-1') for blob in blobs]
+    return pd.DataFrame([ET.fromstring(blob).attrib for blob in blob_text])
+
+
+def rewrite_with_old_patterns(blobs, start_times, end_times):
+    new_blobs = [old_start_time_pattern.sub('startTime="' + start_time + '"', blob)
+                 for blob, start_time in zip(blobs, start_times)]
+    return [old_end_time_pattern.sub('endTime="' + end_time + '"', blob)
+            for blob, end_time in zip(new_blobs, end_times)]
+
+
+def timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    print("Creating {:,} synthetic blobs".format(args.blobs))
+    blobs = make_synthetic_blobs(args.blobs, args.escaped)
+
+    results = []
+    expected, seconds = timed(decode_with_elementtree, blobs)
+    results.append({'stage': 'decode', 'method': 'ElementTree', 'workers': 1, 'seconds': seconds})
+    for workers in args.workers:
+        (decoded, fallbacks), seconds = timed(aq_xmlblob.decode_blobs, blobs, workers=workers,
+                                              chunk_size=args.chunksize)
+        matches = decoded[expected.columns].astype(object).equals(expected.astype(object))
+        results.append({'stage': 'decode', 'method': 'aq_xmlblob', 'workers': workers, 'seconds': seconds,
+                        'fallbacks': fallbacks, 'matches': matches})
+
+    blob_text = [blob.decode('latin-1') for blob in blobs]
+    new_start_times = ['2010-01-01 00:00:00.000'] * len(blob_text)
+    new_end_times = ['2030-12-31 23:55:00.000'] * len(blob_text)
+    expected_blobs, seconds = timed(rewrite_with_old_patterns, blob_text, new_start_times, new_end_times)
+    results.append({'stage': 'rewrite times', 'method': 'two regex passes', 'workers': 1, 'seconds': seconds})
+    rewritten_blobs, seconds = timed(aq_xmlblob.rewrite_times, blob_text, new_start_times, new_end_times)
+    results.append({'stage': 'rewrite times', 'method': 'aq_xmlblob', 'workers': 1, 'seconds': seconds,
+                    'matches': rewritten_blobs == expected_blobs})
+
+    results = pd.DataFrame(results)
+    results['blobs_per_sec'] = args.blobs / results['seconds']
+    print("")
+    print(results.to_string(index=False, float_format='{:,.2f}'.format))
@@ -15,6 +15,8 @@ import numpy as np
 
 # Bring in all of the database connection information.
 from DreamHost.dh_dbinfo import dh_db_host, dh_db_name, dh_db_name_cib, dh_db_user, dh_db_pass
+import DreamHost.dh_sync as dh_sync
+import DreamHost.dh_deployment as dh_deployment
 
 __author__ = 'Sara Geleskie Damiano'
 __contact__ = 'sdamiano@stroudcenter.org'
@@ -22,11 +24,9 @@ __contact__ = 'sdamiano@stroudcenter.org'
 # Turn off chained assignment warning.
 pd.options.mode.chained_assignment = None  # default='warn'
 
-drwi_aq_ids = pd.read_csv("R:\WilliamPenn_Delaware River\CitSci\Data\PythonToAquarius\AquariusDatasets.csv", header=0)
-drwi_aq_ids['SiteID'] = drwi_aq_ids['SiteID'].astype(str)
-
-fromMaster = pd.read_excel("R:/WilliamPenn_Delaware River/CitSci/Data/SensorStation_DeploymentInfo_MASTER.xlsx",
-                           sheet_name="Main", header=0, usecols="A:B, L:N, AV").dropna(axis=0, subset=["SiteID", 'LoggerID'])
+# The parsed sheets are cached locally and only read again from the share when they change
+drwi_aq_ids = dh_deployment.read_aquarius_datasets()
+fromMaster = dh_deployment.read_deployment_info()
 
 aq_sets = fromMaster.merge(drwi_aq_ids, how='outer', on='SiteID')
 aq_sets = aq_sets.drop(labels='i', axis=1)
@@ -34,14 +34,13 @@ aq_sets = aq_sets.drop(labels='i', axis=1)
 # Set up connection to the DreamHost MySQL database
 conn = pymysql.connect(host=dh_db_host, db=dh_db_name,
                        user=dh_db_user, passwd=dh_db_pass)
-cur = conn.cursor()
 
 query = "select * from Sites_for_midStream"
 
 sites_need_ids = pd.read_sql(query, conn)
 
 sites_need_ids['SiteCode'] = sites_need_ids['SiteCode'].astype(str)
-sites_need_ids = sites_need_ids.drop(labels='SiteID', axis=1)
+sites_need_ids = sites_need_ids.rename(columns={'SiteID': 'SiteNumber'})
 
 combined_sites = pd.merge(left=aq_sets, right=sites_need_ids, left_on='SiteID', right_on='SiteCode', how='left')
 combined_sites = combined_sites.sort_values(by='SiteID')
@@ -55,34 +54,20 @@ combined_sites = combined_sites.drop(labels=['Latitude', 'Longitude',
                                              'AQLocationID'], axis=1)
 
 
-for index, row in combined_sites.iterrows():
-    print(row['SiteCode'])
-    if pd.notna(row['SiteCode']):
-        edit_query =\
-            "update Sites_for_midStream " \
-            "set SiteName = \"%s\" " \
-            ", Latitude = %f " \
-            ", Longitude = %f " \
-            ", Elevation_m = %f " \
-            ", SpatialReference = \"WGS84\"" \
-            ", AQLocationID = %d " \
-            "where SiteCode = \"%s\"" \
-            % (row['Name'], row['latitude'], row['longitude'], row['elevation'],
-               row['AquariusLocationId'], row['SiteID'])
-        print(edit_query)
-        cur.execute(edit_query)
-        conn.commit()
-
-    else:
-        insert_query =\
-            "insert into Sites_for_midStream " \
-            "(SiteName, Latitude, Longitude, Elevation_m, SpatialReference, AQLocationID, SiteCode) " \
-            "values ( \"%s\", %f, %f, %f, \"WGS84\", %d, \"%s\")" \
-            % (row['Name'], row['latitude'], row['longitude'], row['elevation'],
-               row['AquariusLocationId'], row['SiteID'])
-        print(insert_query)
-        cur.execute(insert_query)
-        conn.commit()
-
+# Only write the sites which are new or have changed, all in one transaction
+desired_sites = pd.DataFrame({'SiteID': combined_sites['SiteNumber'],
+                              'SiteCode': combined_sites['SiteID'],
+                              'SiteName': combined_sites['Name'].astype(str),
+                              'Latitude': combined_sites['latitude'],
+                              'Longitude': combined_sites['longitude'],
+                              'Elevation_m': combined_sites['elevation'],
+                              'SpatialReference': 'WGS84',
+                              'AQLocationID': combined_sites['AquariusLocationId'].astype(int)})
+counts = dh_sync.sync_table(conn, 'Sites_for_midStream', desired_sites, 'SiteID',
+                            ['SiteCode', 'SiteName', 'Latitude', 'Longitude', 'Elevation_m', 'SpatialReference',
+                             'AQLocationID'])
+print("%s sites edited" % counts['updated'])
+print("%s sites created" % counts['inserted'])
+print("%s sites unchanged" % counts['unchanged'])
 
 conn.close()
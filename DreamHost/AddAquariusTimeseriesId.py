@@ -16,6 +16,8 @@ import numpy as np
 # Bring in all of the database connection information.
 # from DreamHost.dh_dbinfo import dh_db_host, dh_db_name, dh_db_name_cib, dh_db_user, dh_db_pass
 from dh_dbinfo import dh_db_host, dh_db_name, dh_db_name_cib, dh_db_user, dh_db_pass
+import dh_sync
+import dh_deployment
 
 __author__ = 'Sara Geleskie Damiano'
 __contact__ = 'sdamiano@stroudcenter.org'
@@ -24,57 +26,24 @@ __contact__ = 'sdamiano@stroudcenter.org'
 pd.options.mode.chained_assignment = None  # default='warn'
 
 # %%
-drwi_aq_ids = pd.read_csv("R:\WilliamPenn_Delaware River\CitSci\Data\PythonToAquarius\AquariusDatasets.csv", header=0)
-drwi_aq_ids['SiteID'] = drwi_aq_ids['SiteID'].astype(str)
-
-fromMaster = pd.read_excel("R:/WilliamPenn_Delaware River/CitSci/Data/SensorStation_DeploymentInfo_MASTER.xlsx",
-                           sheet_name="Main", header=0, usecols="A:B, L:N, AV").dropna(axis=0, subset=["SiteID", 'LoggerID'])
+# The parsed sheets are cached locally and only read again from the share when they change
+drwi_aq_ids = dh_deployment.read_aquarius_datasets()
+fromMaster = dh_deployment.read_deployment_info()
 
 # %%
 aq_sets = fromMaster.merge(drwi_aq_ids, how='outer', on='SiteID')
 aq_sets = aq_sets.drop(labels='i', axis=1)
 
-aq_sets2 = pd.melt(aq_sets, id_vars=["LoggerID", "SiteID", 'Name', 'latitude', 'longitude',
-                                     'Elevation (off google maps if necessary)', 'AquariusLocationId'],
-                   value_vars=['BatterySeriesId', 'BoardTempSeriesId',
-                               'ConductivitySeriesId', 'TempSeriesId', 'DepthSeriesId',
-                               'TurbLowSeriesId', 'TurbHighSeriesId',
-                               'SignalPercentSeriesId', 'SignalStrengthSeriesId'],
-                               value_name = 'AquariusTimeSeriesId')
-aq_sets['TableColumnName'] = ''
-aq_sets['VariableID'] = 0
-aq_sets2.loc[aq_sets2['variable'] == 'BatterySeriesId', 'TableColumnName'] = 'Battery'
-aq_sets2.loc[aq_sets2['variable'] == 'BoardTempSeriesId', 'TableColumnName'] = 'BoardTemp'
-aq_sets2.loc[aq_sets2['variable'] == 'ConductivitySeriesId', 'TableColumnName'] = 'CTDcond'
-aq_sets2.loc[aq_sets2['variable'] == 'TempSeriesId', 'TableColumnName'] = 'CTDtemp'
-aq_sets2.loc[aq_sets2['variable'] == 'DepthSeriesId', 'TableColumnName'] = 'CTDdepth'
-aq_sets2.loc[aq_sets2['variable'] == 'TurbLowSeriesId', 'TableColumnName'] = 'TurbLow'
-aq_sets2.loc[aq_sets2['variable'] == 'TurbHighSeriesId', 'TableColumnName'] = 'TurbHigh'
-aq_sets2.loc[aq_sets2['variable'] == 'SignalPercentSeriesId', 'TableColumnName'] = 'signalPercent'
-aq_sets2.loc[aq_sets2['variable'] == 'SignalStrengthSeriesId', 'TableColumnName'] = 'RSSI'
-aq_sets2.loc[aq_sets2['variable'] == 'DOppmSeriesId', 'TableColumnName'] = 'DOppm'
-aq_sets2.loc[aq_sets2['variable'] == 'DOpctSeriesId', 'TableColumnName'] = 'DOpercent'
-aq_sets2.loc[aq_sets2['variable'] == 'DOtempSeriesId', 'TableColumnName'] = 'DOtempC'
-
-aq_sets2.loc[aq_sets2['variable'] == 'BatterySeriesId', 'VariableID'] = 16
-aq_sets2.loc[aq_sets2['variable'] == 'BoardTempSeriesId', 'VariableID'] = 6
-aq_sets2.loc[aq_sets2['variable'] == 'ConductivitySeriesId', 'VariableID'] = 3
-aq_sets2.loc[aq_sets2['variable'] == 'TempSeriesId', 'VariableID'] = 2
-aq_sets2.loc[aq_sets2['variable'] == 'DepthSeriesId', 'VariableID'] = 1
-aq_sets2.loc[aq_sets2['variable'] == 'TurbLowSeriesId', 'VariableID'] = 4
-aq_sets2.loc[aq_sets2['variable'] == 'TurbHighSeriesId', 'VariableID'] = 5
-aq_sets2.loc[aq_sets2['variable'] == 'DOppmSeriesId', 'VariableID'] = 37
-aq_sets2.loc[aq_sets2['variable'] == 'DOpctSeriesId', 'VariableID'] = 36
-aq_sets2.loc[aq_sets2['variable'] == 'DOtempSeriesId', 'VariableID'] = 38
-aq_sets2.loc[aq_sets2['variable'] == 'SignalPercentSeriesId', 'VariableID'] = 77
-aq_sets2.loc[aq_sets2['variable'] == 'SignalStrengthSeriesId', 'VariableID'] = 78
+# One row for each series, with the table column and variable of each kind of series from the shared registry
+aq_sets2 = dh_deployment.melt_series_ids(aq_sets, id_vars=["LoggerID", "SiteID", 'Name', 'latitude', 'longitude',
+                                                           'Elevation (off google maps if necessary)',
+                                                           'AquariusLocationId'])
 aq_sets3 = aq_sets2.loc[aq_sets2['AquariusTimeSeriesId'] > 0]
 
 # %%
 # Set up connection to the DreamHost MySQL database
 conn = pymysql.connect(host=dh_db_host, db=dh_db_name,
                        user=dh_db_user, passwd=dh_db_pass)
-cur = conn.cursor()
 
 query = "select distinct SiteID as SiteNumber, SiteCode " \
         " from Sites_for_midStream "
@@ -123,42 +92,20 @@ check = combined_series.loc[pd.notna(combined_series['AQTimeSeriesID']) & (combi
 check2 = combined_series.loc[pd.notna(combined_series['TableName']) & (combined_series['TableName'] != combined_series['LoggerID'])]
 
 # %%
-i = 0
-j = 0
-for index, row in combined_series.iterrows():
-    # print(row['LoggerID'], row['TableColumnName'])
-    if pd.notna(row['SeriesID']):
-        edit_query =\
-            "update Series_for_midStream " \
-            "set TableName = \"%s\" " \
-            ", TableColumnName = \"%s\" " \
-            ", SeriesTimeZone = -5 " \
-            ", SiteID = %d " \
-            ", VariableID = %d " \
-            ", AQTimeSeriesID = %d " \
-            "where SeriesID = %d" \
-            % (row['LoggerID'], row['TableColumnName'], row['SiteNumber'], row['VariableID'],
-               row['AquariusTimeSeriesId'], row['SeriesID'])
-        # print(edit_query)
-        i += 1
-        cur.execute(edit_query)
-        conn.commit()
-
-    else:
-        insert_query =\
-            "insert into Series_for_midStream " \
-            "(TableName, TableColumnName, SeriesTimeZone, SiteID, VariableID, AQTimeSeriesID) " \
-            "values ( \"%s\", \"%s\", -5, %d, %d, \"%s\")" \
-            % (row['LoggerID'], row['TableColumnName'], row['SiteNumber'], row['VariableID'],
-               row['AquariusTimeSeriesId'])
-        # print(insert_query)
-        j += 1
-        cur.execute(insert_query)
-        conn.commit()
-
-print("%s series edited" % i)
-print("%s series created" % j)
-
+# Only write the series which are new or have changed, all in one transaction
+desired_series = pd.DataFrame({'SeriesID': combined_series['SeriesID'],
+                               'TableName': combined_series['LoggerID'],
+                               'TableColumnName': combined_series['TableColumnName'],
+                               'SeriesTimeZone': -5,
+                               'SiteID': combined_series['SiteNumber'],
+                               'VariableID': combined_series['VariableID'],
+                               'AQTimeSeriesID': combined_series['AquariusTimeSeriesId']})
+counts = dh_sync.sync_table(conn, 'Series_for_midStream', desired_series, 'SeriesID',
+                            ['TableName', 'TableColumnName', 'SeriesTimeZone', 'SiteID', 'VariableID',
+                             'AQTimeSeriesID'])
+print("%s series edited" % counts['updated'])
+print("%s series created" % counts['inserted'])
+print("%s series unchanged" % counts['unchanged'])
 
 
 # %%
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+Loading of the deployment spreadsheets the Aquarius ID sync scripts work from, with a local cache of the parsed sheets.
+
+The sheets live on a network share and the master deployment workbook is slow to parse, so each parsed, column
+selected sheet is pickled to a local cache.  A cached copy is only used while the source file's path, modification
+time and size (and the options it was read with) are the same as when it was cached; any change to the source and it
+is parsed again.
+"""
+
+import os
+import json
+import pickle
+import hashlib
+import pandas as pd
+
+__author__ = 'Sara Geleskie Damiano'
+__contact__ = 'sdamiano@stroudcenter.org'
+
+aquarius_datasets_file = "R:/WilliamPenn_Delaware River/CitSci/Data/PythonToAquarius/AquariusDatasets.csv"
+deployment_info_file = "R:/WilliamPenn_Delaware River/CitSci/Data/SensorStation_DeploymentInfo_MASTER.xlsx"
+
+default_cache_directory = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'SheetCache')
+
+# The Aquarius time series id columns of AquariusDatasets.csv, with the DreamHost table column and ODM variable each
+# one's data comes from.  A new kind of sensor only needs a line here.
+series_variables = [('BatterySeriesId', 'Battery', 16),
+                    ('BoardTempSeriesId', 'BoardTemp', 6),
+                    ('ConductivitySeriesId', 'CTDcond', 3),
+                    ('TempSeriesId', 'CTDtemp', 2),
+                    ('DepthSeriesId', 'CTDdepth', 1),
+                    ('TurbLowSeriesId', 'TurbLow', 4),
+                    ('TurbHighSeriesId', 'TurbHigh', 5),
+                    ('SignalPercentSeriesId', 'signalPercent', 77),
+                    ('SignalStrengthSeriesId', 'RSSI', 78),
+                    ('DOppmSeriesId', 'DOppm', 37),
+                    ('DOpctSeriesId', 'DOpercent', 36),
+                    ('DOtempSeriesId', 'DOtempC', 38)]
+
+
+def _cache_key(source_file, read_options):
+    source_stat = os.stat(source_file)
+    return {'path': os.path.realpath(source_file),
+            'mtime_ns': source_stat.st_mtime_ns,
+            'size': source_stat.st_size,
+            'read_options': read_options}
+
+
+def cached_read(source_file, read_function, cache_directory=None, debug=False, **read_options):
+    """
+    Reads a sheet, from the local cache if the source hasn't changed since it was cached.
+    :param source_file: The spreadsheet or csv to read
+    :param read_function: The pandas function to parse it with, like pd.read_excel
+    :param cache_directory: The directory the parsed sheets are cached in, by default SheetCache next to this file
+    :param debug: A boolean for whether extra print commands apply
+    :param read_options: Any other options for read_function; they are part of the cache key too
+    :return: A data frame of the sheet
+    """
+    cache_directory = cache_directory if cache_directory is not None else default_cache_directory
+    key = _cache_key(source_file, read_options)
+    cache_name = hashlib.sha1(json.dumps([key['path'], read_function.__name__, read_options],
+                                         sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    cache_file = os.path.join(cache_directory, cache_name + '.pkl')
+
+    if os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'rb') as open_cache:
+                cached_key, cached_frame = pickle.load(open_cache)
+            if cached_key == key:
+                if debug:
+                    print("Using the cached copy of %s" % source_file)
+                return cached_frame
+        except (pickle.UnpicklingError, EOFError, ValueError, AttributeError, ImportError):
+            # A cache from another version of pandas, or cut off part way through; it is just read again
+            pass
+
+    if debug:
+        print("Reading %s" % source_file)
+    frame = read_function(source_file, **read_options)
+    if not os.path.isdir(cache_directory):
+        os.makedirs(cache_directory)
+    temp_file = cache_file + '.tmp'
+    with open(temp_file, 'wb') as open_cache:
+        pickle.dump((key, frame), open_cache, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_file, cache_file)
+    return frame
+
+
+def read_aquarius_datasets(cache_directory=None, debug=False):
+    """
+    :return: The Aquarius location and time series ids for each site, from AquariusDatasets.csv
+    """
+    drwi_aq_ids = cached_read(aquarius_datasets_file, pd.read_csv, cache_directory, debug, header=0)
+    drwi_aq_ids['SiteID'] = drwi_aq_ids['SiteID'].astype(str)
+    return drwi_aq_ids
+
+
+def read_deployment_info(cache_directory=None, debug=False):
+    """
+    :return: The sites, loggers and locations from the main sheet of the master deployment workbook
+    """
+    from_master = cached_read(deployment_info_file, pd.read_excel, cache_directory, debug,
+                              sheet_name="Main", header=0, usecols="A:B, L:N, AV")
+    return from_master.dropna(axis=0, subset=["SiteID", 'LoggerID'])
+
+
+def series_variable_table():
+    """
+    :return: The series_variables as a data frame, with the series id column names as a categorical "variable" column
+    """
+    variable_table = pd.DataFrame(series_variables, columns=['variable', 'TableColumnName', 'VariableID'])
+    variable_table['variable'] = pd.Categorical(variable_table['variable'],
+                                                categories=[variable for variable, _, _ in series_variables])
+    return variable_table
+
+
+def melt_series_ids(aq_sets, id_vars, value_name='AquariusTimeSeriesId'):
+    """
+    Turns the time series id columns of the sites into one row for each series, with the DreamHost table column and
+    variable of each joined on from series_variables.
+    :param aq_sets: The sites, with a column for each kind of time series id
+    :param id_vars: The columns of the sites to keep on each series
+    :param value_name: The name of the time series id column
+    :return: A data frame with a row for each site and kind of series in series_variables the sites have a column for
+    """
+    variable_table = series_variable_table()
+    value_vars = [variable for variable in variable_table['variable'].cat.categories if variable in aq_sets.columns]
+    melted = pd.melt(aq_sets, id_vars=id_vars, value_vars=value_vars, value_name=value_name)
+    melted['variable'] = pd.Categorical(melted['variable'], categories=variable_table['variable'].cat.categories)
+    return melted.merge(variable_table, on='variable', how='left')
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+Per-stage metrics for the DreamHost sync pipelines.
+
+Each stage of a run (fetch from DreamHost, correct the timestamps, encode, upload and log) records the rows, bytes,
+calls, errors and time it took, split by whatever labels identify the work, like the table (logger), the series and
+the destination.  Times also go into a histogram with fixed buckets, so a slow logger or a slow endpoint stands out
+from the average.
+
+A run's metrics can be appended to a JSON lines file, one line for each stage and set of labels, or written as a
+Prometheus text file (for the node exporter's textfile collector) or served over http for Prometheus to scrape.
+"""
+
+import os
+import json
+import time
+import datetime
+import threading
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pytz
+
+__author__ = 'Sara Geleskie Damiano'
+__contact__ = 'sdamiano@stroudcenter.org'
+
+# The upper bounds, in seconds, of the latency histogram buckets; anything slower goes in the last, open bucket
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+metric_prefix = 'dreamhost_sync_stage'
+counter_names = ('rows', 'bytes', 'calls', 'errors')
+
+
+def _new_entry():
+    return {'rows': 0, 'bytes': 0, 'calls': 0, 'errors': 0, 'seconds': 0.0, 'timed_calls': 0,
+            'buckets': np.zeros(len(latency_buckets) + 1, dtype=np.int64)}
+
+
+def _label_key(labels):
+    # Labels that weren't given (None) are left off; every value is kept as text so keys from different runs match
+    return tuple(sorted((name, '{}'.format(value)) for name, value in labels.items() if value is not None))
+
+
+def _escape_label_value(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class PipelineMetrics(object):
+    """
+    The counters and latency histograms of one or more runs of a pipeline.  Recording is thread safe.
+    """
+
+    def __init__(self, pipeline):
+        """
+        :param pipeline: The name of the pipeline, added as a label to everything it records
+        """
+        self.pipeline = pipeline
+        self.started_at = datetime.datetime.now(pytz.utc)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, pipeline, stage, labels):
+        key = (pipeline, stage, _label_key(labels))
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _new_entry()
+        return entry
+
+    def record(self, stage, seconds=None, rows=0, bytes=0, calls=1, errors=0, **labels):
+        """
+        Records one or more calls of a stage.
+        :param stage: The stage, like "fetch", "correct", "encode", "upload" or "log"
+        :param seconds: How long the call took, or None if it wasn't timed
+        :param rows: The number of rows (data values) handled
+        :param bytes: The number of bytes read or sent
+        :param calls: The number of calls made
+        :param errors: The number of calls that failed
+        :param labels: What the work was for, like table, series or destination
+        """
+        with self._lock:
+            entry = self._entry(self.pipeline, stage, labels)
+            entry['rows'] += int(rows)
+            entry['bytes'] += int(bytes)
+            entry['calls'] += int(calls)
+            entry['errors'] += int(errors)
+            if seconds is not None:
+                entry['seconds'] += seconds
+                entry['timed_calls'] += 1
+                entry['buckets'][np.searchsorted(latency_buckets, seconds)] += 1
+
+    @contextlib.contextmanager
+    def timed(self, stage, **labels):
+        """
+        Times a block of code as one call of a stage, counting it as an error if it raises.  The block can fill in the
+        "rows" and "bytes" of the dictionary it is given.
+        """
+        counts = {'rows': 0, 'bytes': 0}
+        start = time.perf_counter()
+        try:
+            yield counts
+        except BaseException:
+            self.record(stage, time.perf_counter() - start, counts['rows'], counts['bytes'], errors=1, **labels)
+            raise
+        self.record(stage, time.perf_counter() - start, counts['rows'], counts['bytes'], **labels)
+
+    def record_frame(self, stage, frame, label_columns, seconds=None, rows=None, bytes=None, calls=None,
+                     errors=None, **labels):
+        """
+        Records a call of a stage for every row of a data frame at once, like the response of every post.
+        :param stage: The stage, like "upload"
+        :param frame: A data frame with a row for each call
+        :param label_columns: A dictionary of the label names to the columns of the frame holding them
+        :param seconds: The column of how long each call took, or None if they weren't timed
+        :param rows: The column of the number of rows of each call, or None for none
+        :param bytes: The column of the number of bytes of each call, or None for none
+        :param calls: The column of the number of calls each row took, or None for one each
+        :param errors: The column of whether each call failed, or None for none
+        :param labels: Labels with the same value for every row
+        """
+        if len(frame.index) == 0:
+            return
+        columns = {'rows': rows, 'bytes': bytes, 'calls': calls, 'errors': errors}
+        values = {name: (frame[column].to_numpy(dtype=np.int64) if column is not None
+                         else np.full(len(frame.index), 1 if name == 'calls' else 0, dtype=np.int64))
+                  for name, column in columns.items()}
+        label_names = list(label_columns.keys())
+        groups = frame.groupby([frame[column] for column in label_columns.values()], sort=False).indices
+        if seconds is not None:
+            call_seconds = frame[seconds].to_numpy(dtype=np.float64)
+            call_buckets = np.searchsorted(latency_buckets, call_seconds)
+        with self._lock:
+            for group_values, positions in groups.items():
+                if not isinstance(group_values, tuple):
+                    group_values = (group_values,)
+                entry = self._entry(self.pipeline, stage, dict(labels, **dict(zip(label_names, group_values))))
+                for name in counter_names:
+                    entry[name] += int(values[name][positions].sum())
+                if seconds is not None:
+                    entry['seconds'] += float(call_seconds[positions].sum())
+                    entry['timed_calls'] += len(positions)
+                    entry['buckets'] += np.bincount(call_buckets[positions], minlength=len(latency_buckets) + 1)
+
+    def merge(self, other):
+        """
+        Adds the counts of another PipelineMetrics (like those of a single run) to these.
+        """
+        with other._lock:
+            other_entries = [(key, dict(entry, buckets=entry['buckets'].copy()))
+                             for key, entry in other._entries.items()]
+        with self._lock:
+            for (pipeline, stage, label_key), other_entry in other_entries:
+                entry = self._entry(pipeline, stage, dict(label_key))
+                for name in counter_names + ('seconds', 'timed_calls', 'buckets'):
+                    entry[name] += other_entry[name]
+
+    def snapshot(self):
+        """
+        :return: A list of dictionaries, one for each stage and set of labels, with the pipeline, stage, labels,
+            counters, total seconds and the cumulative counts of the latency buckets
+        """
+        with self._lock:
+            entries = [(key, dict(entry, buckets=entry['buckets'].copy())) for key, entry in self._entries.items()]
+        records = []
+        for (pipeline, stage, label_key), entry in sorted(entries, key=lambda item: item[0]):
+            cumulative = np.cumsum(entry['buckets'])
+            records.append({'pipeline': pipeline,
+                            'stage': stage,
+                            'labels': dict(label_key),
+                            'rows': entry['rows'],
+                            'bytes': entry['bytes'],
+                            'calls': entry['calls'],
+                            'errors': entry['errors'],
+                            'seconds': round(entry['seconds'], 6),
+                            'timed_calls': entry['timed_calls'],
+                            'latency_buckets': dict(zip(['{:g}'.format(bound) for bound in latency_buckets] + ['+Inf'],
+                                                        cumulative.tolist()))})
+        return records
+
+    def write_json_lines(self, metrics_file):
+        """
+        Appends a line for each stage and set of labels to a JSON lines file, stamped with when these metrics started
+        and when they were written.
+        """
+        written_at = datetime.datetime.now(pytz.utc).isoformat()
+        with open(metrics_file, 'a') as open_file:
+            for record in self.snapshot():
+                open_file.write(json.dumps(dict(record, started_at=self.started_at.isoformat(),
+                                                written_at=written_at), sort_keys=True) + '\n')
+
+    def prometheus_text(self):
+        """
+        :return: The metrics in the Prometheus text exposition format
+        """
+        records = self.snapshot()
+        lines = []
+
+        def label_text(record, extra=()):
+            labels = [('pipeline', record['pipeline']), ('stage', record['stage'])] + \
+                     sorted(record['labels'].items()) + list(extra)
+            return '{' + ','.join('{}="{}"'.format(name, _escape_label_value(value)) for name, value in labels) + '}'
+
+        for name in counter_names:
+            lines.append('# HELP {}_{}_total The number of {} handled by each stage'.format(metric_prefix, name, name))
+            lines.append('# TYPE {}_{}_total counter'.format(metric_prefix, name))
+            for record in records:
+                lines.append('{}_{}_total{} {}'.format(metric_prefix, name, label_text(record), record[name]))
+        lines.append('# HELP {}_seconds The time taken by each call of each stage'.format(metric_prefix))
+        lines.append('# TYPE {}_seconds histogram'.format(metric_prefix))
+        for record in records:
+            for bound, count in record['latency_buckets'].items():
+                lines.append('{}_seconds_bucket{} {}'.format(metric_prefix, label_text(record, [('le', bound)]), count))
+            lines.append('{}_seconds_sum{} {}'.format(metric_prefix, label_text(record), record['seconds']))
+            lines.append('{}_seconds_count{} {}'.format(metric_prefix, label_text(record), record['timed_calls']))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, metrics_file):
+        """
+        Replaces a Prometheus text file with the current metrics, all at once so a scrape never sees half a file.
+        """
+        temp_file = metrics_file + '.tmp'
+        with open(temp_file, 'w') as open_file:
+            open_file.write(self.prometheus_text())
+        os.replace(temp_file, metrics_file)
+
+    def write(self, metrics_file):
+        """
+        Writes the metrics to a Prometheus text file if the file name ends in .prom, otherwise appends them to a JSON
+        lines file.
+        """
+        if metrics_file.endswith('.prom'):
+            self.write_prometheus(metrics_file)
+        else:
+            self.write_json_lines(metrics_file)
+
+
+def serve_prometheus(metrics, port, host=''):
+    """
+    Serves the metrics for Prometheus to scrape, at /metrics, from a background thread.
+    :param metrics: The PipelineMetrics to serve
+    :param port: The port to listen on
+    :param host: The address to listen on, by default every address
+    :return: The http server; call its shutdown method to stop it
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = metrics.prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics server', daemon=True).start()
+    return server
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+Syncing of a DreamHost table to a frame of the rows it should have, writing only what changed.
+
+The desired rows are matched to the current rows on the table's primary key, and every column is compared at once
+for all of the rows.  Only the new and changed rows are written, with a single batched
+INSERT ... ON DUPLICATE KEY UPDATE in one transaction: new rows (without a key) are inserted and take the next
+auto-increment key, rows with a key replace the existing row's values.
+"""
+
+import numpy as np
+import pandas as pd
+
+__author__ = 'Sara Geleskie Damiano'
+__contact__ = 'sdamiano@stroudcenter.org'
+
+
+def read_table(conn, table_name, columns):
+    """
+    Reads the given columns of every row of a table.
+    """
+    return pd.read_sql("SELECT {} FROM {}".format(", ".join(columns), table_name), conn)
+
+
+def _values_differ(desired, current):
+    # Blanks on both sides are the same; numbers are compared as numbers, so 5 and 5.0 aren't a change
+    both_blank = desired.isna().values & current.isna().values
+    desired_numbers = pd.to_numeric(desired, errors='coerce')
+    current_numbers = pd.to_numeric(current, errors='coerce')
+    if (desired_numbers.notna() | desired.isna()).all() and (current_numbers.notna() | current.isna()).all():
+        same = np.isclose(desired_numbers.values.astype(float), current_numbers.values.astype(float),
+                          rtol=0, atol=1e-9)
+    else:
+        same = desired.astype(str).values == current.astype(str).values
+    return ~(same | both_blank)
+
+
+def diff_table(desired, current, key_column, value_columns):
+    """
+    Compares the rows a table should have with the rows it has.
+    :param desired: A data frame of the rows the table should have, with the key blank for rows to insert
+    :param current: A data frame of the rows the table has, from read_table
+    :param key_column: The table's primary key
+    :param value_columns: The columns to compare and write
+    :return: A dictionary of data frames of the rows to insert ("insert"), the rows to update ("update") and the rows
+        already as they should be ("unchanged"), each with the key and value columns
+    """
+    desired = desired[[key_column] + value_columns].reset_index(drop=True)
+    has_key = desired[key_column].notna()
+    matched = desired[has_key].merge(current[[key_column] + value_columns], on=key_column, how='left',
+                                     suffixes=('', '_current'), indicator=True)
+    # Rows with a key the table doesn't have are inserted with that key
+    exists = (matched['_merge'] == 'both').values
+    changed = np.zeros(len(matched), dtype=bool)
+    for column in value_columns:
+        changed |= _values_differ(matched[column], matched[column + '_current'])
+    matched = matched[[key_column] + value_columns]
+    return {'insert': pd.concat([desired[~has_key], matched[~exists]], ignore_index=True),
+            'update': matched[exists & changed].reset_index(drop=True),
+            'unchanged': matched[exists & ~changed].reset_index(drop=True)}
+
+
+def _to_parameter(value):
+    # Blanks become NULL and numpy numbers plain python ones, which the driver knows how to quote.  Whole numbers held
+    # as floats (any integer column with a blank in it) are sent as integers.
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def sync_table(conn, table_name, desired, key_column, value_columns, debug=False):
+    """
+    Makes a table match a frame of the rows it should have, writing only the new and changed rows, in one transaction.
+    :param conn: An open connection to the DreamHost database
+    :param table_name: The table to sync
+    :param desired: A data frame of the rows the table should have, with the key blank for rows to insert.  Rows of
+        the table which aren't in the frame are left as they are.
+    :param key_column: The table's primary key
+    :param value_columns: The columns to compare and write
+    :param debug: A boolean for whether extra print commands apply
+    :return: A dictionary of the number of rows inserted, updated and unchanged
+    """
+    current = read_table(conn, table_name, [key_column] + value_columns)
+    diff = diff_table(desired, current, key_column, value_columns)
+    to_write = pd.concat([diff['update'], diff['insert']], ignore_index=True)
+
+    if len(to_write) > 0:
+        columns = [key_column] + value_columns
+        upsert_query = "INSERT INTO {} ({}) VALUES ({}) ON DUPLICATE KEY UPDATE {}".format(
+            table_name, ", ".join(columns), ", ".join(["%s"] * len(columns)),
+            ", ".join("{0} = VALUES({0})".format(column) for column in value_columns))
+        if debug:
+            print(upsert_query)
+        rows = [tuple(_to_parameter(value) for value in row)
+                for row in to_write[columns].itertuples(index=False, name=None)]
+        cur = conn.cursor()
+        try:
+            # The driver sends the rows as multi-row INSERTs rather than one statement per row
+            cur.executemany(upsert_query, rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+    counts = {'inserted': len(diff['insert']), 'updated': len(diff['update']), 'unchanged': len(diff['unchanged'])}
+    if debug:
+        print("{}: {inserted} rows inserted, {updated} rows updated, {unchanged} rows unchanged".format(
+            table_name, **counts))
+    return counts
@@ -9,6 +9,7 @@ Created by Sara Geleskie Damiano on 5/16/2016 at 6:14 PM
 
 import pymysql
 import pandas as pd
+import time
 import datetime
 import pytz
 import numpy as np
@@ -54,7 +55,7 @@ def convert_python_time_to_rtc(py_datetime, timezone):
 
 
 def get_dreamhost_data(required_column="SeriesID", query_start=None, query_end=None,
-                       data_table_name=None, data_column_name=None, debug=False):
+                       data_table_name=None, data_column_name=None, debug=False, metrics=None):
     """
     Gets all the data and series from a dreamhost series that has a required column
     :arguments:
@@ -63,15 +64,20 @@ def get_dreamhost_data(required_column="SeriesID", query_start=None, query_end=N
     query_end = A datetime string which data must be older than, defaults to none.
     dataTableName = A string table name, if data from only one is desired.
     dataColumnName = A string column name, if data from only one is desired
+    metrics = A dh_metrics.PipelineMetrics to record the time and rows of each query in, defaults to none.
     :return:
     Returns a list of series.
     """
 
     # Get the actual data for each series
+    fetch_start = time.perf_counter()
     series_table = get_dreamhost_series_table(required_column=required_column,
                                               series_query_start=query_start, series_query_end=query_end,
                                               data_table_name=data_table_name, data_column_name=data_column_name,
                                               debug=debug)
+    if metrics is not None:
+        metrics.record('fetch', time.perf_counter() - fetch_start, rows=len(series_table.index),
+                       table='Series_for_midStream')
 
     # Create a new table to append data to
     series_table_with_data = series_table
@@ -80,7 +86,7 @@ def get_dreamhost_data(required_column="SeriesID", query_start=None, query_end=N
         data_dt = get_data_from_dreamhost_table(table=row.TableName, column=row.TableColumnName,
                                                 data_query_start=row.DateTimeQueryStart,
                                                 data_query_end=row.DateTimeQueryEnd,
-                                                debug=debug)
+                                                debug=debug, metrics=metrics)
         series_table.loc[idx, 'NumberDataValues'] = len(data_dt.index)
         if len(data_dt.index) > 0:
             data_dt['SeriesID'] = row.SeriesID
@@ -264,7 +270,8 @@ def get_dreamhost_series_table(required_column="SeriesID", series_query_start=No
     return series_table
 
 
-def get_data_from_dreamhost_table(table, column, data_query_start=None, data_query_end=None, debug=False):
+def get_data_from_dreamhost_table(table, column, data_query_start=None, data_query_end=None, debug=False,
+                                  metrics=None):
     """
     Returns a pandas data frame with the timestamp and data value from a given table and column.
     :param table: A string which is the same of the SQL table of interest
@@ -272,6 +279,8 @@ def get_data_from_dreamhost_table(table, column, data_query_start=None, data_que
     :param data_query_start: The first date/time for data - All date times should be timezone AWARE
     :param data_query_end: The last date/time for data
     :param debug: A boolean for whether extra print commands apply
+    :param metrics: A dh_metrics.PipelineMetrics to record the query ("fetch") and the timestamp correction
+        ("correct") in, or None
     :return: A pandas data frame with the timestamp and data value from a given table and column.
     """
 
@@ -354,6 +363,7 @@ def get_data_from_dreamhost_table(table, column, data_query_start=None, data_que
         print("Data selected using the query:")
         print("   " + query_text)
     t1 = datetime.datetime.now()
+    fetch_start = time.perf_counter()
 
     # Set up connection to the DreamHost MySQL database
     if table in ["SL035", "SL036", "SL037"]:
@@ -369,9 +379,14 @@ def get_data_from_dreamhost_table(table, column, data_query_start=None, data_que
         if debug:
             print("   ERROR: ", e)
         conn.close()  # close the database connection
+        if metrics is not None:
+            metrics.record('fetch', time.perf_counter() - fetch_start, errors=1, table=table, column=column)
         return pd.DataFrame(columns=['timestamp', 'data_value'])
     else:
         conn.close()  # close the database connection
+    if metrics is not None:
+        metrics.record('fetch', time.perf_counter() - fetch_start, rows=len(values_table.index),
+                       table=table, column=column)
 
     if debug:
         t2 = datetime.datetime.now()
@@ -382,6 +397,7 @@ def get_data_from_dreamhost_table(table, column, data_query_start=None, data_que
     # remove old datetime column
     # values_table = pd.read_sql(query_text, conn)
     if values_table[dt_col].count() > 0:
+        correct_start = time.perf_counter()
         if table in ["davis", "CRDavis"]:
             values_table['timestamp_raw'] = \
                 values_table.apply(lambda row1: pytz.utc.localize(
@@ -438,6 +454,9 @@ def get_data_from_dreamhost_table(table, column, data_query_start=None, data_que
             values_table[values_table.timestamp < data_query_start].index, inplace=True)
         values_table.drop(
             values_table[values_table.timestamp > data_query_end].index, inplace=True)
+        if metrics is not None:
+            metrics.record('correct', time.perf_counter() - correct_start, rows=len(values_table.index),
+                           table=table, column=column)
 
         # if debug:
         #     print "The first and last rows from DreamHost:\r\n", values_table.head(2), "\r\n", values_table.tail(2)
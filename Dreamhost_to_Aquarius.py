@@ -10,15 +10,17 @@ from a DreamHost database to Stroud's Aquarius server.
 This uses command line arguments to decide what to append
 """
 
-import datetime
 import time
+import datetime
 import pytz
 import os
 import sys
 import argparse
-import numpy as np
 import Aquarius.aq_utils as aq_utils
+import Aquarius.aq_journal as aq_journal
+import Aquarius.aq_append as aq_append
 import DreamHost.dh_utils as dh_utils
+import DreamHost.dh_metrics as dh_metrics
 
 __author__ = 'Sara Geleskie Damiano'
 __contact__ = 'sdamiano@stroudcenter.org'
@@ -36,6 +38,10 @@ append_start = None  # Sets start time for the append **in EST**, use None for a
 append_end = None
 table = None  # Selects a single table to append from, often a logger number, use None for all loggers
 column = None  # Selects a single column to append from, often a variable code, use None for all columns
+resume = False  # Replays only the unfinished chunks from the append journal instead of querying DreamHost
+chunk_size = None  # Sets the maximum number of points in a single append, use None for one append per series
+compress_requests = False  # Gzips the SOAP requests sent to Aquarius, only if the server accepts compressed requests
+metrics_file = None  # Writes the metrics of each stage here; .prom for Prometheus text, otherwise JSON lines
 
 
 # %%
@@ -56,20 +62,15 @@ parser.add_argument('--start', action='store', default=None,
                     help='Selects a single column to append from, often a variable code')
 parser.add_argument('--end', action='store', default=None,
                     help='Selects a single column to append from, often a variable code')
-
-# %%
-# Read the command line options, if run from the command line
-if sys.stdin.isatty():
-    debug = parser.parse_args().debug
-    Log_to_file = parser.parse_args().nolog
-    past_hours_to_append = parser.parse_args().hours
-    append_start = parser.parse_args().start
-    append_end = parser.parse_args().end
-    table = parser.parse_args().table
-    column = parser.parse_args().col
-else:
-    debug = True
-    Log_to_file = True
+parser.add_argument('--resume', action='store_true',
+                    help='Replays the chunks in the append journal that were never finished')
+parser.add_argument('--chunksize', action='store', type=int, default=None,
+                    help='Sets the maximum number of points in a single append')
+parser.add_argument('--gzip', action='store_true',
+                    help='Gzips the requests sent to Aquarius')
+parser.add_argument('--metrics', action='store', default=None,
+                    help='Writes the metrics of each stage to this file, as Prometheus text if it ends in .prom, '
+                         'otherwise appended as JSON lines')
 
 # %%
 # Deal with timezones...
@@ -78,7 +79,7 @@ eastern_local_time = pytz.timezone('US/Eastern')
 
 
 # %%
-def start_log():
+def start_log(debug=False, Log_to_file=True):
     # Find the date/time the script was started:
     start_log_dt_utc = datetime.datetime.now(pytz.utc)
     start_log_dt_loc = start_log_dt_utc.astimezone(eastern_local_time)
@@ -114,7 +115,7 @@ def start_log():
 
 
 # %%
-def end_log(open_log_file, start_log_dt_utc):
+def end_log(open_log_file, start_log_dt_utc, debug=False, Log_to_file=True):
     # Find the date/time the script finished:
     end_datetime_utc = datetime.datetime.now(pytz.utc)
     end_datetime_loc = end_datetime_utc.astimezone(eastern_local_time)
@@ -135,78 +136,107 @@ def end_log(open_log_file, start_log_dt_utc):
 
 
 # %%
-# Open the log
-text_file, start_datetime_utc = start_log()
+def run_append(past_hours_to_append=None, append_start=None, append_end=None, table=None, column=None, resume=False,
+               resume_first=False, chunk_size=None, compress_requests=False, debug=False, Log_to_file=True,
+               metrics=None, metrics_file=None):
+    """
+    Appends the data from DreamHost to Aquarius once.
+    :param past_hours_to_append: The number of hours in the past to append, None for all time
+    :param append_start: The start time of the append **in EST**, as "%Y-%m-%d %H:%M:%S", None for all time
+    :param append_end: The end time of the append **in EST**, as "%Y-%m-%d %H:%M:%S", None for all time
+    :param table: A single table to append from, often a logger number, None for all loggers
+    :param column: A single column to append from, often a variable code, None for all columns
+    :param resume: Replays only the unfinished chunks from the append journal instead of querying DreamHost
+    :param resume_first: Replays the unfinished chunks from the append journal before querying DreamHost, so chunks
+        from a run that failed are retried without anyone having to resume by hand
+    :param chunk_size: The maximum number of points in a single append, None for one append per series
+    :param compress_requests: Gzips the SOAP requests sent to Aquarius
+    :param debug: A boolean for whether extra print commands apply
+    :param Log_to_file: A boolean for whether a log is written
+    :param metrics: A dh_metrics.PipelineMetrics to record each stage in, by default a new one for this run
+    :param metrics_file: A file to write the metrics to at the end of the run, or None
+    :return: The number of chunks left unfinished in the append journal
+    """
+    aq_utils.configure_transport(compress_requests=compress_requests)
+    if metrics is None:
+        metrics = dh_metrics.PipelineMetrics('dreamhost_to_aquarius')
+
+    # Open the log
+    text_file, start_datetime_utc = start_log(debug, Log_to_file)
+
+    try:
+        # Open the append journal - every chunk is recorded here before it is sent to Aquarius
+        journal_directory = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'Aquarius', 'AppendJournal')
+        journal = aq_journal.AppendJournal(journal_directory, debug=debug)
+
+        if resume or resume_first:
+            # Replay the chunks which were planned but never finished
+            aq_append.replay_unfinished_chunks(journal, text_file=text_file, debug=debug, metrics=metrics)
+
+        if not resume:
+            # Set the time cutoff for recent series
+            # Need to deal with times that are timezone aware/unaware - the MySQL database has no 'aware' timezones
+            if append_start is None:
+                append_start_dt = None
+            else:
+                append_start_dt_naive = datetime.datetime.strptime(
+                    append_start, "%Y-%m-%d %H:%M:%S")
+                append_start_dt = append_start_dt_naive.replace(
+                    tzinfo=eastern_standard_time)
+
+            if append_end is None:
+                append_end_dt = None
+            else:
+                append_end_dt_naive = datetime.datetime.strptime(
+                    append_end, "%Y-%m-%d %H:%M:%S")
+                append_end_dt = append_end_dt_naive.replace(tzinfo=eastern_standard_time)
+
+            if append_start is None and append_end is None and past_hours_to_append is not None:
+                append_end_dt = None
+                append_start_utc = start_datetime_utc - \
+                    datetime.timedelta(hours=past_hours_to_append)
+                append_start_dt = append_start_utc.astimezone(eastern_standard_time)
+
+            # Get data for all series that are available
+            AqSeries, AqData = dh_utils.get_dreamhost_data(required_column='AQTimeSeriesID',
+                                                           query_start=append_start_dt, query_end=append_end_dt,
+                                                           data_table_name=table, data_column_name=column,
+                                                           debug=debug, metrics=metrics)
+            AqSeries = AqSeries.sort_values(by=['TableName', 'DateTimeSeriesStart', 'TableColumnName'])
+            AqData = AqData.sort_values(by=['TableName', 'DateTimeSeriesStart', 'TableColumnName', 'timestamp'])
+
+            if Log_to_file:
+                text_file.write("{} series found with corresponding time series in Aquarius \n \n".format(
+                    len(AqSeries.index)))
+
+            aq_append.append_dreamhost_data(AqSeries, AqData, journal, text_file=text_file,
+                                            chunk_size=chunk_size, debug=debug, metrics=metrics)
+
+        # Drop everything from the journal that's been finished
+        compact_start = time.perf_counter()
+        RemainingChunks = journal.compact()
+        metrics.record('log', time.perf_counter() - compact_start, destination='journal')
+        if Log_to_file and RemainingChunks > 0:
+            text_file.write("\n{} chunks remain unfinished in the append journal; rerun with --resume to replay "
+                            "them \n".format(RemainingChunks))
+    finally:
+        # Close out the text file, even if the run failed
+        end_log(text_file, start_datetime_utc, debug, Log_to_file)
+
+    if metrics_file is not None:
+        metrics.write(metrics_file)
+    return RemainingChunks
 
 
 # %%
-# Set the time cutoff for recent series
-# Need to deal with times that are timezone aware/unaware - the MySQL database has no 'aware' timezones
-if append_start is None:
-    append_start_dt = None
-else:
-    append_start_dt_naive = datetime.datetime.strptime(
-        append_start, "%Y-%m-%d %H:%M:%S")
-    append_start_dt = append_start_dt_naive.replace(
-        tzinfo=eastern_standard_time)
-
-if append_end is None:
-    append_end_dt = None
-else:
-    append_end_dt_naive = datetime.datetime.strptime(
-        append_end, "%Y-%m-%d %H:%M:%S")
-    append_end_dt = append_end_dt_naive.replace(tzinfo=eastern_standard_time)
-
-if append_start is None and append_end is None and past_hours_to_append is not None:
-    append_end_dt = None
-    append_start_utc = start_datetime_utc - \
-        datetime.timedelta(hours=past_hours_to_append)
-    append_start_dt = append_start_utc.astimezone(eastern_standard_time)
-
-
-# %%
-# Get data for all series that are available
-AqSeries, AqData = dh_utils.get_dreamhost_data(required_column='AQTimeSeriesID',
-                                               query_start=append_start_dt, query_end=append_end_dt,
-                                               data_table_name=table, data_column_name=column, debug=debug)
-AqSeries = AqSeries.sort_values(by=['TableName', 'DateTimeSeriesStart', 'TableColumnName'])
-AqData = AqData.sort_values(by=['TableName', 'DateTimeSeriesStart', 'TableColumnName', 'timestamp'])
-
-if Log_to_file:
-    text_file.write("{} series found with corresponding time series in Aquarius \n \n".format(
-        len(AqSeries.index)))
-
-if len(AqData.index) > 0:
-    if Log_to_file:
-        text_file.write(
-            "Series, Table, Column, NumericIdentifier, TextIdentifier, NumPointsAppended, AppendToken  \n")
-
-    # Get the corresponding Aquarius series time zones for each time series
-    get_aq_timezone = np.vectorize(aq_utils.get_aquarius_timezone)
-    AqSeries['AQTimeZone'] = get_aq_timezone(
-        AqSeries['AQTimeSeriesID'], AqSeries['AQLocationID'])
-    AqSeries2 = AqSeries.loc[:, ['SeriesID', 'AQTimeZone']]
-
-    # Merge the Aquarius timezone with the data
-    AqData = AqData.merge(AqSeries2, how='left', on='SeriesID')
-    # Localize data to the Aquarius timezone
-    AqData['AQLocalizedTimeStamp'] = AqData.apply(
-        lambda row1: row1.timestamp.astimezone(row1.AQTimeZone), axis=1)
-
-    i = 1
-    for name, group in AqData.groupby('AQTimeSeriesID'):
-        append_bytes = aq_utils.create_appendable_csv(group)
-        AppendResult = aq_utils.aq_timeseries_append(
-            name, append_bytes, debug=debug)
-        # TODO: stop execution of further requests after an error.
-        if Log_to_file:
-            text_file.write("{}, {}, {}, {}, {}, {}, {} \n"
-                            .format(i, group['TableName'].iloc[0], group['TableColumnName'].iloc[0],
-                                    name, AppendResult.TsIdentifier,
-                                    AppendResult.NumPointsAppended, AppendResult.AppendToken))
-        time.sleep(1)
-        i += 1
-
-
-# Close out the text file
-end_log(text_file, start_datetime_utc)
+if __name__ == '__main__':
+    # Read the command line options, if run from the command line
+    if sys.stdin.isatty():
+        args = parser.parse_args()
+        run_append(past_hours_to_append=args.hours, append_start=args.start, append_end=args.end, table=args.table,
+                   column=args.col, resume=args.resume, chunk_size=args.chunksize, compress_requests=args.gzip,
+                   debug=args.debug, Log_to_file=args.nolog, metrics_file=args.metrics)
+    else:
+        run_append(past_hours_to_append=past_hours_to_append, append_start=append_start, append_end=append_end,
+                   table=table, column=column, resume=resume, chunk_size=chunk_size,
+                   compress_requests=compress_requests, debug=True, Log_to_file=True, metrics_file=metrics_file)
@@ -17,7 +17,10 @@ import os
 import sys
 import argparse
 import DreamHost.dh_utils as dh_utils
-import requests
+import DreamHost.dh_metrics as dh_metrics
+import EnviroDIY.diy_utils as diy_utils
+import EnviroDIY.diy_uploader as diy_uploader
+import EnviroDIY.diy_dead_letter as diy_dead_letter
 
 __author__ = 'Sara Geleskie Damiano'
 __contact__ = 'sdamiano@stroudcenter.org'
@@ -32,6 +35,12 @@ append_end = None  # Sets end time for the append **in EST**, use None for all t
 # table = "SL112"  # Selects a single table to append from, often a logger number, use None for all loggers
 table = None  # Selects a single table to append from, often a logger number, use None for all loggers
 column = None  # Selects a single column to append from, often a variable code, use None for all columns
+max_workers = 8  # Sets the total number of posts to EnviroDIY that may be in flight at once
+token_workers = 2  # Sets the number of posts that may be in flight at once for any single EnviroDIY token
+token_rate = None  # Sets the maximum requests per second for any single EnviroDIY token, use None for no limit
+max_attempts = 5  # Sets the number of times to try each post before putting it in the dead-letter queue
+replay = False  # Replays the dead-letter queue instead of querying DreamHost
+metrics_file = None  # Writes the metrics of each stage here; .prom for Prometheus text, otherwise JSON lines
 
 
 # Set up a parser for command line options
@@ -51,19 +60,19 @@ parser.add_argument('--start', action='store', default=None,
                     help='Sets the start time for the append')
 parser.add_argument('--end', action='store', default=None,
                     help='Sets the start time for the append')
-
-# Read the command line options, if run from the command line
-if sys.stdin.isatty():
-    debug = parser.parse_args().debug
-    Log_to_file = parser.parse_args().nolog
-    past_hours_to_append = parser.parse_args().hours
-    append_start = parser.parse_args().start
-    append_end = parser.parse_args().end
-    table = parser.parse_args().table
-    column = parser.parse_args().col
-else:
-    debug = True
-    Log_to_file = True
+parser.add_argument('--workers', action='store', type=int, default=8,
+                    help='Sets the total number of posts that may be in flight at once')
+parser.add_argument('--tokenworkers', action='store', type=int, default=2,
+                    help='Sets the number of posts that may be in flight at once for a single EnviroDIY token')
+parser.add_argument('--tokenrate', action='store', type=float, default=None,
+                    help='Sets the maximum requests per second for a single EnviroDIY token')
+parser.add_argument('--attempts', action='store', type=int, default=5,
+                    help='Sets the number of times to try each post before putting it in the dead-letter queue')
+parser.add_argument('--replay', action='store_true',
+                    help='Replays the payloads in the dead-letter queue')
+parser.add_argument('--metrics', action='store', default=None,
+                    help='Writes the metrics of each stage to this file, as Prometheus text if it ends in .prom, '
+                         'otherwise appended as JSON lines')
 
 # Deal with timezones...
 eastern_standard_time = pytz.timezone('Etc/GMT+5')
@@ -74,7 +83,7 @@ eastern_local_time = pytz.timezone('US/Eastern')
 # start_datetime_loc = start_datetime_utc.astimezone(eastern_local_time)
 
 
-def start_log():
+def start_log(debug=False, Log_to_file=True):
     # Find the date/time the script was started:
     start_log_dt_utc = datetime.datetime.now(pytz.utc)
     start_log_dt_loc = start_log_dt_utc.astimezone(eastern_local_time)
@@ -109,7 +118,7 @@ def start_log():
     return open_log_file, start_log_dt_utc
 
 
-def end_log(open_log_file, start_log_dt_utc):
+def end_log(open_log_file, start_log_dt_utc, debug=False, Log_to_file=True):
     # Find the date/time the script finished:
     end_datetime_utc = datetime.datetime.now(pytz.utc)
     end_datetime_loc = end_datetime_utc.astimezone(eastern_local_time)
@@ -130,108 +139,173 @@ def end_log(open_log_file, start_log_dt_utc):
         open_log_file.close()
 
 
-# Open the log
-text_file, start_datetime_utc = start_log()
-
-
-# Set the time cutoff for recent series
-# Need to deal with times that are timezone aware/unaware - the MySQL database has no 'aware' timezones
-if append_start is None:
-    append_start_dt = None
-else:
-    append_start_dt_naive = datetime.datetime.strptime(
-        append_start, "%Y-%m-%d %H:%M:%S")
-    append_start_dt = append_start_dt_naive.replace(
-        tzinfo=eastern_standard_time)
-
-if append_end is None:
-    append_end_dt = None
-else:
-    append_end_dt_naive = datetime.datetime.strptime(
-        append_end, "%Y-%m-%d %H:%M:%S")
-    append_end_dt = append_end_dt_naive.replace(tzinfo=eastern_standard_time)
-
-if append_start is None and append_end is None and past_hours_to_append is not None:
-    append_end_dt = None
-    append_start_utc = start_datetime_utc - \
-        datetime.timedelta(hours=past_hours_to_append)
-    append_start_dt = append_start_utc.astimezone(eastern_standard_time)
-
-
-# Get data for all series that are available
-DIYSeries, DIYData = dh_utils.get_dreamhost_data(required_column='TimeSeriesGUID',
-                                                 query_start=append_start_dt, query_end=append_end_dt,
-                                                 data_table_name=table, data_column_name=column, debug=debug)
-
-if Log_to_file:
-    text_file.write("%s series found with corresponding time series on the EnviroDIY data portal \n \n"
-                    % (len(DIYSeries.index)))
-
-DIYData.sort_values(by=['TableName', 'EnviroDIYToken',
-                        'SamplingFeatureGUID', 'timestamp'], inplace=True)
-
-if len(DIYData.index) > 0:
-    DIYData['AppendSuccessful'] = 0
-    DIYData['AppendFailed'] = 1
-
-    if Log_to_file:
-        text_file.write(
-            "Site Code, Table, # Successful Appends, # Unsuccessful Appends, Max Offset between Server and Logger, Max Timestamp Correction  \n")
-
-    for name, group in DIYData.groupby(['EnviroDIYToken', 'SamplingFeatureGUID', 'timestamp']):
-        json_string = '{\r\n"sampling_feature": "'
-        json_string += group.iloc[0].SamplingFeatureGUID
-        json_string += '",\r\n"timestamp": "'
-        json_string += group.iloc[0].timestamp.isoformat()
-        json_string += '"'
-        for idx, row in group.iterrows():
-            json_string += ',\r\n    "'
-            json_string += row.TimeSeriesGUID
-            json_string += '": '
-            json_string += str(row.data_value)
-        json_string += '\r\n}'
-
-        response = ''
-        while response == '':
-            try:
-                response = requests.post(url='http://data.envirodiy.org/api/data-stream/',
-                                         headers={
-                                             "TOKEN": group.iloc[0].EnviroDIYToken, 'Content-Type': 'application/json'},
-                                         data=json_string)
-            except:
-                if debug:
-                    print("Waiting to retry...")
-                time.sleep(5)
-                continue
-
-        for idx, row in group.iterrows():
-            if response.status_code <= 205:
-                DIYData.loc[idx, ['AppendSuccessful']] = 1
-                DIYData.loc[idx, ['AppendFailed']] = 0
-
-        if debug:
-            print(group.iloc[0].TableName, "-",
-                  group.iloc[0].timestamp.isoformat(), "-", response.status_code)
-            # print "    ", response.request.method, response.request.path_url
-            # print "    ", response.request.headers
-            # print "    ", response.request.body
-            # print "    ", "Response status code: %s" % response.status_code
-            if response.status_code > 205:
-                print("    ", response.text)
-
-    DIYData["NumberSuccessfulAppends"] = \
-        DIYData.groupby(['EnviroDIYToken', 'SamplingFeatureGUID']
-                        )['AppendSuccessful'].transform('sum')
-    DIYData["NumberFailedAppends"] = \
-        DIYData.groupby(['EnviroDIYToken', 'SamplingFeatureGUID']
-                        )['AppendFailed'].transform('sum')
-
-    if Log_to_file:
-        for name, group in DIYData.groupby(['EnviroDIYToken', 'SamplingFeatureGUID']):
-            text_file.write("{}, {}, {}, {}, {}, {}  \n"
-                            .format(group.iloc[0].SiteCode, group.iloc[0].TableName,
-                                    group.iloc[0].NumberSuccessfulAppends, group.iloc[0].NumberFailedAppends,
-                                    group.server_offset.max(), group.time_correction.max()))
-
-# Close out the text file
-end_log(text_file, start_datetime_utc)
+def run_upload(past_hours_to_append=None, append_start=None, append_end=None, table=None, column=None,
+               max_workers=8, token_workers=2, token_rate=None, max_attempts=5, replay=False, replay_first=False,
+               uploader=None, debug=False, Log_to_file=True, metrics=None, metrics_file=None):
+    """
+    Posts the data from DreamHost to the EnviroDIY data portal once.
+    :param past_hours_to_append: The number of hours in the past to append, None for all time
+    :param append_start: The start time of the append **in EST**, as "%Y-%m-%d %H:%M:%S", None for all time
+    :param append_end: The end time of the append **in EST**, as "%Y-%m-%d %H:%M:%S", None for all time
+    :param table: A single table to append from, often a logger number, None for all loggers
+    :param column: A single column to append from, often a variable code, None for all columns
+    :param max_workers: The total number of posts that may be in flight at once
+    :param token_workers: The number of posts that may be in flight at once for any single EnviroDIY token
+    :param token_rate: The maximum requests per second for any single EnviroDIY token, None for no limit
+    :param max_attempts: The number of times to try each post before putting it in the dead-letter queue
+    :param replay: Replays the dead-letter queue instead of querying DreamHost
+    :param replay_first: Replays the dead-letter queue before querying DreamHost, so payloads that failed on an earlier
+        run are retried without anyone having to replay them by hand
+    :param uploader: A DataStreamUploader to post with, which is left open; by default one is made from the options
+        above and closed at the end
+    :param debug: A boolean for whether extra print commands apply
+    :param Log_to_file: A boolean for whether a log is written
+    :param metrics: A dh_metrics.PipelineMetrics to record each stage in, by default a new one for this run
+    :param metrics_file: A file to write the metrics to at the end of the run, or None
+    :return: The number of payloads added to the dead-letter queue
+    """
+    if metrics is None:
+        metrics = dh_metrics.PipelineMetrics('dreamhost_to_envirodiy')
+
+    # Open the log
+    text_file, start_datetime_utc = start_log(debug, Log_to_file)
+
+    # Post over a pooled session, with each sampling feature's posts kept in order.  An uploader that was passed in is
+    # left open, so its connections stay warm for the next run.
+    own_uploader = uploader is None
+
+    try:
+        # Failed payloads are kept here until they can be replayed
+        dead_letters = diy_dead_letter.DeadLetterQueue(
+            os.path.join(os.path.dirname(os.path.realpath(__file__)), 'EnviroDIY', 'DeadLetters'), debug=debug)
+
+        if own_uploader:
+            uploader = diy_uploader.DataStreamUploader(max_workers=max_workers, per_token_concurrency=token_workers,
+                                                       per_token_rate=token_rate, max_attempts=max_attempts,
+                                                       debug=debug)
+
+        NumDeadLetters = 0
+        if replay or replay_first:
+            # Drain the dead-letter queue; anything that fails again goes back in it
+            replay_start = datetime.datetime.now()
+            NumReplayed, NumAccepted = dead_letters.drain(uploader)
+            replay_seconds = (datetime.datetime.now() - replay_start).total_seconds()
+            # The posts of a replay aren't timed one by one, so they are only counted
+            metrics.record('upload', calls=NumReplayed, errors=NumReplayed - NumAccepted, destination='envirodiy')
+            if debug:
+                print("{} of {} dead letters were accepted on replay".format(NumAccepted, NumReplayed))
+            if Log_to_file:
+                text_file.write("{} of {} dead letters were accepted on replay in {:.3f} seconds \n".format(
+                    NumAccepted, NumReplayed, replay_seconds))
+                text_file.write("{} dead letters remain in the queue \n".format(NumReplayed - NumAccepted))
+
+        if not replay:
+            # Set the time cutoff for recent series
+            # Need to deal with times that are timezone aware/unaware - the MySQL database has no 'aware' timezones
+            if append_start is None:
+                append_start_dt = None
+            else:
+                append_start_dt_naive = datetime.datetime.strptime(
+                    append_start, "%Y-%m-%d %H:%M:%S")
+                append_start_dt = append_start_dt_naive.replace(
+                    tzinfo=eastern_standard_time)
+
+            if append_end is None:
+                append_end_dt = None
+            else:
+                append_end_dt_naive = datetime.datetime.strptime(
+                    append_end, "%Y-%m-%d %H:%M:%S")
+                append_end_dt = append_end_dt_naive.replace(tzinfo=eastern_standard_time)
+
+            if append_start is None and append_end is None and past_hours_to_append is not None:
+                append_end_dt = None
+                append_start_utc = start_datetime_utc - \
+                    datetime.timedelta(hours=past_hours_to_append)
+                append_start_dt = append_start_utc.astimezone(eastern_standard_time)
+
+            # Get data for all series that are available
+            DIYSeries, DIYData = dh_utils.get_dreamhost_data(required_column='TimeSeriesGUID',
+                                                             query_start=append_start_dt, query_end=append_end_dt,
+                                                             data_table_name=table, data_column_name=column,
+                                                             debug=debug, metrics=metrics)
+
+            if Log_to_file:
+                text_file.write("%s series found with corresponding time series on the EnviroDIY data portal \n \n"
+                                % (len(DIYSeries.index)))
+
+            DIYData.sort_values(by=['TableName', 'EnviroDIYToken',
+                                    'SamplingFeatureGUID', 'timestamp'], inplace=True)
+
+            if len(DIYData.index) > 0:
+                # Build all of the JSON bodies up front
+                build_start = datetime.datetime.now()
+                DIYPayloads, PayloadForRow = diy_utils.build_data_stream_payloads(DIYData, debug=debug)
+                build_seconds = (datetime.datetime.now() - build_start).total_seconds()
+                PayloadBytes = DIYPayloads['payload'].str.len()
+                metrics.record('encode', build_seconds, rows=len(DIYData.index), bytes=PayloadBytes.sum(),
+                               destination='envirodiy')
+                if Log_to_file:
+                    text_file.write("{} payloads built in {:.3f} seconds ({:.0f} payloads/sec) \n \n".format(
+                        len(DIYPayloads.index), build_seconds,
+                        len(DIYPayloads.index) / build_seconds if build_seconds > 0 else float('inf')))
+
+                # Post the payloads
+                post_start = datetime.datetime.now()
+                DIYResponses = uploader.upload(DIYPayloads)
+                post_seconds = (datetime.datetime.now() - post_start).total_seconds()
+                # Every post was timed by the uploader, so each one goes into the latency histogram of its table
+                metrics.record_frame('upload', DIYResponses.assign(TableName=DIYPayloads['TableName'],
+                                                                   num_values=DIYPayloads['num_values'],
+                                                                   payload_bytes=PayloadBytes,
+                                                                   failed=diy_dead_letter.failed_posts(DIYResponses)),
+                                     {'table': 'TableName'}, seconds='seconds', rows='num_values',
+                                     bytes='payload_bytes', calls='attempts', errors='failed', destination='envirodiy')
+                if Log_to_file:
+                    text_file.write("{} payloads posted in {:.3f} seconds ({:.0f} payloads/sec) \n \n".format(
+                        len(DIYPayloads.index), post_seconds,
+                        len(DIYPayloads.index) / post_seconds if post_seconds > 0 else float('inf')))
+
+                # Keep anything that wasn't accepted so it can be replayed later
+                log_start = time.perf_counter()
+                NumDeadLetters = dead_letters.add(DIYPayloads, DIYResponses)
+                metrics.record('log', time.perf_counter() - log_start, rows=NumDeadLetters, destination='dead letters')
+                if Log_to_file and NumDeadLetters > 0:
+                    text_file.write("{} payloads were not accepted and were added to the dead-letter queue \n \n"
+                                    .format(NumDeadLetters))
+
+                # Summarize by site straight from the status of each payload
+                PayloadSuccessful = (~diy_dead_letter.failed_posts(DIYResponses)).values
+                SiteSummary = diy_utils.summarize_appends(DIYData, PayloadSuccessful, PayloadForRow)
+
+                if Log_to_file:
+                    text_file.write(
+                        "Site Code, Table, # Successful Appends, # Unsuccessful Appends, Max Offset between Server and Logger, Max Timestamp Correction  \n")
+                    for site in SiteSummary.itertuples():
+                        text_file.write("{}, {}, {}, {}, {}, {}  \n"
+                                        .format(site.SiteCode, site.TableName,
+                                                site.NumberSuccessfulAppends, site.NumberFailedAppends,
+                                                site.MaxServerOffset, site.MaxTimeCorrection))
+    finally:
+        if own_uploader and uploader is not None:
+            uploader.close()
+        # Close out the text file, even if the run failed
+        end_log(text_file, start_datetime_utc, debug, Log_to_file)
+
+    if metrics_file is not None:
+        metrics.write(metrics_file)
+    return NumDeadLetters
+
+
+if __name__ == '__main__':
+    # Read the command line options, if run from the command line
+    if sys.stdin.isatty():
+        args = parser.parse_args()
+        run_upload(past_hours_to_append=args.hours, append_start=args.start, append_end=args.end, table=args.table,
+                   column=args.col, max_workers=args.workers, token_workers=args.tokenworkers,
+                   token_rate=args.tokenrate, max_attempts=args.attempts, replay=args.replay, debug=args.debug,
+                   Log_to_file=args.nolog, metrics_file=args.metrics)
+    else:
+        run_upload(past_hours_to_append=past_hours_to_append, append_start=append_start, append_end=append_end,
+                   table=table, column=column, max_workers=max_workers, token_workers=token_workers,
+                   token_rate=token_rate, max_attempts=max_attempts, replay=replay, debug=True, Log_to_file=True,
+                   metrics_file=metrics_file)
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Sara Geleskie Damiano'
+__contact__ = 'sdamiano@stroudcenter.org'
+
+"""
+Created by Sara Geleskie Damiano on 1/11/2018 at 10:38 AM
+
+
+"""
\ No newline at end of file
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+An on-disk dead-letter queue for payloads that EnviroDIY would not accept.
+
+Payloads which still fail after the uploader's retries are written here (token, sampling feature, timestamp, body and
+last status) instead of being lost.  The queue can be drained later, concurrently, once the portal is back.
+"""
+
+import os
+import json
+import datetime
+import pytz
+import pandas as pd
+
+__author__ = 'Sara Geleskie Damiano'
+__contact__ = 'sdamiano@stroudcenter.org'
+
+dead_letter_columns = ['EnviroDIYToken', 'SamplingFeatureGUID', 'TableName', 'SiteCode', 'timestamp', 'payload',
+                       'last_status', 'response_text', 'attempts', 'queued']
+
+
+def failed_posts(responses):
+    """
+    :param responses: The data frame of responses returned by DataStreamUploader.upload
+    :return: A boolean series of which payloads were not accepted
+    """
+    return (responses['status_code'] == 0) | (responses['status_code'] > 205)
+
+
+class DeadLetterQueue(object):
+    """
+    A JSON-lines file of failed payloads, one per line.
+    """
+
+    def __init__(self, queue_directory, debug=False):
+        self.queue_directory = queue_directory
+        self.queue_file = os.path.join(queue_directory, 'DeadLetters.jsonl')
+        # Letters are moved here while they are being replayed, so anything that fails during the replay can be
+        # queued again without mixing it up with the letters being drained.
+        self.draining_file = os.path.join(queue_directory, 'DeadLetters.draining.jsonl')
+        self.debug = debug
+
+        if not os.path.isdir(queue_directory):
+            os.makedirs(queue_directory)
+
+    def add(self, payload_table, responses):
+        """
+        Queues every payload that was not accepted.
+        :param payload_table: The payloads that were posted, from diy_utils.build_data_stream_payloads
+        :param responses: The data frame of responses returned by DataStreamUploader.upload
+        :return: The number of payloads added to the queue
+        """
+        failed = failed_posts(responses)
+        if not failed.any():
+            return 0
+        letters = payload_table.loc[failed, ['EnviroDIYToken', 'SamplingFeatureGUID', 'TableName', 'SiteCode',
+                                             'timestamp', 'payload']]
+        letters['last_status'] = responses.loc[failed, 'status_code']
+        letters['response_text'] = responses.loc[failed, 'response_text']
+        letters['attempts'] = responses.loc[failed, 'attempts']
+        letters['queued'] = datetime.datetime.now(pytz.utc).isoformat()
+        with open(self.queue_file, 'a') as open_queue:
+            open_queue.write(letters.to_json(orient='records', lines=True))
+            open_queue.write('\n')
+            open_queue.flush()
+            os.fsync(open_queue.fileno())
+        if self.debug:
+            print("{} failed payloads added to the dead-letter queue".format(len(letters.index)))
+        return len(letters.index)
+
+    def _read_file(self, file_name):
+        letters = []
+        if os.path.isfile(file_name):
+            with open(file_name, 'r') as open_queue:
+                for line in open_queue:
+                    if line.strip() == '':
+                        continue
+                    try:
+                        letters.append(json.loads(line))
+                    except ValueError:
+                        if self.debug:
+                            print("Skipping unreadable dead letter: {}".format(line.strip()))
+        return letters
+
+    def read(self):
+        """
+        :return: A pandas data frame of all of the letters waiting in the queue, including any left over from a
+            replay that did not finish
+        """
+        letters = self._read_file(self.draining_file) + self._read_file(self.queue_file)
+        return pd.DataFrame(letters, columns=dead_letter_columns)
+
+    def __len__(self):
+        return len(self.read().index)
+
+    def drain(self, uploader):
+        """
+        Replays everything in the queue through the uploader.  Letters that fail again go back in the queue.
+        :param uploader: A DataStreamUploader
+        :return: A tuple of the number of letters replayed and the number that were accepted
+        """
+        # Move the queue aside; a replay that died part way through will have left letters in the draining file
+        if os.path.isfile(self.queue_file):
+            if os.path.isfile(self.draining_file):
+                with open(self.draining_file, 'a') as open_draining:
+                    for letter in self._read_file(self.queue_file):
+                        open_draining.write(json.dumps(letter) + '\n')
+                    open_draining.flush()
+                    os.fsync(open_draining.fileno())
+                os.remove(self.queue_file)
+            else:
+                os.replace(self.queue_file, self.draining_file)
+
+        letters = pd.DataFrame(self._read_file(self.draining_file), columns=dead_letter_columns)
+        if len(letters.index) == 0:
+            return 0, 0
+
+        # Keep each sampling feature's letters in timestamp order, so the uploader posts them in order
+        letters = letters.drop_duplicates(subset=['EnviroDIYToken', 'SamplingFeatureGUID', 'timestamp'], keep='last')
+        letters = letters.sort_values(by=['EnviroDIYToken', 'SamplingFeatureGUID', 'timestamp'],
+                                      kind='mergesort').reset_index(drop=True)
+        if self.debug:
+            print("Replaying {} dead letters".format(len(letters.index)))
+
+        responses = uploader.upload(letters)
+        self.add(letters, responses)
+        os.remove(self.draining_file)
+
+        num_accepted = int((~failed_posts(responses)).sum())
+        return len(letters.index), num_accepted
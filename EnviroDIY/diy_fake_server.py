@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+A local stand-in for the EnviroDIY /api/data-stream/ endpoint, for load testing the uploader without touching
+data.envirodiy.org.
+
+The server runs in a background thread.  It can add latency to every response, fail a share of requests with a
+server error, rate limit each token and reject unknown tokens.  Every payload it accepts is recorded so a test can
+check exactly what arrived, and in what order.
+"""
+
+import time
+import json
+import random
+import threading
+import collections
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+__author__ = 'Sara Geleskie Damiano'
+__contact__ = 'sdamiano@stroudcenter.org'
+
+
+class _DataStreamHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so that clients can keep their connections alive between posts
+    protocol_version = 'HTTP/1.1'
+
+    def _respond(self, status_code, text, headers=None):
+        body = bytes(text, 'utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        fake = self.server.fake
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        token = self.headers.get('TOKEN')
+        status_code = fake.handle(self.path, token, body)
+        if status_code == 429:
+            self._respond(status_code, '{"detail": "Request was throttled."}', {'Retry-After': '1'})
+        elif status_code >= 400:
+            self._respond(status_code, '{{"detail": "Fake server returned {}"}}'.format(status_code))
+        else:
+            self._respond(status_code, '')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeDataStreamServer(object):
+    """
+    A fake EnviroDIY data-stream endpoint.  Use as a context manager, or call start() and stop().
+    """
+
+    def __init__(self, latency=0.0, latency_jitter=0.0, error_rate=0.0, error_status=503,
+                 token_rate_limit=None, valid_tokens=None, seed=None):
+        """
+        :param latency: Seconds to wait before answering each request
+        :param latency_jitter: Up to this many more seconds are randomly added to each request's latency
+        :param error_rate: The fraction of otherwise good requests to fail with error_status
+        :param error_status: The status code returned for injected failures
+        :param token_rate_limit: The number of requests each token may make in any one second before getting a 429,
+            None for no limit
+        :param valid_tokens: A collection of the tokens to accept, None to accept any token
+        :param seed: A seed for the random latency and failures, so runs can be repeated
+        """
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.token_rate_limit = token_rate_limit
+        self.valid_tokens = None if valid_tokens is None else set(valid_tokens)
+        self._random = random.Random(seed)
+
+        self._lock = threading.Lock()
+        self._recent_requests = collections.defaultdict(collections.deque)
+        self.received = []
+        self.status_counts = collections.Counter()
+
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/api/data-stream/'.format(self._server.server_port)
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _DataStreamHandler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _over_rate_limit(self, token, now):
+        if self.token_rate_limit is None:
+            return False
+        recent = self._recent_requests[token]
+        while recent and recent[0] <= now - 1:
+            recent.popleft()
+        if len(recent) >= self.token_rate_limit:
+            return True
+        recent.append(now)
+        return False
+
+    def handle(self, path, token, body):
+        """
+        Decides how to answer a single post, and records it if it is accepted.
+        :return: The status code to respond with
+        """
+        with self._lock:
+            wait = self.latency + self._random.uniform(0, self.latency_jitter)
+            inject_error = self._random.random() < self.error_rate
+        if wait > 0:
+            time.sleep(wait)
+
+        with self._lock:
+            if not path.rstrip('/').endswith('/api/data-stream'):
+                status_code = 404
+            elif token is None or (self.valid_tokens is not None and token not in self.valid_tokens):
+                status_code = 403
+            elif self._over_rate_limit(token, time.monotonic()):
+                status_code = 429
+            elif inject_error:
+                status_code = self.error_status
+            else:
+                try:
+                    payload = json.loads(body)
+                except ValueError:
+                    status_code = 400
+                else:
+                    self.received.append((token, payload))
+                    status_code = 201
+            self.status_counts[status_code] += 1
+        return status_code
+
+    def reset(self):
+        with self._lock:
+            self.received = []
+            self.status_counts = collections.Counter()
+            self._recent_requests.clear()
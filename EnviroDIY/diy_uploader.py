@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+A pooled, concurrent uploader for the EnviroDIY data-stream endpoint.
+
+All posts share one keep-alive session.  Payloads for a single sampling feature form a "lane" which is always posted
+in order by a single worker, so data for a site reaches the portal in timestamp order.  Lanes from different sampling
+features are posted in parallel by a bounded pool of workers, with a cap on how many lanes any one EnviroDIY token
+may have in flight and an optional cap on how many requests per second it may make, so a single big site cannot tie
+up every worker or trip the portal's rate limiting for everyone else.
+
+Connection errors, rate limiting and server errors are retried a bounded number of times with exponential backoff.
+Anything still failing after that is returned with its last status so it can be put in the dead-letter queue.
+"""
+
+import math
+import time
+import random
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+__author__ = 'Sara Geleskie Damiano'
+__contact__ = 'sdamiano@stroudcenter.org'
+
+data_stream_url = 'http://data.envirodiy.org/api/data-stream/'
+
+# Responses worth trying again; anything else over 205 means the payload or token is bad and won't get better
+retryable_status_codes = (408, 429, 500, 502, 503, 504)
+
+
+class TokenRateLimiter(object):
+    """
+    Spaces out the start of requests for a single token so there are never more than max_rate per second.
+    """
+
+    def __init__(self, max_rate=None):
+        self.min_interval = 0 if max_rate is None or max_rate <= 0 else 1.0 / max_rate
+        self._next_allowed = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if self.min_interval == 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start_at = max(now, self._next_allowed)
+            self._next_allowed = start_at + self.min_interval
+        if start_at > now:
+            time.sleep(start_at - now)
+
+
+class DataStreamUploader(object):
+    """
+    Posts pre-built data-stream payloads to EnviroDIY over a pooled session with a bounded number of workers.
+    """
+
+    def __init__(self, url=data_stream_url, max_workers=8, per_token_concurrency=2, per_token_rate=None,
+                 connect_timeout=10, read_timeout=60, max_attempts=5, backoff_base=1.0, backoff_max=60.0,
+                 debug=False):
+        """
+        :param url: The data-stream endpoint to post to
+        :param max_workers: The total number of posts that may be in flight at once
+        :param per_token_concurrency: The number of posts that may be in flight at once for any single token
+        :param per_token_rate: The maximum number of requests per second for any single token, None for no limit
+        :param connect_timeout: Seconds to wait to open a connection
+        :param read_timeout: Seconds to wait for a response once connected
+        :param max_attempts: The number of times to try each post before giving up on it
+        :param backoff_base: Seconds to wait before the first retry; the wait doubles for each retry after that
+        :param backoff_max: The longest to wait between any two attempts
+        :param debug: A boolean for whether extra print commands apply
+        """
+        self.url = url
+        self.max_workers = max(1, int(max_workers))
+        self.per_token_concurrency = max(1, int(per_token_concurrency))
+        self.per_token_rate = per_token_rate
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_attempts = max(1, int(max_attempts))
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.debug = debug
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json', 'Connection': 'keep-alive'})
+
+        self._rate_limiters = {}
+        self._condition = threading.Condition()
+        self._print_lock = threading.Lock()
+
+    def close(self):
+        self.session.close()
+
+    def _rate_limiter(self, token):
+        with self._condition:
+            if token not in self._rate_limiters:
+                self._rate_limiters[token] = TokenRateLimiter(self.per_token_rate)
+            return self._rate_limiters[token]
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                retry_seconds = float(retry_after)
+            except ValueError:
+                retry_seconds = None
+            # A negative, infinite or nan Retry-After can't be slept on, so back off as if there were none
+            if retry_seconds is not None and math.isfinite(retry_seconds):
+                return min(max(0.0, retry_seconds), self.backoff_max)
+        wait = min(self.backoff_base * (2 ** (attempt - 1)), self.backoff_max)
+        # Add some jitter so workers that failed together don't all retry together
+        return wait * random.uniform(0.5, 1.0)
+
+    def post(self, token, body):
+        """
+        Posts a single payload, retrying connection errors, rate limiting and server errors with exponential backoff
+        up to max_attempts times.
+        :param token: The EnviroDIY registration token for the site
+        :param body: The JSON payload
+        :return: A tuple of the last status code (0 if the portal could never be reached), the last response text
+            (or error) and the number of attempts made
+        """
+        rate_limiter = self._rate_limiter(token)
+        status_code = 0
+        response_text = ''
+        for attempt in range(1, self.max_attempts + 1):
+            rate_limiter.wait()
+            retry_after = None
+            try:
+                response = self.session.post(self.url, headers={"TOKEN": token}, data=body, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                status_code = 0
+                response_text = '{}'.format(e)
+            else:
+                status_code = response.status_code
+                response_text = response.text if status_code > 205 else ''
+                if status_code not in retryable_status_codes:
+                    return status_code, response_text, attempt
+                retry_after = response.headers.get('Retry-After')
+            if attempt < self.max_attempts:
+                wait = self._backoff(attempt, retry_after)
+                if self.debug:
+                    with self._print_lock:
+                        print("Post failed ({}), waiting {:.1f} seconds to retry...".format(
+                            status_code if status_code > 0 else response_text, wait))
+                time.sleep(wait)
+        return status_code, response_text, self.max_attempts
+
+    def _post_lane(self, lane, payloads, results):
+        for position in lane:
+            payload = payloads[position]
+            post_start = time.monotonic()
+            status_code, response_text, attempts = self.post(payload['EnviroDIYToken'], payload['payload'])
+            results['seconds'][position] = time.monotonic() - post_start
+            results['status_code'][position] = status_code
+            results['response_text'][position] = response_text
+            results['attempts'][position] = attempts
+            if self.debug:
+                with self._print_lock:
+                    print(payload['TableName'], "-", payload['timestamp'], "-", status_code)
+                    if status_code > 205 or status_code == 0:
+                        print("    ", response_text)
+
+    def _worker(self, lanes_by_token, in_flight, payloads, results):
+        while True:
+            with self._condition:
+                lane = None
+                while lane is None:
+                    if not any(lanes_by_token.values()):
+                        return
+                    # Take the next lane from the first token (in round-robin order) that has room for another post
+                    for _ in range(len(lanes_by_token)):
+                        token, token_lanes = next(iter(lanes_by_token.items()))
+                        lanes_by_token.move_to_end(token)
+                        if token_lanes and in_flight[token] < self.per_token_concurrency:
+                            lane = token_lanes.popleft()
+                            in_flight[token] += 1
+                            break
+                    else:
+                        self._condition.wait()
+            try:
+                self._post_lane(lane, payloads, results)
+            finally:
+                with self._condition:
+                    in_flight[token] -= 1
+                    self._condition.notify_all()
+
+    def upload(self, payload_table):
+        """
+        Posts every payload in a table built by diy_utils.build_data_stream_payloads.
+        :param payload_table: A pandas data frame with the columns EnviroDIYToken, SamplingFeatureGUID, TableName,
+            timestamp and payload, in timestamp order within each sampling feature
+        :return: A pandas data frame aligned to payload_table's index with the last response status_code for each
+            payload (0 if the portal could never be reached), the response_text for any that were not accepted, the
+            number of attempts made and the seconds spent on the post (including any retries)
+        """
+        payloads = payload_table.loc[:, ['EnviroDIYToken', 'SamplingFeatureGUID',
+                                         'TableName', 'timestamp', 'payload']].to_dict('records')
+        results = {'status_code': np.zeros(len(payloads), dtype='int64'),
+                   'response_text': np.full(len(payloads), '', dtype=object),
+                   'attempts': np.zeros(len(payloads), dtype='int64'),
+                   'seconds': np.zeros(len(payloads), dtype='float64')}
+
+        # Each sampling feature is one lane, posted in order; lanes are queued up under their token
+        lanes_by_token = collections.OrderedDict()
+        lanes = collections.OrderedDict()
+        for position, payload in enumerate(payloads):
+            lane_key = (payload['EnviroDIYToken'], payload['SamplingFeatureGUID'])
+            if lane_key not in lanes:
+                lanes[lane_key] = []
+                lanes_by_token.setdefault(payload['EnviroDIYToken'], collections.deque()).append(lanes[lane_key])
+            lanes[lane_key].append(position)
+        in_flight = collections.Counter()
+
+        num_workers = min(self.max_workers, max(1, len(lanes)))
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            workers = [executor.submit(self._worker, lanes_by_token, in_flight, payloads, results)
+                       for _ in range(num_workers)]
+            for worker in workers:
+                worker.result()
+
+        return pd.DataFrame(results, index=payload_table.index)
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+Utilities for sending data from DreamHost to the EnviroDIY data portal.
+"""
+
+import json
+import datetime
+import numpy as np
+import pandas as pd
+
+__author__ = 'Sara Geleskie Damiano'
+__contact__ = 'sdamiano@stroudcenter.org'
+
+
+def _format_iso_timestamps_in(timestamps, timezone):
+    if timezone is None:
+        return pd.to_datetime(timestamps).dt.strftime('%Y-%m-%dT%H:%M:%S')
+    local_timestamps = pd.to_datetime(timestamps, utc=True).dt.tz_convert(timezone)
+    iso_strings = local_timestamps.dt.strftime('%Y-%m-%dT%H:%M:%S%z')
+    # strftime gives the offset as +HHMM, isoformat gives +HH:MM
+    return iso_strings.str[:-2] + ':' + iso_strings.str[-2:]
+
+
+def format_iso_timestamps(timestamps):
+    """
+    A vectorized version of calling isoformat() on every timestamp in a column.  The timestamps can be in different
+    timezones, like the data of series with different SeriesTimeZones; each timezone's rows are formatted together as
+    a whole column, keeping the offset of their own timezone.
+    :param timestamps: A pandas series of timezone aware timestamps
+    :return: A pandas series of ISO 8601 strings with a "+HH:MM" offset, matching datetime.isoformat()
+    """
+    if len(timestamps.index) == 0:
+        return pd.Series([], index=timestamps.index, dtype=object)
+    if isinstance(timestamps.dtype, pd.DatetimeTZDtype):
+        return _format_iso_timestamps_in(timestamps, timestamps.dt.tz)
+    timezones = timestamps.map(lambda timestamp: getattr(timestamp, 'tzinfo', None))
+    # Group by the name of each timezone, so naive timestamps (None) get a group of their own
+    timezone_names = timezones.map(str)
+    iso_strings = np.empty(len(timestamps.index), dtype=object)
+    for _, positions in timezone_names.groupby(timezone_names, sort=False).indices.items():
+        iso_strings[positions] = _format_iso_timestamps_in(timestamps.iloc[positions],
+                                                           timezones.iloc[positions[0]]).values
+    return pd.Series(iso_strings, index=timestamps.index)
+
+
+def _serialize_wide_payloads(wide):
+    """
+    Serializes a wide data frame of payloads (one row per timestamp) into JSON strings.  Complete rows are encoded in
+    bulk by pandas' C JSON encoder; only the rows missing a value need to drop their empty keys one at a time.
+    :param wide: A data frame with the sampling_feature and timestamp columns followed by one column per
+        TimeSeriesGUID
+    :return: A list of JSON strings, in the same order as the rows
+    """
+    payloads = np.empty(len(wide.index), dtype=object)
+    complete = wide.notna().all(axis=1).values
+    if complete.any():
+        payloads[complete] = wide[complete].to_json(orient='records', lines=True,
+                                                    double_precision=15).splitlines()
+    if not complete.all():
+        payloads[~complete] = [json.dumps({key: value for key, value in record.items() if pd.notna(value)},
+                                          separators=(',', ':'))
+                               for record in wide[~complete].to_dict('records')]
+    return list(payloads)
+
+
+def build_data_stream_payloads(data_table, debug=False):
+    """
+    Builds all of the JSON bodies for posting to the EnviroDIY /api/data-stream/ endpoint.  Each sampling feature's
+    data is pivoted into a wide matrix of timestamps by TimeSeriesGUID and all of its payloads are serialized at once,
+    rather than building a string for every timestamp.
+    :param data_table: A pandas data frame with the columns EnviroDIYToken, SamplingFeatureGUID, TimeSeriesGUID,
+        TableName, SiteCode, timestamp and data_value
+    :param debug: A boolean for whether extra print commands apply
+    :return: A tuple of:
+        - A pandas data frame with one row per payload and the columns EnviroDIYToken, SamplingFeatureGUID, TableName,
+          SiteCode, timestamp, num_values and payload; the payloads are in timestamp order within each sampling
+          feature.
+        - A pandas series aligned to the index of data_table giving the row number of the payload each data value
+          was sent in.
+    """
+    t1 = datetime.datetime.now()
+
+    keyed = data_table.loc[:, ['EnviroDIYToken', 'SamplingFeatureGUID', 'TimeSeriesGUID',
+                               'TableName', 'SiteCode', 'timestamp', 'data_value']]
+    keyed['utc_timestamp'] = pd.to_datetime(keyed['timestamp'], utc=True)
+    keyed['iso_timestamp'] = format_iso_timestamps(keyed['timestamp'])
+    keyed['row_number'] = np.arange(len(keyed.index))
+
+    row_payload = np.full(len(keyed.index), -1, dtype='int64')
+    payload_frames = []
+    num_payloads = 0
+
+    for (token, sampling_feature), group in keyed.groupby(['EnviroDIYToken', 'SamplingFeatureGUID'], sort=True):
+        # One row per timestamp, one column per time series - a series only reports once per timestamp
+        by_series = group.set_index(['utc_timestamp', 'iso_timestamp', 'TimeSeriesGUID'])['data_value']
+        by_series = by_series[~by_series.index.duplicated(keep='first')]
+        wide = by_series.unstack('TimeSeriesGUID').sort_index()
+
+        row_payload[group['row_number'].values] = num_payloads + wide.index.get_indexer(
+            pd.MultiIndex.from_arrays([group['utc_timestamp'], group['iso_timestamp']]))
+
+        num_values = wide.notna().sum(axis=1).values
+        iso_timestamps = wide.index.get_level_values('iso_timestamp')
+        wide = wide.reset_index(drop=True)
+        wide.columns = wide.columns.astype(str)
+        wide.insert(0, 'timestamp', iso_timestamps)
+        wide.insert(0, 'sampling_feature', sampling_feature)
+
+        payload_frames.append(pd.DataFrame({'EnviroDIYToken': token,
+                                            'SamplingFeatureGUID': sampling_feature,
+                                            'TableName': group['TableName'].iloc[0],
+                                            'SiteCode': group['SiteCode'].iloc[0],
+                                            'timestamp': iso_timestamps,
+                                            'num_values': num_values,
+                                            'payload': _serialize_wide_payloads(wide)}))
+        num_payloads += len(wide.index)
+
+    if len(payload_frames) > 0:
+        payloads = pd.concat(payload_frames, ignore_index=True)
+    else:
+        payloads = pd.DataFrame(columns=['EnviroDIYToken', 'SamplingFeatureGUID', 'TableName', 'SiteCode',
+                                         'timestamp', 'num_values', 'payload'])
+
+    t2 = datetime.datetime.now()
+    build_seconds = (t2 - t1).total_seconds()
+    if debug:
+        print("Built {} payloads from {} values in {} ({:.0f} payloads/sec)".format(
+            len(payloads.index), len(keyed.index), (t2 - t1),
+            len(payloads.index) / build_seconds if build_seconds > 0 else float('inf')))
+
+    return payloads, pd.Series(row_payload, index=data_table.index)
+
+
+def summarize_appends(data_table, payload_successful, row_payload):
+    """
+    Summarizes the results of posting to EnviroDIY for each sampling feature in a single aggregation.
+    :param data_table: The data frame the payloads were built from, with the columns EnviroDIYToken,
+        SamplingFeatureGUID, SiteCode, TableName, server_offset and time_correction
+    :param payload_successful: A boolean array with whether each payload was accepted, in payload order
+    :param row_payload: The series returned by build_data_stream_payloads giving the payload each value was sent in
+    :return: A pandas data frame with one row per EnviroDIYToken and SamplingFeatureGUID and the columns SiteCode,
+        TableName, NumberSuccessfulAppends, NumberFailedAppends, MaxServerOffset and MaxTimeCorrection
+    """
+    # Values that didn't make it into any payload (row_payload of -1) pick up the extra False on the end
+    value_successful = np.append(np.asarray(payload_successful, dtype=bool), False)[row_payload.values]
+
+    summary = data_table.assign(AppendSuccessful=value_successful.astype('int64')).groupby(
+        ['EnviroDIYToken', 'SamplingFeatureGUID']).agg(
+        SiteCode=('SiteCode', 'first'),
+        TableName=('TableName', 'first'),
+        NumberSuccessfulAppends=('AppendSuccessful', 'sum'),
+        NumberAppends=('AppendSuccessful', 'size'),
+        MaxServerOffset=('server_offset', 'max'),
+        MaxTimeCorrection=('time_correction', 'max'))
+    summary['NumberFailedAppends'] = summary['NumberAppends'] - summary['NumberSuccessfulAppends']
+
+    return summary.drop(columns='NumberAppends').reset_index()
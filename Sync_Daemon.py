@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+
+"""
+@author: Sara Geleskie Damiano
+
+This script keeps running and does the work of the scheduled sync scripts itself: appending from DreamHost to
+Aquarius, posting from DreamHost to the EnviroDIY data portal, cleaning the Aquarius append log and filling in the
+series end dates on DreamHost, each on its own interval.
+Because it stays up between runs, the Aquarius SOAP client, its authentication token, its pooled connections and the
+timezone of every time series, and the EnviroDIY upload session, are all set up once and kept warm for every later
+run, instead of being built again by every scheduled start of a script.
+A run of a job is never started while the last run of the same job is still going; it is skipped until the next
+interval.  Each append or post run first replays what earlier runs left unfinished (the Aquarius append journal and
+the EnviroDIY dead-letter queue), so an outage longer than the hours each run looks back over doesn't lose data.
+Ctrl+C (or SIGTERM) stops new runs from starting and waits for the running ones to finish.
+The metrics of every stage of every run can be appended to a JSON lines file, and the running totals since the daemon
+started written to a Prometheus text file after each run or served for Prometheus to scrape.
+"""
+
+import os
+import sys
+import time
+import signal
+import datetime
+import argparse
+import threading
+import traceback
+
+# CleanAppendLog imports its neighbours in the Aquarius directory directly
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'Aquarius'))
+
+import Dreamhost_to_Aquarius
+import Dreamhost_to_EnviroDIY
+import Aquarius.CleanAppendLog as CleanAppendLog
+import DreamHost.UpdateEndDates as UpdateEndDates
+import DreamHost.dh_metrics as dh_metrics
+import EnviroDIY.diy_uploader as diy_uploader
+
+__author__ = 'Sara Geleskie Damiano'
+__contact__ = 'sdamiano@stroudcenter.org'
+
+
+# Set up a parser for command line options
+parser = argparse.ArgumentParser(
+    description='This script runs the DreamHost, Aquarius and EnviroDIY sync jobs on a schedule.')
+parser.add_argument('--debug', action='store_true',
+                    help='Turn debugging on')
+parser.add_argument('--nolog', action='store_false',
+                    help='Turn logging off')
+parser.add_argument('--aquarius', action='store', type=float, default=15,
+                    help='Sets the minutes between appends to Aquarius, 0 to not append')
+parser.add_argument('--envirodiy', action='store', type=float, default=5,
+                    help='Sets the minutes between posts to EnviroDIY, 0 to not post')
+parser.add_argument('--cleanlog', action='store', type=float, default=60,
+                    help='Sets the minutes between clean-ups of the Aquarius append log, 0 to not clean it')
+parser.add_argument('--enddates', action='store', type=float, default=1440,
+                    help='Sets the minutes between updates of the DreamHost series end dates, 0 to not update them')
+parser.add_argument('--hours', action='store', type=int, default=2,
+                    help='Sets number of hours in the past to append or post on each run')
+parser.add_argument('--chunksize', action='store', type=int, default=None,
+                    help='Sets the maximum number of points in a single append to Aquarius')
+parser.add_argument('--gzip', action='store_true',
+                    help='Gzips the requests sent to Aquarius')
+parser.add_argument('--workers', action='store', type=int, default=8,
+                    help='Sets the total number of posts to EnviroDIY that may be in flight at once')
+parser.add_argument('--tokenworkers', action='store', type=int, default=2,
+                    help='Sets the number of posts that may be in flight at once for a single EnviroDIY token')
+parser.add_argument('--tokenrate', action='store', type=float, default=None,
+                    help='Sets the maximum requests per second for a single EnviroDIY token')
+parser.add_argument('--attempts', action='store', type=int, default=5,
+                    help='Sets the number of times to try each post before putting it in the dead-letter queue')
+parser.add_argument('--timebudget', action='store', type=float, default=600,
+                    help='Sets the number of seconds each clean-up of the append log may run for')
+parser.add_argument('--whenneeded', action='store_true',
+                    help='Only clean up the append log if it is bigger or growing faster than its limits')
+parser.add_argument('--noreplay', action='store_false',
+                    help='Turn off replaying the append journal and dead-letter queue at the start of each run')
+parser.add_argument('--maxrows', action='store', type=int, default=None,
+                    help='Sets the number of rows in the append log above which it is cleaned up')
+parser.add_argument('--maxgrowth', action='store', type=float, default=None,
+                    help='Sets the growth of the append log, in rows per hour, above which it is cleaned up')
+parser.add_argument('--metrics', action='store', default=None,
+                    help='Appends the metrics of each run to this JSON lines file')
+parser.add_argument('--prometheus', action='store', default=None,
+                    help='Rewrites this Prometheus text file with the metrics since the daemon started after each run')
+parser.add_argument('--metricsport', action='store', type=int, default=None,
+                    help='Serves the metrics since the daemon started for Prometheus to scrape on this port')
+parser.add_argument('--shutdowntimeout', action='store', type=float, default=None,
+                    help='Sets the number of seconds to wait for running jobs when stopping, by default until done')
+
+
+# Jobs finishing at the same time take turns writing the metrics files
+metrics_write_lock = threading.Lock()
+
+
+def log(message):
+    print("{} {}".format(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), message))
+    sys.stdout.flush()
+
+
+def metered_job(name, function, all_metrics, metrics_file=None, prometheus_file=None):
+    """
+    Wraps a job so each run records its stages in metrics of its own, which are then added to the daemon's totals and
+    written out, even if the run fails.
+    :param name: The name of the job, which is the pipeline label of its metrics
+    :param function: The function to call, with the run's PipelineMetrics
+    :param all_metrics: The PipelineMetrics totalling every run of every job
+    :param metrics_file: A JSON lines file to append the metrics of each run to, or None
+    :param prometheus_file: A Prometheus text file to rewrite with the totals after each run, or None
+    :return: A function with no arguments for the ScheduledJob
+    """
+
+    def run():
+        run_metrics = dh_metrics.PipelineMetrics(name)
+        try:
+            with run_metrics.timed('run'):
+                function(run_metrics)
+        finally:
+            all_metrics.merge(run_metrics)
+            with metrics_write_lock:
+                if metrics_file is not None:
+                    run_metrics.write_json_lines(metrics_file)
+                if prometheus_file is not None:
+                    all_metrics.write_prometheus(prometheus_file)
+
+    return run
+
+
+class ScheduledJob(object):
+    """
+    A function run every so many minutes in its own thread, never twice at once.
+    """
+
+    def __init__(self, name, function, interval_minutes):
+        """
+        :param name: The name of the job, for the log
+        :param function: The function to call, with no arguments
+        :param interval_minutes: The minutes from the start of one run to the start of the next
+        """
+        self.name = name
+        self.function = function
+        self.interval_seconds = interval_minutes * 60
+        # Every job runs once as soon as the daemon starts
+        self.next_run = time.monotonic()
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self._running = threading.Lock()
+        self._thread = None
+
+    def start_if_due(self, now):
+        """
+        Starts a run if one is due, or skips it if the last run hasn't finished.
+        :return: True if a run was started
+        """
+        if now < self.next_run:
+            return False
+        # Runs that were missed while the machine was asleep, or the last run was going, aren't made up
+        self.next_run += self.interval_seconds
+        if self.next_run <= now:
+            self.next_run = now + self.interval_seconds
+        if not self._running.acquire(blocking=False):
+            self.skipped += 1
+            log("{} is still running from the last interval, skipping this run".format(self.name))
+            return False
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        return True
+
+    def _run(self):
+        started = time.monotonic()
+        log("Starting {}".format(self.name))
+        try:
+            self.function()
+        except (Exception, SystemExit):
+            # Some of the scripts' helpers still call sys.exit when they give up; that ends the run, not the daemon
+            self.failures += 1
+            log("{} failed:\n{}".format(self.name, traceback.format_exc()))
+        else:
+            log("{} finished in {:.1f} seconds".format(self.name, time.monotonic() - started))
+        finally:
+            self.runs += 1
+            self._running.release()
+
+    def is_running(self):
+        return self._running.locked()
+
+    def join(self, timeout=None):
+        """
+        Waits for a running run to finish.
+        :return: True if the job isn't running any more
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return not self.is_running()
+
+
+def run_scheduler(jobs, shutdown):
+    """
+    Starts each job whenever it is due until shutdown is set, sleeping until the next one is.
+    :param jobs: The ScheduledJobs to run
+    :param shutdown: A threading.Event which is set to stop starting new runs
+    """
+    while not shutdown.is_set():
+        now = time.monotonic()
+        for job in jobs:
+            job.start_if_due(now)
+        shutdown.wait(max(0, min(job.next_run for job in jobs) - time.monotonic()))
+
+
+def stop_jobs(jobs, timeout=None):
+    """
+    Waits for the running jobs to finish, up to timeout seconds altogether.
+    :return: The names of the jobs still running
+    """
+    give_up_at = None if timeout is None else time.monotonic() + timeout
+    for job in jobs:
+        if job.is_running():
+            log("Waiting for {} to finish".format(job.name))
+        job.join(None if give_up_at is None else max(0, give_up_at - time.monotonic()))
+    return [job.name for job in jobs if job.is_running()]
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    # Without a limit the clean-up would run every interval anyway
+    if args.whenneeded and args.maxrows is None and args.maxgrowth is None:
+        parser.error("--whenneeded needs --maxrows or --maxgrowth")
+
+    # The EnviroDIY session is kept open between runs, so its connections are reused
+    uploader = diy_uploader.DataStreamUploader(max_workers=args.workers, per_token_concurrency=args.tokenworkers,
+                                               per_token_rate=args.tokenrate, max_attempts=args.attempts,
+                                               debug=args.debug)
+
+    # The totals of every run of every job since the daemon started
+    all_metrics = dh_metrics.PipelineMetrics('sync_daemon')
+    metrics_server = None
+    if args.metricsport is not None:
+        metrics_server = dh_metrics.serve_prometheus(all_metrics, args.metricsport)
+        log("Serving metrics on port {}".format(args.metricsport))
+
+    # Each job's function is called with the metrics of the run
+    job_functions = []
+    if args.aquarius > 0:
+        job_functions.append((
+            'Dreamhost_to_Aquarius',
+            lambda run_metrics: Dreamhost_to_Aquarius.run_append(
+                past_hours_to_append=args.hours, resume_first=args.noreplay, chunk_size=args.chunksize,
+                compress_requests=args.gzip, debug=args.debug, Log_to_file=args.nolog, metrics=run_metrics),
+            args.aquarius))
+    if args.envirodiy > 0:
+        job_functions.append((
+            'Dreamhost_to_EnviroDIY',
+            lambda run_metrics: Dreamhost_to_EnviroDIY.run_upload(
+                past_hours_to_append=args.hours, replay_first=args.noreplay, uploader=uploader, debug=args.debug,
+                Log_to_file=args.nolog, metrics=run_metrics),
+            args.envirodiy))
+    if args.cleanlog > 0:
+        job_functions.append((
+            'CleanAppendLog',
+            lambda run_metrics: CleanAppendLog.clean_append_log(
+                time_budget=args.timebudget, only_when_needed=args.whenneeded, max_rows=args.maxrows,
+                max_growth=args.maxgrowth, debug=args.debug, Log_to_file=args.nolog),
+            args.cleanlog))
+    if args.enddates > 0:
+        job_functions.append((
+            'UpdateEndDates',
+            lambda run_metrics: UpdateEndDates.update_end_dates(debug=args.debug),
+            args.enddates))
+    if not job_functions:
+        sys.exit("Every job is turned off")
+    job_list = [ScheduledJob(name, metered_job(name, function, all_metrics, args.metrics, args.prometheus), interval)
+                for name, function, interval in job_functions]
+
+    shutdown_event = threading.Event()
+
+    def request_shutdown(signal_number, frame):
+        log("Stopping: no new runs will be started")
+        shutdown_event.set()
+
+    signal.signal(signal.SIGINT, request_shutdown)
+    signal.signal(signal.SIGTERM, request_shutdown)
+
+    log("Running {}".format(", ".join("{} every {:g} minutes".format(job.name, job.interval_seconds / 60)
+                                      for job in job_list)))
+    run_scheduler(job_list, shutdown_event)
+
+    StillRunning = stop_jobs(job_list, args.shutdowntimeout)
+    if not StillRunning:
+        uploader.close()
+    if metrics_server is not None:
+        metrics_server.shutdown()
+    for job in job_list:
+        log("{}: {} runs, {} failed, {} skipped".format(job.name, job.runs, job.failures, job.skipped))
+    if StillRunning:
+        sys.exit("Stopped without waiting for {}".format(", ".join(StillRunning)))